@@ -0,0 +1,108 @@
+"""
+Micro-benchmark of per-page address translation.
+
+It times page_to_block_off(), block_to_page_range(), lpn_to_m_vpn() and
+the flash address of a page (Controller.physical_to_machine_page()) per
+call, through the methods of the dftldes Config, which look up
+conf['flash_config'] on every call, and through the FlashGeometry of the
+config (conf.geometry()). The flash address is compared with the loop over
+the page hierarchy it replaced.
+
+Usage: python -m benchmarks.address_translation [n_pages_per_block]
+"""
+import sys
+import timeit
+
+from utilities import utils
+from wiscsim.dftldes import Config
+
+
+N_PAGES = 10000
+N_REPEATS = 5
+
+
+def create_config(n_pages_per_block):
+    conf = Config()
+
+    conf['flash_config']['n_pages_per_block'] = n_pages_per_block
+    conf['flash_config']['n_blocks_per_plane'] = 1000
+    conf['flash_config']['n_planes_per_chip'] = 1
+    conf['flash_config']['n_chips_per_package'] = 1
+    conf['flash_config']['n_packages_per_channel'] = 1
+    conf['flash_config']['n_channels_per_dev'] = 16
+
+    utils.set_exp_metadata(conf, save_data = False,
+            expname = 'bench_expname',
+            subexpname = 'bench_subexpname')
+    utils.runtime_update(conf)
+
+    return conf
+
+
+def hierarchy_location(page_hierarchy, page_no):
+    "The loop of physical_to_machine_page() before FlashGeometry"
+    location = [0] * (len(page_hierarchy) + 1)
+    for i, count in enumerate(page_hierarchy):
+        location[i] = page_no / count
+        page_no = page_no % count
+    location[-1] = page_no
+    return location
+
+
+def translations(conf, geometry):
+    """
+    Return [(name, old func, new func)]. Each func translates all pages.
+    """
+    n_pages_per_block = geometry.n_pages_per_block
+    pages = range(0, geometry.n_pages_per_dev,
+            max(1, geometry.n_pages_per_dev / N_PAGES))
+    blocks = [page / n_pages_per_block for page in pages]
+    page_hierarchy = list(geometry.page_hierarchy)
+
+    return [
+        ('page_to_block_off',
+            lambda: [conf.page_to_block_off(page) for page in pages],
+            lambda: [geometry.page_to_block_off(page) for page in pages]),
+        ('block_to_page_range',
+            lambda: [conf.block_to_page_range(block) for block in blocks],
+            lambda: [geometry.block_to_page_range(block) for block in blocks]),
+        ('lpn_to_m_vpn',
+            lambda: [conf.lpn_to_m_vpn(page) for page in pages],
+            lambda: [geometry.lpn_to_m_vpn(page) for page in pages]),
+        ('page_to_location',
+            lambda: [hierarchy_location(page_hierarchy, page)
+                for page in pages],
+            lambda: [geometry.page_to_location(page) for page in pages]),
+        ], len(pages)
+
+
+def time_per_call(func, n_calls):
+    seconds = min(timeit.repeat(func, number=1, repeat=N_REPEATS))
+    return seconds / n_calls * 1e9
+
+
+def main(n_pages_per_block=256):
+    conf = create_config(n_pages_per_block)
+    geometry = conf.geometry()
+
+    funcs, n_calls = translations(conf, geometry)
+    table = []
+    for name, old_func, new_func in funcs:
+        assert old_func() == new_func(), name
+        old_nsec = time_per_call(old_func, n_calls)
+        new_nsec = time_per_call(new_func, n_calls)
+        table.append({'translation': name,
+                      'n_pages_per_block': n_pages_per_block,
+                      'config_nsec': round(old_nsec, 1),
+                      'geometry_nsec': round(new_nsec, 1),
+                      'speedup': round(old_nsec / new_nsec, 2)})
+
+    print utils.table_to_str(table)
+    return table
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(n_pages_per_block=int(sys.argv[1]))
+    else:
+        main()
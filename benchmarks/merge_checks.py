@@ -0,0 +1,251 @@
+"""
+Micro-benchmark of the merge decisions of the nkftl2 garbage collector.
+
+It fills log blocks with switch mergable, partial mergable and mixed
+pages, and times is_switch_mergable(), is_partial_mergable() and finding
+the logical blocks of a full merge, per log block. The block-scoped checks
+(OutOfBandAreas.block_pages()) are compared with the per-page checks they
+replaced, which are kept below as PerPageChecks.
+
+Usage: python -m benchmarks.merge_checks [n_pages_per_block]
+"""
+import random
+import sys
+import timeit
+
+import simpy
+
+import wiscsim
+from utilities import utils
+from wiscsim.ftlsim_commons import LockPool
+from wiscsim.nkftl2 import (Config, DataBlockMappingTable, GarbageCollector,
+        GlobalHelper, LogMappingTable, NKBlockPool, OutOfBandAreas,
+        Translator)
+
+
+N_REPEATS = 5
+
+
+def create_config(n_pages_per_block):
+    conf = Config()
+
+    conf['flash_config']['n_pages_per_block'] = n_pages_per_block
+    conf['flash_config']['n_blocks_per_plane'] = 64
+    conf['flash_config']['n_planes_per_chip'] = 1
+    conf['flash_config']['n_chips_per_package'] = 1
+    conf['flash_config']['n_packages_per_channel'] = 1
+    conf['flash_config']['n_channels_per_dev'] = 4
+
+    conf['nkftl']['max_blocks_in_log_group'] = 16
+    conf['nkftl']['n_blocks_in_data_group'] = 4
+
+    utils.set_exp_metadata(conf, save_data = False,
+            expname = 'bench_expname',
+            subexpname = 'bench_subexpname')
+    utils.runtime_update(conf)
+
+    return conf
+
+
+def create_gc(conf):
+    rec = wiscsim.recorder.Recorder(output_target = conf['output_target'],
+        output_directory = conf['result_dir'],
+        verbose_level = conf['verbose_level'],
+        print_when_finished = conf['print_when_finished'])
+    rec.disable()
+
+    block_pool = NKBlockPool(
+            n_channels=conf.n_channels_per_dev,
+            n_blocks_per_channel=conf.n_blocks_per_channel,
+            n_pages_per_block=conf.n_pages_per_block,
+            tags=['TDATA', 'TLOG'])
+    oob = OutOfBandAreas(conf)
+    helper = GlobalHelper(conf)
+    logmaptable = LogMappingTable(conf, block_pool, rec, helper)
+    datablocktable = DataBlockMappingTable(conf, rec, helper)
+    translator = Translator(conf, rec, helper, logmaptable, datablocktable)
+    env = simpy.Environment()
+    des_flash = wiscsim.controller.Controller3(env, conf, rec)
+
+    return GarbageCollector(conf, block_pool,
+            wiscsim.flash.SimpleFlash(recorder=rec, confobj=conf), oob, rec,
+            translator, helper, logmaptable, datablocktable, env, des_flash,
+            LockPool(env))
+
+
+def fill_log_blocks(gc, n_blocks_per_kind):
+    """
+    Return log blocks of three kinds: fully written in logical order
+    (switch mergable), half written in logical order (partial mergable)
+    and fully written with random LPNs of the data group (full merge).
+    """
+    conf = gc.conf
+    n = conf.n_pages_per_block
+    n_blocks_in_data_group = conf['nkftl']['n_blocks_in_data_group']
+    rand = random.Random(1)
+
+    blocks = []
+    for kind in range(3):
+        for i in range(n_blocks_per_kind):
+            dgn = kind * n_blocks_per_kind + i
+            lbn = dgn * n_blocks_in_data_group
+            n_pages = n / 2 if kind == 1 else n
+            ppns = gc.log_mapping_table.next_ppns_to_program(dgn=dgn,
+                    n=n_pages, strip_unit_size='infinity')
+            if kind == 2:
+                lpns = [lbn * n + rand.randint(0, n_blocks_in_data_group * n - 1)
+                        for _ in ppns]
+            else:
+                lpns = [lbn * n + off for off in range(n_pages)]
+            for lpn, ppn in zip(lpns, ppns):
+                found, old_ppn, _ = gc.translator.lpn_to_ppn(lpn)
+                if found is False or not gc.oob.states.is_page_valid(old_ppn):
+                    old_ppn = None
+                gc.oob.remap(lpn=lpn, old_ppn=old_ppn, new_ppn=ppn)
+                gc.log_mapping_table.add_mapping(lpn=lpn, ppn=ppn)
+            blocks.append(conf.page_to_block_off(ppns[0])[0])
+
+    return blocks
+
+
+class PerPageChecks(object):
+    """
+    The merge checks as they were before block_pages(), one bitmap slice
+    and one ppn_to_lpn lookup per page.
+    """
+    def __init__(self, gc):
+        self.gc = gc
+        self.conf = gc.conf
+        self.oob = gc.oob
+
+    def is_switch_mergable(self, log_pbn):
+        gc = self.gc
+        ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
+        if not log_pbn in gc.block_pool.log_usedblocks:
+            return False, None
+
+        logical_blocks = set()
+        for ppn in range(ppn_start, ppn_end):
+            if self.oob.states.is_page_valid(ppn) is True:
+                lpn = self.oob.ppn_to_lpn[ppn]
+                logical_block, logical_off = self.conf.page_to_block_off(lpn)
+                _, physical_off = self.conf.page_to_block_off(ppn)
+                if logical_off != physical_off:
+                    return False, None
+                logical_blocks.add(logical_block)
+
+        if len(logical_blocks) != 1:
+            return False, None
+
+        logical_block = logical_blocks.pop()
+        for ppn in range(ppn_start, ppn_end):
+            if self.oob.states.is_page_valid(ppn) is False:
+                _, physical_off = self.conf.page_to_block_off(ppn)
+                lpn = self.conf.block_off_to_page(logical_block, physical_off)
+                found, _ = gc.log_mapping_table.lpn_to_ppn(lpn)
+                if found is True:
+                    return False, None
+                found, _ = gc.data_block_mapping_table.lpn_to_ppn(lpn)
+                if found is True:
+                    return False, None
+
+        return True, logical_block
+
+    def is_partial_mergable(self, log_pbn):
+        ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
+        if not log_pbn in self.gc.block_pool.log_usedblocks:
+            return False, None, None
+
+        last_valid_ppn = None
+        for ppn in range(ppn_start, ppn_end):
+            if self.oob.states.is_page_valid(ppn):
+                last_valid_ppn = ppn
+            else:
+                break
+
+        if last_valid_ppn == None or last_valid_ppn == ppn_end - 1:
+            return False, None, None
+
+        for ppn in range(last_valid_ppn + 1, ppn_end):
+            if not self.oob.states.is_page_erased(ppn):
+                return False, None, None
+
+        lpn_start = self.oob.ppn_to_lpn[ppn_start]
+        logical_block, off = self.conf.page_to_block_off(lpn_start)
+        if off != 0:
+            return False, None, None
+
+        for ppn in range(ppn_start, last_valid_ppn + 1):
+            lpn = self.oob.ppn_to_lpn[ppn]
+            if lpn - lpn_start != ppn - ppn_start:
+                return False, None, None
+
+        return True, logical_block, last_valid_ppn + 1 - ppn_start
+
+    def full_merge_logical_blocks(self, log_pbn):
+        ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
+        logical_blocks = set()
+        for ppn in range(ppn_start, ppn_end):
+            if self.oob.states.is_page_valid(ppn) == True:
+                lpn = self.oob.ppn_to_lpn[ppn]
+                logical_block, _ = self.conf.page_to_block_off(lpn)
+                logical_blocks.add(logical_block)
+        return logical_blocks
+
+
+def full_merge_logical_blocks(gc, log_pbn):
+    "The same as the first part of GarbageCollector.full_merge()"
+    n_pages_per_block = gc.conf.n_pages_per_block
+    states, lpns = gc.oob.block_pages(log_pbn)
+    logical_blocks = set()
+    for off, state in enumerate(states):
+        if state == gc.oob.states.VALID_CODE:
+            logical_blocks.add(lpns[off] / n_pages_per_block)
+    return logical_blocks
+
+
+def decide(checks, full_merge_func, blocks):
+    ret = []
+    for pbn in blocks:
+        ret.append((checks.is_switch_mergable(pbn),
+                    checks.is_partial_mergable(pbn),
+                    full_merge_func(pbn)))
+    return ret
+
+
+def time_per_block(func, blocks):
+    seconds = min(timeit.repeat(func, number=1, repeat=N_REPEATS))
+    return seconds / len(blocks) * 1e6
+
+
+def main(n_pages_per_block=256, n_blocks_per_kind=16):
+    conf = create_config(n_pages_per_block)
+    gc = create_gc(conf)
+    blocks = fill_log_blocks(gc, n_blocks_per_kind)
+    per_page = PerPageChecks(gc)
+
+    new_func = lambda pbn: full_merge_logical_blocks(gc, pbn)
+    assert decide(gc, new_func, blocks) == \
+            decide(per_page, per_page.full_merge_logical_blocks, blocks)
+
+    table = []
+    for name, checks, full_merge_func in [
+            ('per-page', per_page, per_page.full_merge_logical_blocks),
+            ('block', gc, new_func)]:
+        usec = time_per_block(
+                lambda: decide(checks, full_merge_func, blocks), blocks)
+        table.append({'checks': name,
+                      'n_pages_per_block': n_pages_per_block,
+                      'usec_per_block': round(usec, 2)})
+
+    print utils.table_to_str(table)
+    print 'speedup: {:.1f}x'.format(
+            table[0]['usec_per_block'] / table[1]['usec_per_block'])
+    return table
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(n_pages_per_block=int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,391 @@
+"""
+Throughput benchmark of the simulators.
+
+Each case simulates one workload with one FTL and reports:
+
+    events_per_sec      host requests (read/write/discard) per second
+    flash_ops_per_sec   simulated flash operations per second
+    peak_rss_mb         peak RSS of the process that ran the case
+    phase_seconds       wall time of setup (building the simulator), aging,
+                        workload and gc (OP_CLEAN after the workload)
+
+SimulatorDESNew is run with dftldes and nkftl2, and SimulatorNonDESSpeed
+with ftlcounter. Workloads are AccessesWithDist (uniform, hotcold, zipf)
+after a sequential fill of the space, and the sqlite trace in tests/testdata.
+Cases run one after another, each in its own process, so peak RSS is per
+case and cases do not share warm caches.
+
+The results can be compared with a baseline (benchmarks/baseline.json by
+default). A case is a regression if its events/sec drops, or its peak RSS
+grows, by more than the tolerance. A change of the number of flash
+operations is reported too, as it means the simulated behavior changed.
+Baselines depend on the machine, so save one (--save-baseline) on the
+machine that compares against it.
+
+Usage: python -m benchmarks.simulation [--quick] [--cases SUBSTRING]
+        [--output results.json] [--baseline path] [--save-baseline]
+        [--tolerance 0.2]
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+import traceback
+
+import config
+from commons import *
+from config_helper import experiment
+from utilities import utils
+from wiscsim import hostevent
+from wiscsim.simulator import create_simulator
+from workrunner import lbaworkloadgenerator
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+TRACE_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'tests', 'testdata',
+        'sqlitewal-update',
+        'subexp-7928737328932659543-ext4-10-07-23-50-10--2726320246496492803')
+
+SIMULATORS = {'dftldes': 'SimulatorDESNew',
+              'nkftl2': 'SimulatorDESNew',
+              'ftlcounter': 'SimulatorNonDESSpeed'}
+SYNTHETIC = ('uniform', 'hotcold', 'zipf')
+HOST_OPS = (OP_READ, OP_WRITE, OP_DISCARD)
+
+AGING, WORKLOAD, GC = ('aging', 'workload', 'gc')
+
+Case = collections.namedtuple('Case', 'ftl, workload, dev_mb, ncq_depth')
+
+
+def case_name(case):
+    return '{}-{}-{}-{}MB-ncq{}'.format(SIMULATORS[case.ftl], case.ftl,
+            case.workload, case.dev_mb, case.ncq_depth)
+
+
+def all_cases():
+    cases = []
+    for ftl in ('dftldes', 'nkftl2'):
+        for workload in SYNTHETIC:
+            cases.append(Case(ftl, workload, 16, 4))
+        for ncq_depth in (1, 8):
+            cases.append(Case(ftl, 'uniform', 64, ncq_depth))
+        cases.append(Case(ftl, 'trace', 1024, 1))
+        cases.append(Case(ftl, 'trace', 1024, 4))
+        cases.append(Case(ftl, 'trace', 2048, 4))
+
+    for workload in SYNTHETIC:
+        cases.append(Case('ftlcounter', workload, 1024, 1))
+    cases.append(Case('ftlcounter', 'trace', 1024, 1))
+
+    return cases
+
+
+def quick_cases():
+    return [Case('dftldes', 'uniform', 16, 4),
+            Case('nkftl2', 'uniform', 16, 4),
+            Case('dftldes', 'trace', 1024, 4),
+            Case('ftlcounter', 'uniform', 1024, 1)]
+
+
+class BenchExperiment(experiment.Experiment):
+    def __init__(self, case):
+        para = experiment.get_shared_nolist_para_dict('bench_simulation',
+                case.dev_mb * MB)
+        para.update({
+            'ftl': case.ftl,
+            'dirty_bytes': None,
+            'over_provisioning': 1.5,
+            'n_channels_per_dev': 4,
+            'gc_high_ratio': 0.9,
+            'gc_low_ratio': 0.8,
+            'ssd_ncq_depth': case.ncq_depth,
+            'cache_mapped_data_bytes': case.dev_mb * MB / 8,
+            'segment_bytes': 1*MB,
+            'log_group_factor': 4,
+            'max_log_blocks_ratio': 0.2,
+            'do_gc_after_workload': True,
+            'write_gc_log': False,
+            'gen_ncq_depth_table': False,
+            'do_dump_lpn_sem': False,
+            })
+        Parameters = collections.namedtuple('Parameters',
+                ','.join(para.keys()))
+        super(BenchExperiment, self).__init__(Parameters(**para))
+        self.case = case
+
+    def setup_workload(self):
+        self.conf['workload_src'] = config.LBAGENERATOR
+        if self.case.workload == 'trace':
+            self.conf['lba_workload_class'] = 'BlktraceEvents'
+            self.conf['lba_workload_configs']['mkfs_event_path'] = \
+                    os.path.join(TRACE_DIR, 'blkparse-events-for-ftlsim-mkfs.txt')
+            self.conf['lba_workload_configs']['ftlsim_event_path'] = \
+                    os.path.join(TRACE_DIR, 'blkparse-events-for-ftlsim.txt')
+        else:
+            space_size = self.case.dev_mb * MB * 3 / 4
+            self.conf['lba_workload_class'] = 'AccessesWithDist'
+            self.conf['AccessesWithDist'] = {
+                    'lba_access_dist': self.case.workload,
+                    'traffic_size': 2 * space_size,
+                    'chunk_size': 64*KB,
+                    'space_size': space_size,
+                    'skew_factor': 10,
+                    'zipf_alpha': 1,
+                    }
+
+    def build(self):
+        """
+        Return the config of the case, without running it.
+        """
+        self.setup_environment()
+        self.setup_fs()
+        self.setup_workload()
+        self.setup_flash()
+        self.setup_ftl()
+        utils.set_exp_metadata(self.conf, save_data = False,
+                expname = 'bench_simulation',
+                subexpname = case_name(self.case))
+        utils.runtime_update(self.conf)
+        return self.conf
+
+
+def synthetic_events(conf):
+    """
+    Fill the space sequentially with the recorder disabled (aging), then the
+    AccessesWithDist workload, then clean with OP_CLEAN.
+    """
+    barriergen = hostevent.BarrierGen()
+    sector_size = conf['sector_size']
+    wlconf = conf['AccessesWithDist']
+
+    yield hostevent.ControlEvent(operation=OP_DISABLE_RECORDER)
+    for offset in range(0, wlconf['space_size'], wlconf['chunk_size']):
+        yield hostevent.Event(sector_size=sector_size, pid=0,
+                operation=OP_WRITE, offset=offset, size=wlconf['chunk_size'])
+    for req in barriergen.barrier_events():
+        yield req
+
+    # starts with OP_ENABLE_RECORDER
+    for req in lbaworkloadgenerator.AccessesWithDist(conf):
+        yield req
+
+    for req in barriergen.barrier_events():
+        yield req
+    yield hostevent.ControlEvent(operation=OP_REC_TIMESTAMP,
+            arg1='gc_start_timestamp')
+    yield hostevent.ControlEvent(operation=OP_CLEAN)
+
+
+class PhaseClock(object):
+    """
+    Time the phases of a run: aging until the recorder is enabled, workload
+    until gc_start_timestamp is recorded, and gc after it. The phases are
+    marked when the simulator processes these events rather than when it
+    takes them from the event iterator, since the DES host queues all
+    events at once. It also counts the host requests taken from
+    event_iter.
+    """
+    def __init__(self, event_iter):
+        self.event_iter = event_iter
+        self.seconds = collections.OrderedDict(
+                (phase, 0.0) for phase in (AGING, WORKLOAD, GC))
+        self.n_host_events = 0
+        self._phase = None
+        self._phase_start = None
+
+    def __iter__(self):
+        for event in self.event_iter:
+            if event.operation in HOST_OPS and event.action == 'D':
+                self.n_host_events += 1
+            yield event
+
+    def attach(self, recorder):
+        recorder.add_listener(self._on_recorder_action)
+
+    def _on_recorder_action(self, action, key):
+        if action == 'enable' and self._phase == AGING:
+            self.start_phase(WORKLOAD)
+        elif action == 'set_result' and key == 'gc_start_timestamp':
+            self.start_phase(GC)
+
+    def start_phase(self, phase):
+        self.stop()
+        self._phase = phase
+        self._phase_start = time.time()
+
+    def stop(self):
+        if self._phase is not None:
+            self.seconds[self._phase] += time.time() - self._phase_start
+            self._phase = None
+
+
+def run_case(case):
+    """
+    Run case in this process and return its result dict.
+    """
+    random.seed(0)
+
+    t_start = time.time()
+    conf = BenchExperiment(case).build()
+    if case.workload == 'trace':
+        event_iter = lbaworkloadgenerator.BlktraceEvents(conf)
+    else:
+        event_iter = synthetic_events(conf)
+    clock = PhaseClock(event_iter)
+    simulator = create_simulator(conf['simulator_class'], conf, iter(clock))
+    clock.attach(simulator.recorder)
+    setup_seconds = time.time() - t_start
+
+    t_run = time.time()
+    clock.start_phase(AGING)
+    simulator.run()
+    clock.stop()
+    run_seconds = time.time() - t_run
+
+    accumulator = simulator.recorder.general_accumulator
+    # ftlcounter only counts host traffic, its flash ops are 0
+    n_flash_ops = sum(accumulator.get('flash_ops', {}).values())
+
+    phase_seconds = collections.OrderedDict([('setup', setup_seconds)])
+    phase_seconds.update(clock.seconds)
+
+    return collections.OrderedDict([
+        ('case', case_name(case)),
+        ('simulator', conf['simulator_class']),
+        ('ftl', case.ftl),
+        ('workload', case.workload),
+        ('dev_mb', case.dev_mb),
+        ('ncq_depth', case.ncq_depth),
+        ('n_host_events', clock.n_host_events),
+        ('n_flash_ops', n_flash_ops),
+        ('run_seconds', run_seconds),
+        ('events_per_sec', clock.n_host_events / run_seconds),
+        ('flash_ops_per_sec', n_flash_ops / run_seconds),
+        # ru_maxrss is in KB on Linux
+        ('peak_rss_mb',
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0),
+        ('phase_seconds', phase_seconds),
+        ])
+
+
+def _run_case_in_child(case, queue):
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    sys.stdout.flush()
+    os.dup2(devnull, 1)
+    try:
+        queue.put(('ok', run_case(case)))
+    except BaseException:
+        queue.put(('error', traceback.format_exc()))
+
+
+def run_case_in_child(case):
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_run_case_in_child,
+            args=(case, queue))
+    proc.start()
+    status, result = queue.get()
+    proc.join()
+    if status != 'ok':
+        raise RuntimeError("Case {} failed:\n{}".format(case_name(case),
+            result))
+    return result
+
+
+def run_cases(cases):
+    results = []
+    for case in cases:
+        result = run_case_in_child(case)
+        print '{:<55} {:>10.1f} events/s {:>10.1f} flash ops/s {:>8.1f} MB'\
+            .format(result['case'], result['events_per_sec'],
+                    result['flash_ops_per_sec'], result['peak_rss_mb'])
+        sys.stdout.flush()
+        results.append(result)
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Return a list of (case name, message) of the regressions of results
+    against baseline. Cases missing in either are ignored.
+    """
+    base_of_case = {result['case']: result for result in baseline['results']}
+    problems = []
+    for result in results:
+        base = base_of_case.get(result['case'], None)
+        if base is None:
+            continue
+
+        ratio = result['events_per_sec'] / base['events_per_sec']
+        if ratio < 1 - tolerance:
+            problems.append((result['case'],
+                'events/sec {:.1f} -> {:.1f} ({:+.0%})'.format(
+                    base['events_per_sec'], result['events_per_sec'],
+                    ratio - 1)))
+
+        ratio = result['peak_rss_mb'] / base['peak_rss_mb']
+        if ratio > 1 + tolerance:
+            problems.append((result['case'],
+                'peak RSS {:.1f}MB -> {:.1f}MB ({:+.0%})'.format(
+                    base['peak_rss_mb'], result['peak_rss_mb'], ratio - 1)))
+
+        if result['n_flash_ops'] != base['n_flash_ops']:
+            problems.append((result['case'],
+                'flash ops {} -> {}, the simulated behavior changed'.format(
+                    base['n_flash_ops'], result['n_flash_ops'])))
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Throughput benchmark of the simulators')
+    parser.add_argument('--quick', action='store_true',
+            help='run a few representative cases only')
+    parser.add_argument('--cases', default=None,
+            help='run the cases whose name contains this string')
+    parser.add_argument('--output', default=None,
+            help='write the results as JSON to this file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+            help='save the results as the baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    cases = quick_cases() if args.quick else all_cases()
+    if args.cases is not None:
+        cases = [case for case in cases if args.cases in case_name(case)]
+
+    results = run_cases(cases)
+    report = {'python': sys.version.split()[0],
+              'results': results}
+
+    if args.output is not None:
+        utils.dump_json(report, args.output)
+
+    if args.save_baseline:
+        utils.dump_json(report, args.baseline)
+        print 'Saved baseline to', args.baseline
+        return
+
+    if not os.path.exists(args.baseline):
+        print 'No baseline at', args.baseline
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    problems = compare_with_baseline(results, baseline, args.tolerance)
+    for name, message in problems:
+        print 'REGRESSION', name, message
+    if len(problems) > 0:
+        sys.exit(1)
+    print 'No regression against', args.baseline
+
+
+if __name__ == '__main__':
+    main()
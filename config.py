@@ -240,7 +240,14 @@ class Config(dict):
             "output_target" : "file",
             "print_when_finished": False,
             # "output_target" : "stdout",
+            # format of timeline.txt and channel_timeline.txt, 'text' or
+            # 'columnar'. 'columnar' buffers rows and writes binary chunks
+            # to timeline.cols, see wiscsim/timelinewriter.py
+            "timeline_format": 'text',
             "record_bad_victim_block": False,
+            # histograms of the latency of host requests in the ssd, from
+            # taking them from the ncq to completion, in recorder.json
+            "record_request_latency": True,
 
             ############## For workrunner ########
             "linux_ncq_depth"  : 128,
@@ -337,6 +344,11 @@ class Config(dict):
             # "lba_workload_class"    : "Random",
             "lba_workload_class"    : "Manual",
             "lba_workload_configs"  : {},
+            # BlktraceEvents saves the state of the simulated SSD after the
+            # mkfs events to this directory, and later runs with the same
+            # config and mkfs events load it instead of replaying them.
+            # None disables it.
+            "aging_snapshot_dir"    : None,
 
             ############# PERF #####################
             "wrap_by_perf" : False,
@@ -344,6 +356,16 @@ class Config(dict):
                     "perf_path"         : "perf",
                     "flamegraph_dir"    : None
                     },
+            # profile the simulator in Python: None, 'cprofile' or
+            # 'sampling'. simulator.pstats and simulator.collapsed are
+            # written to result_dir, see wiscsim/simprofiler.py
+            "profile_simulator": None,
+            # 'run' profiles the whole simulation, 'workload' only the
+            # target workload, from OP_ENABLE_RECORDER to
+            # interest_workload_end
+            "profile_window": 'run',
+            # seconds of CPU time between samples of 'sampling'
+            "profile_sampling_interval": 0.005,
 
             ############# OS #####################
             "linux_version": utils.linux_kernel_version(),
@@ -376,6 +398,146 @@ class Config(dict):
                 self['device_path']).group(1)
 
 
+def is_power_of_two(n):
+    return n > 0 and n & (n - 1) == 0
+
+
+def _divider(n):
+    """
+    Return functions div(x) and divmod(x) by n. If n is a power of two they
+    shift and mask.
+    """
+    if is_power_of_two(n):
+        shift = n.bit_length() - 1
+        mask = n - 1
+
+        def div(x):
+            return x >> shift
+
+        def div_mod(x):
+            return x >> shift, x & mask
+    else:
+        def div(x):
+            return x / n
+
+        def div_mod(x):
+            return x / n, x % n
+
+    return div, div_mod
+
+
+class FlashGeometry(object):
+    """
+    The flash layout of a config, as integer attributes computed once.
+    Address translations that are done per page use it instead of the
+    nested dicts of the config, see ConfigNewFlash.geometry(). It cannot be
+    changed; get a new one if the layout of the config changes.
+
+    page_to_block, page_to_block_off, block_to_page_range,
+    block_off_to_page, lpn_to_m_vpn and page_to_location are functions
+    stored in the object, so they are called without creating bound
+    methods. When a size is a power of two, they shift and mask instead of
+    dividing.
+    """
+    __slots__ = ('page_size', 'n_pages_per_block', 'n_blocks_per_plane',
+            'n_planes_per_chip', 'n_chips_per_package',
+            'n_packages_per_channel', 'n_channels_per_dev',
+            'n_pages_per_plane', 'n_pages_per_chip', 'n_pages_per_package',
+            'n_pages_per_channel', 'n_pages_per_dev', 'n_blocks_per_channel',
+            'n_blocks_per_dev', 'page_hierarchy',
+            'n_mapping_entries_per_page',
+            'page_to_block', 'page_to_block_off', 'block_to_page_range',
+            'block_off_to_page', 'lpn_to_m_vpn', 'page_to_location')
+
+    LAYOUT_KEYS = ('page_size', 'n_pages_per_block', 'n_blocks_per_plane',
+            'n_planes_per_chip', 'n_chips_per_package',
+            'n_packages_per_channel', 'n_channels_per_dev')
+
+    def __init__(self, flash_config, n_mapping_entries_per_page=None):
+        """
+        flash_config is conf['flash_config']. n_mapping_entries_per_page is
+        needed by lpn_to_m_vpn only.
+        """
+        init = lambda name, value: object.__setattr__(self, name, value)
+
+        for key in self.LAYOUT_KEYS:
+            init(key, int(flash_config[key]))
+        init('n_mapping_entries_per_page', n_mapping_entries_per_page)
+
+        init('n_pages_per_plane',
+                self.n_pages_per_block * self.n_blocks_per_plane)
+        init('n_pages_per_chip',
+                self.n_pages_per_plane * self.n_planes_per_chip)
+        init('n_pages_per_package',
+                self.n_pages_per_chip * self.n_chips_per_package)
+        init('n_pages_per_channel',
+                self.n_pages_per_package * self.n_packages_per_channel)
+        init('n_pages_per_dev',
+                self.n_pages_per_channel * self.n_channels_per_dev)
+        init('n_blocks_per_channel',
+                self.n_pages_per_channel / self.n_pages_per_block)
+        init('n_blocks_per_dev',
+                self.n_blocks_per_channel * self.n_channels_per_dev)
+        init('page_hierarchy', (self.n_pages_per_channel,
+            self.n_pages_per_package, self.n_pages_per_chip,
+            self.n_pages_per_plane, self.n_pages_per_block))
+
+        n_pages_per_block = self.n_pages_per_block
+        page_to_block, page_to_block_off = _divider(n_pages_per_block)
+        init('page_to_block', page_to_block)
+        init('page_to_block_off', page_to_block_off)
+
+        if is_power_of_two(n_pages_per_block):
+            shift = n_pages_per_block.bit_length() - 1
+
+            def block_to_page_range(blocknum):
+                return blocknum << shift, (blocknum + 1) << shift
+
+            def block_off_to_page(blocknum, pageoff):
+                return (blocknum << shift) + pageoff
+        else:
+            def block_to_page_range(blocknum):
+                return blocknum * n_pages_per_block, \
+                        (blocknum + 1) * n_pages_per_block
+
+            def block_off_to_page(blocknum, pageoff):
+                return blocknum * n_pages_per_block + pageoff
+        init('block_to_page_range', block_to_page_range)
+        init('block_off_to_page', block_off_to_page)
+
+        if n_mapping_entries_per_page is None:
+            init('lpn_to_m_vpn', None)
+        else:
+            init('lpn_to_m_vpn', _divider(n_mapping_entries_per_page)[0])
+
+        # each count of the hierarchy is a multiple of the next one, so
+        # page_no % n_pages_per_channel % n_pages_per_package is
+        # page_no % n_pages_per_package
+        channel, package, chip, plane, block = self.page_hierarchy
+
+        def page_to_location(page_no):
+            """
+            Return [channel, package, chip, plane, block, page] of page_no
+            """
+            return [page_no / channel,
+                    page_no % channel / package,
+                    page_no % package / chip,
+                    page_no % chip / plane,
+                    page_no % plane / block,
+                    page_no % block]
+        init('page_to_location', page_to_location)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FlashGeometry cannot be changed")
+
+    def __reduce__(self):
+        # the functions are rebuilt instead of pickled
+        flash_config = dict((key, getattr(self, key))
+                for key in self.LAYOUT_KEYS)
+        return (self.__class__,
+                (flash_config, self.n_mapping_entries_per_page))
+
+
 class ConfigNewFlash(Config):
     """
     This config class uses more complex flash configuration with channels,
@@ -387,6 +549,20 @@ class ConfigNewFlash(Config):
         flash_config = self.flash_default()
         self['flash_config'] = flash_config
 
+        # Let the flash controller do the operations of a request on the
+        # same channel back to back in one process. This is faster, but
+        # pages of concurrent requests on the same channel no longer
+        # interleave, which changes timing and GC results. By default each
+        # page is done in its own process.
+        self['coalesce_channel_ops'] = False
+
+        # How the flash controller times channels. 'resource' holds a
+        # simpy.Resource per channel for each operation. 'analytical' keeps
+        # the time each channel becomes free and wakes the caller with one
+        # timeout, which is faster. For the same operations, both give the
+        # same times, busy time and channel timeline.
+        self['channel_model'] = 'resource'
+
         # remove duplication
         del self["flash_page_size"]
         del self["flash_npage_per_block"]
@@ -447,6 +623,14 @@ class ConfigNewFlash(Config):
     def n_channels_per_dev(self, value):
         self['flash_config']['n_channels_per_dev'] = value
 
+    def geometry(self):
+        """
+        Return a FlashGeometry of the current flash layout. Objects that
+        translate addresses per page keep it instead of calling the
+        methods of the config.
+        """
+        return FlashGeometry(self['flash_config'])
+
     def flash_default(self):
         flash_config = {
             # layout info
@@ -615,6 +799,16 @@ class ConfigNCQFTL(ConfigNewFlash):
         self['process_queue_depth'] = 32
         self['simulator_enable_interval'] = False
 
+        # 'closed': Host puts requests to the ncq as fast as the ssd takes
+        # them. 'open': Host puts each request at its timestamp in the
+        # trace, with the gaps between timestamps multiplied by
+        # host_time_scale, see wiscsim/host.py
+        self['host_replay'] = 'closed'
+        self['host_time_scale'] = 1.0
+        # max requests waiting for the ssd in the host queue, None for
+        # unbounded
+        self['host_queue_depth'] = None
+
     def ssd_ncq_depth(self):
         return self['SSDFramework']['ncq_depth']
 
@@ -10,7 +10,7 @@ from config import MountOption as MOpt
 from config import LBAGENERATOR
 
 class Experiment(object):
-    def __init__(self, para):
+    def __init__(self, para, result_dir=None):
         if para.ftl == 'nkftl2':
             self.conf = wiscsim.nkftl2.Config()
         elif para.ftl == 'dftldes':
@@ -24,6 +24,8 @@ class Experiment(object):
             raise NotImplementedError()
         self.para = para
         self.conf['exp_parameters'] = self.para._asdict()
+        # if not None, results are saved here instead of a new dir
+        self.result_dir = result_dir
 
     def setup_environment(self):
         self.conf['device_path'] = self.para.device_path
@@ -218,6 +220,8 @@ class Experiment(object):
                 expname = self.para.expname,
                 subexpname = 'subexp-' + str(hash(chain_items_as_filename(self.para))))
         runtime_update(self.conf)
+        if self.result_dir is not None:
+            self.conf['result_dir'] = self.result_dir
 
         self.check_config()
 
@@ -383,17 +387,18 @@ def run_on_real_dev(para):
     obj.main()
 
 
-def execute_simulation(para):
+def execute_simulation(para, result_dir=None):
     """
     INPUT: para is a dictionary generated by filesim.ParaDict
 
-    This function is only for simulating blktrace events as LBA workload
+    This function is only for simulating blktrace events as LBA workload.
+    Results are saved in result_dir if it is not None.
     """
     default_para = get_shared_nolist_para_dict(None, None)
     default_para.update(para)
     para = default_para
     Parameters = collections.namedtuple("Parameters", ','.join(para.keys()))
-    obj = ExistingTraceExperiment( Parameters(**para) )
+    obj = ExistingTraceExperiment( Parameters(**para), result_dir=result_dir )
     obj.main()
 
 
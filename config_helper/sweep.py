@@ -0,0 +1,153 @@
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from experiment import execute_simulation
+from utilities import utils
+
+
+SWEEP_LOG = 'sweep.log'
+SUMMARY_FILE = 'sweep-summary.txt'
+DONE, SKIPPED, FAILED = 'done', 'skipped', 'failed'
+
+
+def run_name(para):
+    """
+    A stable name of a run, so the same parameters always get the same
+    result directory and finished runs can be found again.
+    """
+    digest = hashlib.md5(repr(sorted(para.items()))).hexdigest()
+    return 'run-' + digest[:16]
+
+
+def _run_in_child(run_func, para, run_dir):
+    """
+    Entry of the child process of a run. Output goes to the log file of
+    the run, so runs do not mix their output.
+    """
+    log_path = os.path.join(run_dir, SWEEP_LOG)
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+
+    try:
+        run_func(para, run_dir)
+    except BaseException:
+        traceback.print_exc()
+        sys.stderr.flush()
+        os._exit(1)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(0)
+
+
+class SweepRunner(object):
+    """
+    Simulate a sweep of parameter dicts (for example, from
+    rule_parameter.ParaDict) in parallel, one process per run.
+
+    Results of a run go to <sweep_dir>/<run_name(para)>. A run is skipped
+    if recorder.json exists in its directory, so a stopped sweep can be
+    resumed by running it again. A failed run does not stop the others; its
+    traceback is in the sweep.log of the run. A summary table of all runs is
+    written to <sweep_dir>/sweep-summary.txt.
+
+    run_func(para, result_dir) runs one simulation. The default is
+    experiment.execute_simulation.
+    """
+    def __init__(self, paras, sweep_dir, n_workers=None,
+            run_func=execute_simulation, poll_interval=0.5):
+        self.paras = list(paras)
+        self.sweep_dir = sweep_dir
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        self.n_workers = n_workers
+        self.run_func = run_func
+        self.poll_interval = poll_interval
+
+    def run_dir(self, para):
+        return os.path.join(self.sweep_dir, run_name(para))
+
+    def is_finished(self, para):
+        return os.path.exists(os.path.join(self.run_dir(para),
+            'recorder.json'))
+
+    def run(self):
+        """
+        Return the summary table, one row per parameter dict.
+        """
+        table = []
+        pending = []
+        for para in self.paras:
+            row = {'run': run_name(para), 'status': None, 'seconds': 0,
+                   'error': ''}
+            table.append(row)
+            if self.is_finished(para):
+                row['status'] = SKIPPED
+            else:
+                pending.append((para, row))
+
+        print 'Sweep: {} runs, {} to simulate with {} workers'.format(
+            len(table), len(pending), self.n_workers)
+
+        running = []
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < self.n_workers:
+                para, row = pending.pop(0)
+                running.append(self._start(para, row))
+
+            time.sleep(self.poll_interval)
+            for proc, para, row, start_time in list(running):
+                if proc.is_alive():
+                    continue
+                proc.join()
+                running.remove((proc, para, row, start_time))
+                self._finish(proc, para, row, start_time)
+
+        utils.prepare_dir(self.sweep_dir)
+        utils.table_to_file(table, os.path.join(self.sweep_dir, SUMMARY_FILE))
+
+        return table
+
+    def _start(self, para, row):
+        run_dir = self.run_dir(para)
+        utils.prepare_dir(run_dir)
+        proc = multiprocessing.Process(target=_run_in_child,
+                args=(self.run_func, para, run_dir))
+        proc.start()
+        return (proc, para, row, time.time())
+
+    def _finish(self, proc, para, row, start_time):
+        row['seconds'] = round(time.time() - start_time, 2)
+        if proc.exitcode == 0:
+            row['status'] = DONE
+        else:
+            row['status'] = FAILED
+            row['error'] = self._last_log_line(para) or \
+                    'exit code {}'.format(proc.exitcode)
+        print 'Sweep:', row['run'], row['status'], row['seconds'], 'sec'
+
+    def _last_log_line(self, para):
+        log_path = os.path.join(self.run_dir(para), SWEEP_LOG)
+        if not os.path.exists(log_path):
+            return None
+        with open(log_path, 'r') as f:
+            lines = [line.strip() for line in f if line.strip() != '']
+        if len(lines) == 0:
+            return None
+        return lines[-1]
+
+
+def run_sweep(paras, sweep_dir, n_workers=None):
+    """
+    Simulate paras in parallel. paras can be a rule_parameter.ParaDict.
+    """
+    runner = SweepRunner(paras, sweep_dir, n_workers=n_workers)
+    return runner.run()
+
@@ -7,23 +7,62 @@ class ZipfGenerator:
     """
     from
     http://stackoverflow.com/questions/1366984/generate-random-numbers-distributed-by-zipf
+
+    The CDF is built in O(n). By default, it is a list and numbers are
+    drawn one by one from the random module. With use_numpy, it is a numpy
+    array and sample() draws a batch of numbers with one searchsorted()
+    over a vector of uniforms from a numpy random state.
     """
-    def __init__(self, n, alpha):
+    def __init__(self, n, alpha, seed=None, use_numpy=False):
         """
         Generate numbers up to n
         alpha can be 0.x, or larger. Smaller -. more uniform
+        use_numpy requires numpy. seed seeds its random state. If it is
+        None, the seed is drawn from the random module, so seeding random
+        makes runs repeatable. seed is not used without use_numpy.
         """
-        # Calculate Zeta values from 1 to n:
-        tmp = [1. / (math.pow(float(i), alpha)) for i in range(1, n+1)]
-        zeta = reduce(lambda sums, x: sums + [sums[-1] + x], tmp, [0])
+        self.use_numpy = use_numpy
+        if use_numpy is False:
+            # Calculate Zeta values from 1 to n:
+            zeta = [0.]
+            total = 0.
+            for i in range(1, n+1):
+                total += 1. / (math.pow(float(i), alpha))
+                zeta.append(total)
+
+            # Store the translation map:
+            self.distMap = [x / total for x in zeta]
+        else:
+            import numpy as np
+            self._np = np
 
-        # Store the translation map:
-        self.distMap = [x / zeta[-1] for x in zeta]
+            if seed is None:
+                seed = random.getrandbits(32)
+            self.random_state = np.random.RandomState(seed)
+
+            zeta = np.empty(n + 1)
+            zeta[0] = 0.
+            np.cumsum(np.arange(1, n + 1, dtype=float) ** -float(alpha),
+                    out=zeta[1:])
+            self.distMap = zeta / zeta[-1]
 
     def next(self):
+        if self.use_numpy is True:
+            return int(self.sample(1)[0])
+
         # Take a uniform 0-1 pseudo-random value:
         u = random.random()
 
         # Translate the Zipf variable:
         return bisect.bisect(self.distMap, u) - 1
 
+    def sample(self, size):
+        """
+        Return size numbers, as a numpy array with use_numpy, otherwise as
+        a list.
+        """
+        if self.use_numpy is False:
+            return [self.next() for _ in range(size)]
+
+        u = self.random_state.random_sample(size)
+        return self._np.searchsorted(self.distMap, u, side='right') - 1
@@ -1,6 +1,9 @@
+import heapq
 import os
 import re
+import shutil
 import subprocess
+import tempfile
 import time
 
 from pyreuse.helpers import *
@@ -243,6 +246,176 @@ class BlktraceResultInMem(object):
         return size_mb / duration
 
 
+class BlktraceResultStream(object):
+    """
+    Parse blkparse output without holding the trace in memory.
+
+    The output of create_event_file() is the same as BlktraceResultInMem's.
+    When do_sort is True, data lines are sorted by timestamp with an
+    external merge sort: runs of at most sort_run_lines lines are sorted in
+    memory and written to temporary files next to parsed_output_path, then
+    the runs are merged. The sort is stable, like list.sort().
+    """
+    def __init__(self, sector_size, event_file_column_names,
+            raw_blkparse_file_path, parsed_output_path,
+            padding_bytes=0, do_sort=True, sort_run_lines=1000000,
+            max_merge_runs=128):
+        self.raw_blkparse_file_path = raw_blkparse_file_path
+        self.parsed_output_path = parsed_output_path
+        self.sector_size = sector_size
+        self.event_file_column_names = event_file_column_names
+        self.do_sort = do_sort
+        self.sort_run_lines = sort_run_lines
+        self.max_merge_runs = max_merge_runs
+
+        # event offset + padding_bytes = blktrace addr
+        # see BlktraceResultInMem
+        self.padding_bytes = padding_bytes
+
+    def iter_events(self):
+        """
+        Yield row dicts of the data lines, in event file order, with
+        pre_wait_time.
+        """
+        prev_timestamp = None
+        for line in self._iter_data_lines():
+            row = parse_data_line(line, self.sector_size, self.padding_bytes)
+            row['type'] = 'blkparse'
+
+            timestamp = float(row['timestamp'])
+            if prev_timestamp is None:
+                row['pre_wait_time'] = 0
+            else:
+                row['pre_wait_time'] = timestamp - prev_timestamp
+                if self.do_sort is True:
+                    assert row['pre_wait_time'] >= 0, \
+                        "data is {}".format(row['pre_wait_time'])
+            prev_timestamp = timestamp
+
+            yield row
+
+    def create_event_file(self):
+        prepare_dir_for_path(self.parsed_output_path)
+        out = open(self.parsed_output_path, 'w')
+        for row_dict in self.iter_events():
+            columns = [str(row_dict[colname])
+                    for colname in self.event_file_column_names]
+            out.write(' '.join(columns) + '\n')
+
+        out.flush()
+        os.fsync(out)
+        out.close()
+
+    def get_duration(self):
+        timestamps = (float(line.split()[3])
+                for line in self._iter_raw_data_lines())
+        first = last = None
+        for timestamp in timestamps:
+            if first is None:
+                first = last = timestamp
+            elif self.do_sort is True:
+                first = min(first, timestamp)
+                last = max(last, timestamp)
+            else:
+                last = timestamp
+
+        return last - first
+
+    def count_sectors(self, operation):
+        sectors_cnt = 0
+        for line in self._iter_raw_data_lines():
+            row = parse_data_line(line, self.sector_size, self.padding_bytes)
+            if row['operation'] == operation:
+                sectors_cnt += int(row['sector_count'])
+
+        return sectors_cnt
+
+    def get_bandwidth_mb(self, operation):
+        sec_cnt = self.count_sectors(operation)
+        size_mb = sec_cnt * self.sector_size / float(MB)
+        duration = self.get_duration()
+
+        return size_mb / duration
+
+    def _iter_raw_data_lines(self):
+        with open(self.raw_blkparse_file_path, 'r') as line_iter:
+            for line in line_iter:
+                line = line.strip()
+                if is_data_line(line):
+                    yield line
+
+    def _iter_data_lines(self):
+        if self.do_sort is not True:
+            for line in self._iter_raw_data_lines():
+                yield line
+            return
+
+        tmp_dir = tempfile.mkdtemp(prefix='blkparse-sort-',
+                dir=os.path.dirname(os.path.abspath(self.parsed_output_path)))
+        try:
+            run_paths = self._write_sorted_runs(tmp_dir)
+            while len(run_paths) > self.max_merge_runs:
+                run_paths = self._merge_run_groups(run_paths, tmp_dir)
+
+            for _, _, line in self._merge_runs(run_paths):
+                yield line
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def _write_sorted_runs(self, tmp_dir):
+        """
+        Each line of a run is 'seq line', seq being the position of the line
+        in the raw file. seq breaks ties of timestamps when merging.
+        """
+        run_paths = []
+        run = []
+        for seq, line in enumerate(self._iter_raw_data_lines()):
+            run.append((float(line.split()[3]), seq, line))
+            if len(run) >= self.sort_run_lines:
+                run_paths.append(self._write_run(run, tmp_dir))
+                run = []
+
+        if len(run) > 0:
+            run_paths.append(self._write_run(run, tmp_dir))
+
+        return run_paths
+
+    def _write_run(self, entries, tmp_dir):
+        entries.sort()
+        return self._dump_run(entries, tmp_dir)
+
+    def _dump_run(self, entries, tmp_dir):
+        fd, path = tempfile.mkstemp(dir=tmp_dir, suffix='.run')
+        with os.fdopen(fd, 'w') as f:
+            for _, seq, line in entries:
+                f.write('{} {}\n'.format(seq, line))
+        return path
+
+    def _merge_run_groups(self, run_paths, tmp_dir):
+        merged_paths = []
+        for i in range(0, len(run_paths), self.max_merge_runs):
+            group = run_paths[i:i + self.max_merge_runs]
+            merged_paths.append(
+                    self._dump_run(self._merge_runs(group), tmp_dir))
+            for path in group:
+                os.remove(path)
+        return merged_paths
+
+    def _merge_runs(self, run_paths):
+        files = [open(path, 'r') for path in run_paths]
+        try:
+            for entry in heapq.merge(*[self._iter_run(f) for f in files]):
+                yield entry
+        finally:
+            for f in files:
+                f.close()
+
+    def _iter_run(self, run_file):
+        for run_line in run_file:
+            seq, line = run_line.rstrip('\n').split(' ', 1)
+            yield float(line.split()[3]), int(seq), line
+
+
 class BlockTraceManager(object):
     "This class provides interfaces to interact with blktrace"
     def __init__(self, dev, event_file_column_names,
@@ -265,7 +438,7 @@ class BlockTraceManager(object):
 
     def create_event_file_from_blkparse(self):
         if self.do_sort is True:
-            rawparser = BlktraceResultInMem(self.sector_size,
+            rawparser = BlktraceResultStream(self.sector_size,
                     self.event_file_column_names,
                     self.resultpath, self.to_ftlsim_path,
                     padding_bytes=self.padding_bytes,
@@ -321,3 +494,29 @@ def is_data_line(line):
         return True
 
 
+def parse_data_line(line, sector_size, padding_bytes=0):
+    """
+    Return the row dict of a blkparse line, is_data_line() must be true
+    for the line. The row has the same keys as BlktraceResultInMem's rows,
+    except type and pre_wait_time.
+    """
+    names = ['devid', 'cpuid', 'seqid', 'timestamp', 'pid', 'action', 'RWBS', 'sector_start', 'ignore1', 'sector_count']
+    items = line.split()
+    assert len(items) >= len(names)
+    row = dict(zip(names, items))
+
+    rwbs = row['RWBS']
+    if 'D' in rwbs:
+        row['operation'] = 'discard'
+    elif 'W' in rwbs:
+        row['operation'] = 'write'
+    elif 'R' in rwbs:
+        row['operation'] = 'read'
+    else:
+        raise RuntimeError('unknow operation ' + rwbs)
+    row['sync'] = 'True' if 'S' in rwbs else 'False'
+
+    row['offset'] = int(row['sector_start']) * sector_size - padding_bytes
+    row['size'] = int(row['sector_count']) * sector_size
+
+    return row
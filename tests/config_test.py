@@ -1,3 +1,4 @@
+import cPickle
 import unittest
 
 import config
@@ -48,6 +49,66 @@ class TestConfigNewFlash(unittest.TestCase):
         self.assertEqual(npages1, npages2)
 
 
+class TestFlashGeometry(unittest.TestCase):
+    def create_config(self, n_pages_per_block):
+        conf = config.ConfigNewFlash()
+        conf['flash_config']['n_pages_per_block'] = n_pages_per_block
+        conf['flash_config']['n_blocks_per_plane'] = 6
+        conf['flash_config']['n_channels_per_dev'] = 3
+        return conf
+
+    def test_same_as_config(self):
+        # 4 takes the shift/mask paths, 6 the division paths
+        for n_pages_per_block in (4, 6):
+            conf = self.create_config(n_pages_per_block)
+            geometry = conf.geometry()
+
+            self.assertEqual(geometry.n_pages_per_block, n_pages_per_block)
+            self.assertEqual(geometry.n_blocks_per_dev, conf.n_blocks_per_dev)
+            self.assertEqual(geometry.n_pages_per_dev, conf.total_num_pages())
+            self.assertEqual(geometry.n_blocks_per_channel,
+                    conf.n_blocks_per_channel)
+
+            for page in range(conf.total_num_pages()):
+                self.assertEqual(geometry.page_to_block_off(page),
+                        conf.page_to_block_off(page))
+                self.assertEqual(geometry.page_to_block(page),
+                        conf.page_to_block(page)['blocknum'])
+                self.assertEqual(geometry.block_off_to_page(
+                    *conf.page_to_block_off(page)), page)
+
+            for block in range(conf.n_blocks_per_dev):
+                self.assertEqual(geometry.block_to_page_range(block),
+                        conf.block_to_page_range(block))
+
+    def test_page_to_location(self):
+        conf = self.create_config(4)
+        geometry = conf.geometry()
+        # 2 planes per chip, 2 chips per package, 1 package per channel
+        page = 1 * geometry.n_pages_per_channel + \
+                1 * geometry.n_pages_per_chip + \
+                1 * geometry.n_pages_per_plane + 5 * 4 + 3
+        self.assertEqual(geometry.page_to_location(page), [1, 0, 1, 1, 5, 3])
+
+    def test_lpn_to_m_vpn(self):
+        geometry = config.FlashGeometry(self.create_config(4)['flash_config'],
+                n_mapping_entries_per_page=512)
+        self.assertEqual(geometry.lpn_to_m_vpn(511), 0)
+        self.assertEqual(geometry.lpn_to_m_vpn(1024), 2)
+        self.assertIsNone(self.create_config(4).geometry().lpn_to_m_vpn)
+
+    def test_immutable_and_picklable(self):
+        geometry = config.FlashGeometry(self.create_config(6)['flash_config'],
+                n_mapping_entries_per_page=100)
+        with self.assertRaises(AttributeError):
+            geometry.n_pages_per_block = 8
+
+        loaded = cPickle.loads(cPickle.dumps(geometry, 2))
+        self.assertEqual(loaded.n_blocks_per_dev, geometry.n_blocks_per_dev)
+        self.assertEqual(loaded.page_to_block_off(13), (2, 1))
+        self.assertEqual(loaded.lpn_to_m_vpn(250), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -440,6 +440,114 @@ class TestControllerTag(unittest.TestCase):
         self.my_run()
 
 
+class TestControllerTagCoalesced(TestControllerTag):
+    def setup_config(self):
+        super(TestControllerTagCoalesced, self).setup_config()
+        self.conf['coalesce_channel_ops'] = True
+
+
+class TestControllerCoalesced(TestControllerTagCoalesced):
+    def access(self, env,  controller):
+        rt = controller.channels[0].read_time
+        wt = controller.channels[0].program_time
+        rec = controller.recorder
+
+        # pages 0, 1, 3 are in channel 0, page 4 is in channel 1
+        yield env.process(controller.rw_ppns([0, 4, 1, 3], 'write',
+            tag = 'mytag1'))
+        self.assertEqual(env.now, wt * 3)
+        self.assertEqual(rec.get_general_accumulater_cnt('channel_busy_time',
+            'channel_0-write-mytag1'), wt * 3)
+        self.assertEqual(rec.get_general_accumulater_cnt('channel_busy_time',
+            'channel_1-write-mytag1'), wt)
+        self.assertEqual(rec.get_count_me('flash_ops', OP_WRITE), 4)
+
+        yield env.process(controller.rw_ppns([], 'read', tag = 'mytag1'))
+        self.assertEqual(env.now, wt * 3)
+        self.assertFalse(OP_READ in rec.general_accumulator['flash_ops'])
+
+        # the second request waits for the channel
+        start = env.now
+        p1 = env.process(controller.rw_ppns([0, 1], 'read', tag = 'mytag2'))
+        p2 = env.process(controller.rw_ppns([2], 'read', tag = 'mytag2'))
+        yield p1
+        self.assertEqual(env.now, start + rt * 2)
+        yield p2
+        self.assertEqual(env.now, start + rt * 3)
+        self.assertEqual(rec.get_count_me('flash_ops', OP_READ), 3)
+
+
+class TestControllerTagAnalytical(TestControllerTag):
+    def setup_config(self):
+        super(TestControllerTagAnalytical, self).setup_config()
+        self.conf['channel_model'] = 'analytical'
+
+
+class TestControllerTagCoalescedAnalytical(TestControllerTagCoalesced):
+    def setup_config(self):
+        super(TestControllerTagCoalescedAnalytical, self).setup_config()
+        self.conf['channel_model'] = 'analytical'
+
+
+class TestControllerCoalescedAnalytical(TestControllerCoalesced):
+    def setup_config(self):
+        super(TestControllerCoalescedAnalytical, self).setup_config()
+        self.conf['channel_model'] = 'analytical'
+
+
+class TestChannelModelsAgree(TestControllerTag):
+    """
+    Concurrent requests get the same finish times, channel busy time and
+    channel timeline from both channel models.
+    """
+    def request(self, env, controller, delay, ppns, op, tag, finish_times):
+        yield env.timeout(delay)
+        if op == 'erase':
+            yield env.process(controller.erase_pbn_extent(ppns[0],
+                len(ppns), tag = tag))
+        else:
+            yield env.process(controller.rw_ppns(ppns, op, tag = tag))
+        finish_times.append((tag, env.now))
+
+    def run_model(self, channel_model):
+        self.conf['channel_model'] = channel_model
+        self.conf['write_channel_timeline'] = True
+        set_exp_metadata(self.conf, save_data = False,
+                expname = 'default',
+                subexpname = 'default-sub')
+        runtime_update(self.conf)
+        rec = wiscsim.recorder.Recorder(output_target = self.conf['output_target'],
+            output_directory = self.conf['result_dir'],
+            verbose_level = self.conf['verbose_level'],
+            print_when_finished = False
+            )
+        rec.enable()
+        timeline = []
+        rec.write_timeline = lambda filename, **kwargs: timeline.append(kwargs)
+
+        env = simpy.Environment()
+        controller = wiscsim.controller.Controller3(env, self.conf, rec)
+        finish_times = []
+        requests = [(0, [0, 1, 4], 'write'), (0, [2], 'read'),
+                (5, [0, 4, 5, 6, 7], 'read'), (100, [1, 2], 'erase'),
+                (100, [3, 2, 1, 0], 'write'), (20000, [5], 'read')]
+        for i, (delay, ppns, op) in enumerate(requests):
+            env.process(self.request(env, controller, delay, ppns, op,
+                'req{}'.format(i), finish_times))
+        env.run()
+
+        return (finish_times, timeline,
+                dict(rec.general_accumulator['channel_busy_time']))
+
+    def test_main(self):
+        self.setup_config()
+        resource = self.run_model('resource')
+        analytical = self.run_model('analytical')
+        self.assertEqual(resource, analytical)
+        self.assertEqual(len(resource[0]), 6)
+        self.assertEqual(len(resource[1]), 16)
+
+
 
 def main():
     unittest.main()
@@ -1,7 +1,10 @@
+import cPickle
+import random
 import unittest
 
 import wiscsim
-from wiscsim.lrulist import LinkedList, Node, LruDict, LruCache
+from wiscsim.lrulist import LinkedList, Node, LruDict, LruCache, \
+        IndexLinkedList, SlotLruCache
 import profile
 
 
@@ -73,6 +76,13 @@ class Test_LruCache(unittest.TestCase):
         self.assertListEqual(lk, list(range(10)))
         self.assertListEqual(lv, list(range(0, 100, 10)))
 
+    def test_pickle(self):
+        d = self.get_lrucache()
+        d[3] = 33
+        d2 = cPickle.loads(cPickle.dumps(d, cPickle.HIGHEST_PROTOCOL))
+        self.assertListEqual(list(d2.items()), list(d.items()))
+        self.assertEqual(d2.most_recently_used_key(), 3)
+
     def test_recency_iter(self):
         d = LruDict()
         d[1] = 11
@@ -118,6 +128,13 @@ class Test_LruCache(unittest.TestCase):
         self.assertEqual(d.victim_key(), 10)
         self.assertEqual(d.most_recently_used_key(), 9)
 
+    def test_add_to_least_used_when_empty(self):
+        d = LruCache()
+        d.add_as_least_used(1, 10)
+        d[2] = 20
+        self.assertListEqual(list(d), [2, 1])
+        self.assertListEqual(list(reversed(d)), [1, 2])
+
     def _test_performance(self):
         d = LruDict()
         for i in range(2048):
@@ -131,6 +148,98 @@ class Test_LruCache(unittest.TestCase):
 
 
 
+class TestIndexLinkedList(unittest.TestCase):
+    def test_ops(self):
+        l = IndexLinkedList(8)
+        self.assertEqual(len(l), 0)
+        self.assertEqual(l.head(), None)
+
+        for slot in (3, 5, 7):
+            l.add_to_head(slot)
+        self.assertListEqual(list(l), [7, 5, 3])
+        self.assertListEqual(list(reversed(l)), [3, 5, 7])
+
+        l.move_to_head(3)
+        self.assertListEqual(list(l), [3, 7, 5])
+
+        l.add_to_tail(0)
+        self.assertEqual(l.tail(), 0)
+
+        l.delete(7)
+        self.assertListEqual(list(l), [3, 5, 0])
+        self.assertEqual(len(l), 3)
+
+    def test_add_to_tail_when_empty(self):
+        l = IndexLinkedList(8)
+        l.add_to_tail(1)
+        l.add_to_head(2)
+        self.assertListEqual(list(l), [2, 1])
+        self.assertListEqual(list(reversed(l)), [1, 2])
+
+    def test_same_as_linked_list(self):
+        random.seed(1)
+        l = IndexLinkedList(32)
+        ll = LinkedList()
+        nodes = {}
+        for i in range(1000):
+            slot = random.randint(0, 31)
+            op = random.choice(('head', 'tail', 'delete'))
+            if slot in nodes:
+                if op == 'delete':
+                    l.delete(slot)
+                    ll.delete(nodes.pop(slot))
+                else:
+                    l.move_to_head(slot)
+                    ll.move_to_head(nodes[slot])
+            elif op == 'head':
+                l.add_to_head(slot)
+                nodes[slot] = Node(slot)
+                ll.add_to_head(nodes[slot])
+            elif op == 'tail':
+                l.add_to_tail(slot)
+                nodes[slot] = Node(slot)
+                ll.add_to_tail(nodes[slot])
+            self.assertListEqual(list(l), [node.key for node in ll])
+        self.assertEqual(len(l), len(ll))
+
+
+class TestSlotLruCache(unittest.TestCase):
+    def get_lrucache(self):
+        d = SlotLruCache(16)
+        for i in range(10):
+            d[i * 10] = i
+        return d
+
+    def test_order(self):
+        d = self.get_lrucache()
+        self.assertEqual(len(d), 10)
+        self.assertListEqual(list(d), list(reversed(range(0, 100, 10))))
+        self.assertListEqual(list(d.least_to_most_items()),
+                [(i * 10, i) for i in range(10)])
+
+    def test_hits(self):
+        d = self.get_lrucache()
+        self.assertEqual(d[20], 2)
+        self.assertEqual(d.victim_key(), 0)
+        self.assertEqual(d.most_recently_used_key(), 20)
+
+        self.assertEqual(d.peek(30), 3)
+        self.assertEqual(d.most_recently_used_key(), 20)
+
+    def test_del(self):
+        d = self.get_lrucache()
+        del d[0]
+        self.assertEqual(d.has_key(0), False)
+        self.assertEqual(d.victim_key(), 10)
+        self.assertRaises(KeyError, d.__getitem__, 0)
+
+    def test_add_to_least_used(self):
+        d = self.get_lrucache()
+        d.add_as_least_used(100, 12)
+        self.assertEqual(d.victim_key(), 100)
+        self.assertEqual(d.peek(100), 12)
+
+
 class Test_LruDict(unittest.TestCase):
     def get_lrudict(self):
         d = LruDict()
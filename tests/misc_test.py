@@ -1,8 +1,12 @@
+import os
+import shutil
 import socket
+import tempfile
 import unittest
 import time
 import copy
 import pprint
+import random
 
 import workrunner
 import wiscsim
@@ -15,6 +19,9 @@ from wiscsim.ftlsim_commons import Extent, random_channel_id
 from wiscsim.ftlcounter import LpnClassification, get_file_range_table, EventNCQParser
 from wiscsim import hostevent
 from config_helper.rule_parameter import EventFileSets
+from config_helper import sweep
+from pyreuse.general.zipf import ZipfGenerator
+from workrunner.lbaworkloadgenerator import AccessesWithDist
 from commons import *
 
 class TestCpuhandler(unittest.TestCase):
@@ -178,6 +185,74 @@ class TestLpnClassification(unittest.TestCase):
         classifier.classify()
 
 
+class TestBinaryEventFile(unittest.TestCase):
+    def test_same_events(self):
+        conf = ConfigNCQFTL()
+        tmpdir = tempfile.mkdtemp()
+        text_path = os.path.join(tmpdir, 'blkparse-events-for-ftlsim.txt')
+        shutil.copy("tests/testdata/sqlitewal-update/subexp-7928737328932659543-ext4-10-07-23-50-10--2726320246496492803/blkparse-events-for-ftlsim.txt",
+                text_path)
+
+        self.assertIsInstance(hostevent.event_file_iterator(conf, text_path),
+                hostevent.EventIterator)
+        text_events = [vars(event) for event in
+                hostevent.event_file_iterator(conf, text_path)]
+
+        bin_path = hostevent.convert_event_file(text_path)
+        self.assertEqual(bin_path, text_path + '.bin')
+        self.assertIsInstance(hostevent.event_file_iterator(conf, text_path),
+                hostevent.BinaryEventIterator)
+        bin_events = [vars(event) for event in
+                hostevent.event_file_iterator(conf, text_path)]
+
+        self.assertEqual(len(bin_events), 10000)
+        self.assertListEqual(text_events, bin_events)
+
+        shutil.rmtree(tmpdir)
+
+    def test_timestamp(self):
+        self.assertEqual(hostevent._timestamp_to_ns('1.000223461'),
+                1000223461)
+        self.assertEqual(hostevent._ns_to_timestamp(1000223461),
+                '1.000223461')
+
+
+def fake_simulation(para, result_dir):
+    if para['fail'] is True:
+        raise RuntimeError('simulation {} failed'.format(para['id']))
+    utils.dump_json({'id': para['id']}, os.path.join(result_dir, 'recorder.json'))
+
+
+class TestSweepRunner(unittest.TestCase):
+    def test_sweep(self):
+        sweep_dir = tempfile.mkdtemp()
+        paras = [{'id': i, 'fail': i == 2} for i in range(4)]
+
+        runner = sweep.SweepRunner(paras, sweep_dir, n_workers=2,
+                run_func=fake_simulation, poll_interval=0.01)
+        table = runner.run()
+        self.assertListEqual([row['status'] for row in table],
+                [sweep.DONE, sweep.DONE, sweep.FAILED, sweep.DONE])
+        self.assertIn('simulation 2 failed', table[2]['error'])
+        self.assertEqual(utils.load_json(os.path.join(runner.run_dir(paras[3]),
+            'recorder.json'))['id'], 3)
+        self.assertTrue(os.path.exists(
+            os.path.join(sweep_dir, sweep.SUMMARY_FILE)))
+
+        # finished runs are skipped when resumed
+        table = runner.run()
+        self.assertListEqual([row['status'] for row in table],
+                [sweep.SKIPPED, sweep.SKIPPED, sweep.FAILED, sweep.SKIPPED])
+
+        shutil.rmtree(sweep_dir)
+
+    def test_run_name(self):
+        self.assertEqual(sweep.run_name({'a': 1, 'b': 2}),
+                sweep.run_name({'b': 2, 'a': 1}))
+        self.assertNotEqual(sweep.run_name({'a': 1}),
+                sweep.run_name({'a': 2}))
+
+
 class TestNCQParser(unittest.TestCase):
     def test(self):
         # blkparse-events-for-ftlsim.txt
@@ -210,6 +285,85 @@ class TestEventFileSets(unittest.TestCase):
 
 
 
+class TestZipfGenerator(unittest.TestCase):
+    def test_cdf(self):
+        gen = ZipfGenerator(4, 1)
+        dist_map = list(gen.distMap)
+        self.assertEqual(len(dist_map), 5)
+        self.assertEqual(dist_map[0], 0)
+        self.assertAlmostEqual(dist_map[1], 12. / 25)
+        self.assertAlmostEqual(dist_map[-1], 1)
+
+    def test_sample(self):
+        for gen in (ZipfGenerator(100, 1),
+                ZipfGenerator(100, 1, seed=1, use_numpy=True)):
+            self.check_sample(gen)
+
+    def check_sample(self, gen):
+        samples = list(gen.sample(10000))
+        self.assertEqual(len(samples), 10000)
+        self.assertTrue(all(0 <= x < 100 for x in samples))
+        # about 1/H(100) = 19% of the samples are 0
+        self.assertGreater(samples.count(0), samples.count(1))
+        self.assertGreater(samples.count(0), 1500)
+        self.assertTrue(0 <= gen.next() < 100)
+
+
+class TestAccessesWithDist(unittest.TestCase):
+    def get_chunk_ids(self, distribution, **configs):
+        conf = ConfigNCQFTL()
+        conf['dev_size_mb'] = 1
+        conf['AccessesWithDist'] = {
+                'lba_access_dist': distribution,
+                'traffic_size': 100*KB,
+                'chunk_size': 4*KB,
+                'space_size': 40*KB,
+                'skew_factor': 2,
+                'zipf_alpha': 1,
+                'batch_size': 7,
+                }
+        conf['AccessesWithDist'].update(configs)
+        events = list(AccessesWithDist(conf))
+        self.assertEqual(events[0].operation, OP_ENABLE_RECORDER)
+        for event in events[1:]:
+            self.assertEqual(event.operation, OP_WRITE)
+            self.assertEqual(event.size, 4*KB)
+        return [event.offset / (4*KB) for event in events[1:]]
+
+    def test_uniform(self):
+        chunk_ids = self.get_chunk_ids('uniform', use_numpy=True)
+        self.assertEqual(len(chunk_ids), 25)
+        self.assertTrue(all(0 <= x < 10 for x in chunk_ids))
+
+    def test_uniform_random_module(self):
+        # the default sequence is the one of the random module
+        random.seed(3)
+        chunk_ids = self.get_chunk_ids('uniform')
+        random.seed(3)
+        self.assertListEqual(chunk_ids,
+                [random.randint(0, 9) for i in range(25)])
+
+    def test_hotcold(self):
+        # cold half once, hot half twice, until 25 + 1 chunks are written
+        one_round = range(5) + range(5, 10) * 2
+        for use_numpy in (False, True):
+            chunk_ids = self.get_chunk_ids('hotcold', use_numpy=use_numpy)
+            self.assertListEqual(chunk_ids, (one_round * 2)[:26])
+
+    def test_zipf(self):
+        chunk_ids = self.get_chunk_ids('zipf', seed=3, use_numpy=True)
+        self.assertEqual(len(chunk_ids), 25)
+        self.assertTrue(all(0 <= x < 10 for x in chunk_ids))
+        self.assertListEqual(chunk_ids, self.get_chunk_ids('zipf', seed=3,
+            use_numpy=True, batch_size=100))
+
+        random.seed(3)
+        chunk_ids = self.get_chunk_ids('zipf')
+        random.seed(3)
+        self.assertListEqual(chunk_ids, self.get_chunk_ids('zipf',
+            batch_size=100))
+
+
 def main():
     unittest.main()
 
@@ -1,7 +1,12 @@
 import config
+import cPickle
+import os
+import shutil
+import tempfile
 import unittest
 
 import wiscsim
+from commons import *
 from utilities.utils import *
 
 class TestFTLwithDFTL(unittest.TestCase):
@@ -79,6 +84,241 @@ class TestCountMe(unittest.TestCase):
         self.setup_ftl()
         self.my_run()
 
+class TestCounterHandle(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.recorder = wiscsim.recorder.Recorder(
+                output_target = wiscsim.recorder.FILE_TARGET,
+                output_directory = self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_not_switched(self):
+        handle = self.recorder.counter('set1', 'item1')
+        with self.assertRaises(RuntimeError):
+            handle.add()
+
+    def test_add(self):
+        rec = self.recorder
+        rec.enable()
+        rec.count_me('set1', 'item1')
+        handle = rec.counter('set1', 'item1')
+        self.assertIs(rec.counter('set1', 'item1'), handle)
+
+        handle.add()
+        handle.add(3)
+        rec.add_to_general_accumulater('set1', 'item1', 2)
+        self.assertEqual(rec.get_count_me('set1', 'item1'), 7)
+        self.assertEqual(rec.general_accumulator['set1']['item1'], 7)
+        self.assertEqual(
+            rec.get_result_summary()['general_accumulator']['set1']['item1'],
+            7)
+
+    def test_disable(self):
+        rec = self.recorder
+        handle = rec.counter('set1', 'item1')
+        rec.disable()
+        handle.add(5)
+        rec.enable()
+        handle.add(1)
+        rec.disable()
+        handle.add(5)
+        self.assertEqual(rec.general_accumulator['set1']['item1'], 1)
+
+    def test_not_counted(self):
+        rec = self.recorder
+        rec.enable()
+        rec.counter('set1', 'item1')
+        self.assertNotIn('set1', rec.general_accumulator)
+
+    def test_replace_accumulator(self):
+        rec = self.recorder
+        rec.enable()
+        handle = rec.counter('set1', 'item1')
+        handle.add(5)
+
+        rec.general_accumulator = {'set1': {'item1': 2}}
+        handle.add()
+        self.assertEqual(rec.general_accumulator['set1']['item1'], 3)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.recorder = wiscsim.recorder.Recorder(
+                output_target = wiscsim.recorder.FILE_TARGET,
+                output_directory = self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_buckets(self):
+        histogram = wiscsim.recorder.LatencyHistogram('set1', 'item1', True)
+        # small values are exact
+        for value in range(200):
+            histogram.add(value)
+        for index in range(128):
+            self.assertEqual(histogram.counts[index], 1)
+
+        # buckets are contiguous and hold the values they say
+        prev_high = -1
+        for index in range(histogram.N_BUCKETS):
+            low, high = histogram.bucket_range(index)
+            self.assertEqual(low, prev_high + 1)
+            self.assertLessEqual(high - low, low / 64)
+            prev_high = high
+        self.assertEqual(prev_high, 2**64 - 1)
+
+        for value in (128, 129, 1000, 3*SEC, 2**64 - 1):
+            histogram.add(value)
+            index = [i for i, n in enumerate(histogram.counts) if n > 0
+                    and histogram.bucket_range(i)[0] <= value
+                    <= histogram.bucket_range(i)[1]]
+            self.assertEqual(len(index), 1)
+
+    def test_percentiles(self):
+        rec = self.recorder
+        rec.enable()
+        histogram = rec.histogram('set1', 'item1')
+        self.assertIs(rec.histogram('set1', 'item1'), histogram)
+        for value in range(1, 10001):
+            histogram.add(value * 1000)
+
+        summary = rec.get_result_summary()['histograms']['set1']['item1']
+        self.assertEqual(summary['count'], 10000)
+        self.assertEqual(summary['min'], 1000)
+        self.assertEqual(summary['max'], 10**7)
+        self.assertAlmostEqual(summary['mean'], 5000500)
+        for name, exact in (('p50', 5 * 10**6), ('p99', 9.9 * 10**6),
+                ('p99.9', 9.99 * 10**6)):
+            self.assertGreaterEqual(summary[name], exact)
+            self.assertLess(summary[name], exact * 1.016)
+        self.assertEqual(sum(n for _, n in summary['buckets']), 10000)
+
+    def test_disable(self):
+        rec = self.recorder
+        histogram = rec.histogram('set1', 'item1')
+        with self.assertRaises(RuntimeError):
+            histogram.add(1)
+        rec.disable()
+        histogram.add(5)
+        rec.enable()
+        histogram.add(7)
+        self.assertEqual(rec.get_result_summary()['histograms'],
+                {'set1': {'item1': {'count': 1, 'min': 7, 'max': 7,
+                    'mean': 7.0, 'p50': 7, 'p99': 7, 'p99.9': 7,
+                    'buckets': [[7, 1]]}}})
+
+    def test_replace_histograms(self):
+        rec = self.recorder
+        rec.enable()
+        histogram = rec.histogram('set1', 'item1')
+        histogram.add(5)
+        rec.histogram('set1', 'item2').add(3)
+
+        saved = cPickle.loads(cPickle.dumps(rec.histograms,
+            cPickle.HIGHEST_PROTOCOL))
+        histogram.add(6)
+        rec.histograms = {('set1', 'item1'): saved[('set1', 'item1')]}
+        histogram.add(8)
+
+        summaries = rec.get_result_summary()['histograms']['set1']
+        self.assertEqual(summaries['item1']['count'], 2)
+        self.assertEqual(summaries['item1']['max'], 8)
+        self.assertEqual(summaries['item2'], {'count': 0})
+
+
+class TestListener(unittest.TestCase):
+    def test_actions(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            rec = wiscsim.recorder.Recorder(
+                    output_target = wiscsim.recorder.FILE_TARGET,
+                    output_directory = tmpdir)
+            actions = []
+            rec.add_listener(lambda action, key: actions.append((action, key)))
+
+            rec.enable()
+            rec.set_result_by_one_key('interest_workload_end', 8)
+            rec.disable()
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(actions, [('enable', None),
+            ('set_result', 'interest_workload_end'), ('disable', None)])
+
+
+class TestColumnarTimeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_rows(self, timeline_format, n):
+        recorder = wiscsim.recorder.Recorder(
+                output_target = wiscsim.recorder.FILE_TARGET,
+                output_directory = self.tmpdir,
+                timeline_format = timeline_format)
+        for i in range(n):
+            recorder.write_timeline('timeline.txt', op_id = i,
+                    op = 'write_user', arg = i * 2,
+                    start_time = i * 0.5, end_time = i * 0.5 + 1)
+        recorder.close()
+
+    def test_text(self):
+        self.write_rows(wiscsim.recorder.TEXT_TIMELINE, 3)
+        with open(os.path.join(self.tmpdir, 'timeline.txt')) as f:
+            self.assertEqual(len(f.readlines()), 4)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmpdir, 'timeline.cols')))
+
+    def test_columnar(self):
+        from wiscsim import timelinewriter
+
+        self.write_rows(wiscsim.recorder.COLUMNAR_TIMELINE, 10)
+        path = os.path.join(self.tmpdir, 'timeline.cols')
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmpdir, 'timeline.txt')))
+
+        columns = timelinewriter.read_timeline(path)
+        self.assertItemsEqual(columns.keys(),
+                ['op_id', 'op', 'arg', 'start_time', 'end_time'])
+        self.assertEqual(list(columns['op_id']), range(10))
+        self.assertEqual(list(columns['op']), ['write_user'] * 10)
+        self.assertEqual(list(columns['end_time']),
+                [i * 0.5 + 1 for i in range(10)])
+
+        df = timelinewriter.read_timeline_dataframe(path)
+        self.assertEqual(len(df), 10)
+        self.assertEqual(df['arg'].sum(), 90)
+
+    def test_chunks(self):
+        from wiscsim import timelinewriter
+
+        path = os.path.join(self.tmpdir, 'x.cols')
+        writer = timelinewriter.ColumnarTimelineWriter(path, ['a', 'b'],
+                chunk_rows = 4)
+        for i in range(10):
+            writer.append({'a': i, 'b': i if i < 6 else float(i)})
+        writer.close()
+
+        chunks = list(timelinewriter.iter_chunks(path))
+        self.assertEqual([len(chunk['a']) for chunk in chunks], [4, 4, 2])
+        self.assertEqual([chunk['b'].typecode for chunk in chunks],
+                ['l', 'd', 'd'])
+
+        columns = timelinewriter.read_timeline(path)
+        self.assertEqual(list(columns['b']), range(10))
+
+    def test_empty(self):
+        from wiscsim import timelinewriter
+
+        path = os.path.join(self.tmpdir, 'x.cols')
+        writer = timelinewriter.ColumnarTimelineWriter(path, ['a'])
+        writer.close()
+        self.assertEqual(len(timelinewriter.read_timeline(path)['a']), 0)
 
 
 def main():
@@ -1,6 +1,15 @@
+import shutil
+import tempfile
 import unittest
+
+import config
 import wiscsim
+from wiscsim import hostevent
 from wiscsim.ftlsim_commons import *
+from wiscsim.host import Host
+from wiscsim.simulator import SimulatorDESNew
+from commons import *
+from utilities import utils
 
 
 class TestNCQSingleQueue(unittest.TestCase):
@@ -44,6 +53,217 @@ class TestNCQSingleQueueWithWaitTime(unittest.TestCase):
         ncq.slots.release(req)
 
 
+class TestNCQSingleQueueBarrier(unittest.TestCase):
+    """
+    Workers take requests like Ssd._process(). Requests after a barrier
+    must start after all requests before it are done.
+    """
+    def test_barrier(self):
+        env = simpy.Environment()
+        ncq = NCQSingleQueue(4, env)
+        self.times = {}
+
+        # (name, operation, duration)
+        requests = [('a', 'OP_WRITE', 5), ('b', 'OP_WRITE', 1),
+                ('barrier1', OP_BARRIER, 0),
+                ('c', 'OP_WRITE', 2), ('d', 'OP_WRITE', 1),
+                ('barrier2', OP_BARRIER, 0), ('barrier3', OP_BARRIER, 0),
+                ('e', 'OP_WRITE', 1)]
+        for name, operation, duration in requests:
+            ncq.queue.put(Request(name, operation, duration))
+        for i in range(4):
+            env.process(self.worker(env, ncq))
+        env.run()
+
+        # name: (start, end)
+        self.assertEqual(self.times, {
+            'a': (0, 5), 'b': (0, 1), 'barrier1': (0, 5),
+            'c': (5, 7), 'd': (5, 6), 'barrier2': (5, 7),
+            'barrier3': (7, 7), 'e': (7, 8)})
+        self.assertEqual(ncq.n_in_flight, 0)
+        self.assertFalse(ncq.in_barrier)
+
+    def worker(self, env, ncq):
+        while True:
+            req = yield ncq.queue.get()
+            start = env.now
+            if req.operation == OP_BARRIER:
+                yield env.process(ncq.barrier())
+            else:
+                yield env.timeout(req.duration)
+            self.times[req.name] = (start, env.now)
+            ncq.finish_request(req)
+
+
+class Request(object):
+    def __init__(self, name, operation, duration):
+        self.name = name
+        self.operation = operation
+        self.duration = duration
+
+
+class TestHostOpenLoop(unittest.TestCase):
+    def setUp(self):
+        self.conf = config.ConfigNCQFTL()
+        self.conf['SSDFramework']['ncq_depth'] = 1
+        self.conf['host_replay'] = 'open'
+
+    def write_event(self, offset, timestamp):
+        return hostevent.Event(sector_size=512, pid=0, operation=OP_WRITE,
+                offset=offset, size=4096, timestamp=timestamp)
+
+    def run_host(self, events, service_time):
+        """
+        A worker takes the events from the ncq, each taking service_time.
+        Return [(event, time taken from the ncq)] and the ncq.
+        """
+        env = simpy.Environment()
+        host = Host(self.conf, env, iter(events))
+        ncq = host.get_ncq()
+        taken = []
+
+        def worker():
+            while True:
+                event = yield ncq.queue.get()
+                if event.operation == OP_SHUT_SSD:
+                    break
+                taken.append((event, env.now))
+                if event.operation == OP_BARRIER:
+                    # as Ssd does
+                    yield env.process(ncq.barrier())
+                    event.barrier_done.succeed()
+                else:
+                    yield env.timeout(service_time)
+                ncq.finish_request(event)
+
+        env.process(host.run())
+        env.process(worker())
+        env.run()
+        return taken, ncq
+
+    def test_timestamps(self):
+        self.conf['host_time_scale'] = 2.0
+        events = [self.write_event(0, '1.5'), self.write_event(0, '1.500001'),
+                hostevent.ControlEvent(OP_BARRIER),
+                # times restart after a barrier
+                self.write_event(0, '0.2'), self.write_event(0, '0.200003'),
+                # late events are put right away
+                self.write_event(0, '0.1'), self.write_event(0, None),
+                self.write_event(-4096, '0.3')]
+        taken, _ = self.run_host(events, service_time=0)
+
+        times = [(event.enqueue_time, now) for event, now in taken]
+        self.assertEqual(len(times), 7)
+        for (enqueue_time, now), expected in zip(times,
+                [0, 2000, None, 2000, 8000, 8000, 8000]):
+            if expected is None:
+                self.assertEqual(enqueue_time, None)
+            else:
+                self.assertAlmostEqual(enqueue_time, expected, places=3)
+                self.assertAlmostEqual(now, expected, places=3)
+
+    def test_rebase_after_barrier(self):
+        events = [self.write_event(0, '0'), self.write_event(0, '0'),
+                hostevent.ControlEvent(OP_BARRIER),
+                self.write_event(0, '5'), self.write_event(0, '5.000001'),
+                hostevent.ControlEvent(OP_NOOP),
+                # other control events do not restart the times
+                self.write_event(0, '5.000002')]
+        taken, _ = self.run_host(events, service_time=100)
+
+        # the barrier drains at 200, after the two writes
+        expected = [(0, 0), (0, 100), (None, 200), (200, 200), (1200, 1200),
+                (None, 1300), (2200, 2200)]
+        self.assertEqual(len(taken), len(expected))
+        for (event, now), (enqueue_time, expected_now) in zip(taken,
+                expected):
+            if enqueue_time is None:
+                self.assertEqual(event.enqueue_time, None)
+            else:
+                self.assertAlmostEqual(event.enqueue_time, enqueue_time,
+                        places=3)
+            self.assertAlmostEqual(now, expected_now, places=3)
+
+    def test_queue_depth(self):
+        self.conf['host_queue_depth'] = 1
+        events = [self.write_event(i * 4096, '0') for i in range(3)]
+        taken, _ = self.run_host(events, service_time=100)
+        # the third event waits for room in the queue, but it still arrived
+        # at time 0
+        self.assertEqual([now for _, now in taken], [0, 100, 200])
+        self.assertEqual([event.enqueue_time for event, _ in taken],
+                [0, 0, 0])
+
+    def test_track_depth(self):
+        rec = wiscsim.recorder.Recorder(
+                output_target = wiscsim.recorder.STDOUT_TARGET,
+                output_directory = tempfile.mkdtemp())
+        rec.enable()
+        events = [self.write_event(i * 4096, '0') for i in range(3)]
+        env = simpy.Environment()
+        host = Host(self.conf, env, iter(events))
+        ncq = host.get_ncq()
+        ncq.track_depth(rec.histogram('queue_depth', 'outstanding'))
+
+        def worker():
+            while True:
+                event = yield ncq.queue.get()
+                if event.operation != OP_SHUT_SSD:
+                    yield env.timeout(100)
+                ncq.finish_request(event)
+
+        env.process(host.run())
+        env.process(worker())
+        env.run()
+
+        summary = rec.get_result_summary()['histograms']['queue_depth'][
+                'outstanding']
+        self.assertEqual(summary['buckets'], [[1, 100], [2, 100], [3, 100]])
+        self.assertEqual(summary['mean'], 2)
+        self.assertEqual(ncq.n_outstanding, 0)
+        shutil.rmtree(rec.output_directory)
+
+
+class TestSimulatorOpenLoop(unittest.TestCase):
+    def test_run(self):
+        conf = wiscsim.dftldes.Config()
+        conf['ftl_type'] = 'dftldes'
+        conf['simulator_class'] = 'SimulatorDESNew'
+        conf['host_replay'] = 'open'
+        conf['SSDFramework']['ncq_depth'] = 4
+        conf['flash_config']['n_pages_per_block'] = 8
+        conf['flash_config']['n_blocks_per_plane'] = 8
+        conf['flash_config']['n_planes_per_chip'] = 1
+        conf['flash_config']['n_chips_per_package'] = 1
+        conf['flash_config']['n_packages_per_channel'] = 1
+        conf['flash_config']['n_channels_per_dev'] = 4
+        utils.set_exp_metadata(conf, save_data = False,
+                expname = 'test_expname',
+                subexpname = 'test_subexpname')
+        conf.mapping_cache_bytes = 4 * conf.n_mapping_entries_per_page \
+                * conf['cache_entry_bytes']
+        conf.set_flash_num_blocks_by_bytes(int(8 * MB * 1.28))
+        utils.runtime_update(conf)
+
+        events = [hostevent.ControlEvent(OP_ENABLE_RECORDER)]
+        for i in range(100):
+            events.append(hostevent.Event(sector_size=512, pid=0,
+                operation=OP_WRITE, offset=(i % 64) * 4096, size=4096,
+                timestamp='{:.6f}'.format(i * 0.0001)))
+        sim = SimulatorDESNew(conf, iter(events))
+        sim.run()
+
+        histograms = sim.recorder.get_result_summary()['histograms']
+        self.assertEqual(sum(summary['count'] for summary in
+            histograms['host_latency'].values()), 100)
+        self.assertEqual(sum(summary['count'] for summary in
+            histograms['request_latency'].values()), 100)
+        # the last write is put at 9.9ms
+        self.assertGreaterEqual(sim.env.now, 9.9 * MILISEC)
+        self.assertGreater(histograms['queue_depth']['outstanding']['count'],
+                0)
+
+
 def main():
     unittest.main()
 
@@ -0,0 +1,54 @@
+import unittest
+
+from benchmarks import simulation
+
+
+def result(case, events_per_sec, peak_rss_mb, n_flash_ops):
+    return {'case': case, 'events_per_sec': events_per_sec,
+            'peak_rss_mb': peak_rss_mb, 'n_flash_ops': n_flash_ops}
+
+
+class TestCompareWithBaseline(unittest.TestCase):
+    def setUp(self):
+        self.baseline = {'results': [result('a', 100.0, 50.0, 10),
+                                     result('b', 100.0, 50.0, 10)]}
+
+    def compare(self, results):
+        return simulation.compare_with_baseline(results, self.baseline,
+                tolerance = 0.2)
+
+    def test_no_regression(self):
+        self.assertEqual(self.compare([result('a', 85.0, 55.0, 10),
+                                       result('c', 1.0, 500.0, 3)]), [])
+
+    def test_slower(self):
+        problems = self.compare([result('a', 70.0, 50.0, 10)])
+        self.assertEqual([name for name, _ in problems], ['a'])
+        self.assertIn('events/sec', problems[0][1])
+
+    def test_more_memory(self):
+        problems = self.compare([result('b', 100.0, 70.0, 10)])
+        self.assertEqual([name for name, _ in problems], ['b'])
+        self.assertIn('peak RSS', problems[0][1])
+
+    def test_behavior_changed(self):
+        problems = self.compare([result('a', 100.0, 50.0, 11)])
+        self.assertEqual([name for name, _ in problems], ['a'])
+        self.assertIn('flash ops', problems[0][1])
+
+
+class TestCases(unittest.TestCase):
+    def test_names_are_unique(self):
+        names = [simulation.case_name(case)
+                for case in simulation.all_cases()]
+        self.assertEqual(len(names), len(set(names)))
+
+        for case in simulation.quick_cases():
+            self.assertIn(case, simulation.all_cases())
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,7 @@ import unittest
 
 import wiscsim
 from utilities import utils
-from wiscsim.bitmap import FlashBitmap2
+from wiscsim.bitmap import FlashBitmap2, IndexedFlashBitmap2
 
 def create_config():
     conf = wiscsim.dftldes.Config()
@@ -67,6 +67,116 @@ class TestBitmap(unittest.TestCase):
         self.assertEqual(bitmap.block_valid_ratio(0),
                 1 - 1.0/conf.n_pages_per_block)
 
+    def test_block_counts(self):
+        conf = create_config()
+        bitmap = create_bitmap(conf)
+        n = conf.n_pages_per_block
+
+        bitmap.validate_page(0)
+        bitmap.validate_page(1)
+        bitmap.validate_page(2)
+        bitmap.invalidate_page(1)
+        # validating a valid page should not count it twice
+        bitmap.validate_page(0)
+
+        self.assertEqual(bitmap.block_valid_count(0), 2)
+        self.assertEqual(bitmap.block_invalid_count(0), 1)
+        self.assertEqual(bitmap.block_erased_count(0), n - 3)
+        self.assertEqual(bitmap.block_valid_ratio(0), 2.0 / n)
+        self.assertEqual(bitmap.block_invalid_ratio(0), (n - 2.0) / n)
+        self.assertEqual(bitmap.block_erased_ratio(0), (n - 3.0) / n)
+
+        bitmap.erase_block(0)
+        self.assertEqual(bitmap.block_valid_count(0), 0)
+        self.assertEqual(bitmap.block_invalid_count(0), 0)
+        self.assertEqual(bitmap.block_erased_ratio(0), 1)
+
+    def test_block_valid_ratios(self):
+        conf = create_config()
+        bitmap = create_bitmap(conf)
+        n = conf.n_pages_per_block
+
+        bitmap.validate_block(1)
+        bitmap.invalidate_page(n)
+
+        ratios = bitmap.block_valid_ratios()
+        self.assertEqual(len(ratios), conf.total_num_pages() / n)
+        self.assertEqual(ratios[0], 0)
+        self.assertEqual(ratios[1], (n - 1.0) / n)
+        for blocknum in range(len(ratios)):
+            self.assertEqual(ratios[blocknum],
+                    bitmap.block_valid_ratio(blocknum))
+
+    def test_block_page_states(self):
+        conf = create_config()
+        bitmap = create_bitmap(conf)
+        n = conf.n_pages_per_block
+
+        bitmap.validate_page(n)
+        bitmap.validate_page(n + 1)
+        bitmap.invalidate_page(n + 1)
+        bitmap.validate_page(2 * n - 1)
+
+        states = bitmap.block_page_states(1)
+        self.assertEqual(len(states), n)
+        for i, state in enumerate(states):
+            if bitmap.is_page_valid(n + i):
+                self.assertEqual(state, bitmap.VALID_CODE)
+            elif bitmap.is_page_invalid(n + i):
+                self.assertEqual(state, bitmap.INVALID_CODE)
+            else:
+                self.assertEqual(state, bitmap.ERASED_CODE)
+        self.assertEqual(states.count(bitmap.VALID_CODE), 2)
+        self.assertEqual(states[1], bitmap.INVALID_CODE)
+
+
+class TestIndexedBitmap(unittest.TestCase):
+    def test_valid_count_index(self):
+        conf = create_config()
+        bitmap = IndexedFlashBitmap2(conf)
+
+        # erased blocks are not indexed
+        self.assertEqual(len(bitmap.blocks_of_valid_count(0)), 0)
+
+        bitmap.validate_page(0)
+        bitmap.validate_page(1)
+        self.assertEqual(bitmap.blocks_of_valid_count(2), set([0]))
+
+        bitmap.invalidate_page(0)
+        self.assertEqual(bitmap.blocks_of_valid_count(1), set([0]))
+        self.assertEqual(len(bitmap.blocks_of_valid_count(2)), 0)
+
+        bitmap.invalidate_page(1)
+        self.assertEqual(bitmap.blocks_of_valid_count(0), set([0]))
+
+        bitmap.erase_block(0)
+        self.assertEqual(len(bitmap.blocks_of_valid_count(0)), 0)
+
+    def test_snapshot(self):
+        conf = create_config()
+        bitmap = IndexedFlashBitmap2(conf)
+        n = conf.n_pages_per_block
+
+        bitmap.validate_page(0)
+        bitmap.validate_page(n)
+
+        snapshot = bitmap.snapshot_valid_counts()
+        # changes after the snapshot are not seen in it
+        bitmap.invalidate_page(0)
+        bitmap.validate_page(n + 1)
+        bitmap.validate_page(2 * n)
+        bitmap.erase_block(1)
+
+        self.assertEqual(sorted(snapshot.blocks_of_valid_count(1)), [0, 1])
+        self.assertEqual(snapshot.blocks_of_valid_count(0), [])
+        self.assertEqual(snapshot.blocks_of_valid_count(2), [])
+
+        self.assertEqual(bitmap.blocks_of_valid_count(0), set([0]))
+        self.assertEqual(bitmap.blocks_of_valid_count(1), set([2]))
+
+        snapshot.close()
+        self.assertEqual(len(bitmap._snapshots), 0)
+
 
 def main():
     unittest.main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import config
+from pyreuse.sysutils import blocktrace
+
+
+RAW_PATH = os.path.join(os.path.dirname(__file__),
+        'testdata/blkparse-output.txt')
+
+
+class TestBlktraceResultStream(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.columns = config.Config()['event_file_column_names']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create_event_file(self, cls, name, **kwargs):
+        path = os.path.join(self.tmpdir, name)
+        parser = cls(512, self.columns, RAW_PATH, path, **kwargs)
+        parser.create_event_file()
+        with open(path) as f:
+            return f.read(), parser
+
+    def check_same_as_in_mem(self, do_sort, **kwargs):
+        expected, in_mem = self.create_event_file(
+                blocktrace.BlktraceResultInMem, 'inmem.txt', do_sort=do_sort)
+        actual, stream = self.create_event_file(
+                blocktrace.BlktraceResultStream, 'stream.txt', do_sort=do_sort,
+                **kwargs)
+
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(actual, expected)
+        self.assertEqual(stream.get_duration(), in_mem.get_duration())
+        for op in ('read', 'write', 'discard'):
+            self.assertEqual(stream.count_sectors(op), in_mem.count_sectors(op))
+
+        # temporary runs are removed
+        self.assertItemsEqual(os.listdir(self.tmpdir),
+                ['inmem.txt', 'stream.txt'])
+
+    def test_sorted(self):
+        self.check_same_as_in_mem(do_sort=True)
+
+    def test_sorted_many_runs(self):
+        self.check_same_as_in_mem(do_sort=True, sort_run_lines=7,
+                max_merge_runs=3)
+
+    def test_unsorted(self):
+        self.check_same_as_in_mem(do_sort=False)
+
+    def test_equal_timestamps_keep_order(self):
+        raw_path = os.path.join(self.tmpdir, 'raw.txt')
+        with open(raw_path, 'w') as f:
+            for i, ts in enumerate([2.0, 1.0, 1.0, 1.0, 0.5, 1.0]):
+                f.write("  8,0 0 {i} {ts:.9f} 1 D W {sec} + 8 [x]\n".format(
+                    i=i, ts=ts, sec=i * 8))
+        out_path = os.path.join(self.tmpdir, 'out.txt')
+        parser = blocktrace.BlktraceResultStream(512, ['offset'],
+                raw_path, out_path, sort_run_lines=2)
+        parser.create_event_file()
+
+        with open(out_path) as f:
+            offsets = [int(line) for line in f]
+        self.assertEqual(offsets, [4 * 4096, 4096, 2 * 4096, 3 * 4096,
+            5 * 4096, 0])
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
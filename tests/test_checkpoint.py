@@ -0,0 +1,166 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import config
+import wiscsim
+from wiscsim import checkpoint
+from wiscsim.simulator import SimulatorDESNew
+from workrunner.lbaworkloadgenerator import BlktraceEvents
+from commons import *
+from utilities import utils
+
+
+def create_config(ftl_type, ncq_depth):
+    if ftl_type == 'dftldes':
+        conf = wiscsim.dftldes.Config()
+        conf['n_gc_procs'] = 1
+    else:
+        conf = wiscsim.nkftl2.Config()
+        conf['nkftl']['max_blocks_in_log_group'] = 2
+        conf['nkftl']['n_blocks_in_data_group'] = 4
+    conf['ftl_type'] = ftl_type
+    conf['simulator_class'] = 'SimulatorDESNew'
+    conf['SSDFramework']['ncq_depth'] = ncq_depth
+
+    conf['flash_config']['n_pages_per_block'] = 8
+    conf['flash_config']['n_blocks_per_plane'] = 8
+    conf['flash_config']['n_planes_per_chip'] = 1
+    conf['flash_config']['n_chips_per_package'] = 1
+    conf['flash_config']['n_packages_per_channel'] = 1
+    conf['flash_config']['n_channels_per_dev'] = 4
+
+    utils.set_exp_metadata(conf, save_data = False,
+            expname = 'test_expname',
+            subexpname = 'test_subexpname')
+
+    logicsize_mb = 8
+    if ftl_type == 'dftldes':
+        conf.mapping_cache_bytes = 4 * conf.n_mapping_entries_per_page \
+                * conf['cache_entry_bytes']
+    conf.set_flash_num_blocks_by_bytes(int(logicsize_mb * 2**20 * 1.28))
+
+    utils.runtime_update(conf)
+
+    return conf
+
+
+def write_event_file(path, n_events, space_bytes, seed):
+    rand = random.Random(seed)
+    with open(path, 'w') as f:
+        for i in range(n_events):
+            op = rand.choice(['write', 'write', 'read', 'discard'])
+            offset = rand.randint(0, space_bytes / 4096 - 16) * 4096
+            size = rand.randint(1, 16) * 4096
+            f.write("0 D {} {} {} 0.0 0 False\n".format(op, offset, size))
+
+
+class TestAgingSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mkfs_path = os.path.join(self.tmpdir, 'mkfs.txt')
+        self.workload_path = os.path.join(self.tmpdir, 'workload.txt')
+        write_event_file(self.mkfs_path, 800, 8*MB, seed=1)
+        write_event_file(self.workload_path, 200, 8*MB, seed=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def setup_workload(self, conf, snapshot_dir):
+        conf['workload_src'] = config.LBAGENERATOR
+        conf['lba_workload_class'] = 'BlktraceEvents'
+        conf['lba_workload_configs']['mkfs_event_path'] = self.mkfs_path
+        conf['lba_workload_configs']['ftlsim_event_path'] = \
+                self.workload_path
+        conf['stop_sim_on_bytes'] = 'inf'
+        conf['aging_snapshot_dir'] = snapshot_dir
+
+    def run_simulator(self, conf):
+        random.seed(1)
+        sim = SimulatorDESNew(conf, iter(BlktraceEvents(conf)))
+        sim.run()
+        acc = sim.recorder.general_accumulator
+        results = {key: acc.get(key) for key in
+                ('flash_ops', 'traffic', 'Mapping_Cache')}
+        latency = sim.recorder.get_result_summary()['histograms'][
+                'request_latency']
+        results['request_latency'] = {item: summary['count']
+                for item, summary in latency.items()}
+        return results
+
+    def event_ops(self, conf):
+        return [event.operation for event in BlktraceEvents(conf)]
+
+    def check_ftl(self, ftl_type, ncq_depth):
+        snapshot_dir = os.path.join(self.tmpdir, 'snapshots')
+
+        conf = create_config(ftl_type, ncq_depth)
+        self.setup_workload(conf, snapshot_dir)
+        self.assertNotIn(OP_LOAD_STATE, self.event_ops(conf))
+        aged = self.run_simulator(conf)
+
+        snapshot_path = checkpoint.aging_snapshot_path(conf, self.mkfs_path)
+        self.assertTrue(os.path.exists(snapshot_path))
+
+        conf = create_config(ftl_type, ncq_depth)
+        self.setup_workload(conf, snapshot_dir)
+        ops = self.event_ops(conf)
+        self.assertIn(OP_LOAD_STATE, ops)
+        self.assertNotIn(OP_SAVE_STATE, ops)
+        restored = self.run_simulator(conf)
+
+        self.assertGreater(aged['flash_ops']['OP_WRITE'], 0)
+        # every request of the target workload, and none of aging
+        self.assertEqual(sum(aged['request_latency'].values()), 200)
+        self.assertDictEqual(aged, restored)
+
+    def test_dftldes(self):
+        self.check_ftl('dftldes', ncq_depth=1)
+
+    def test_dftldes_deep_ncq(self):
+        self.check_ftl('dftldes', ncq_depth=32)
+
+    def test_nkftl2(self):
+        self.check_ftl('nkftl2', ncq_depth=1)
+
+    def test_nkftl2_deep_ncq(self):
+        self.check_ftl('nkftl2', ncq_depth=32)
+
+    def test_key(self):
+        conf = create_config('dftldes', ncq_depth=1)
+        self.setup_workload(conf, self.tmpdir)
+        key = checkpoint.aging_snapshot_key(conf, self.mkfs_path)
+
+        # the target workload does not matter
+        conf['lba_workload_configs']['ftlsim_event_path'] = 'another'
+        conf['subexpname'] = 'another'
+        self.assertEqual(
+                checkpoint.aging_snapshot_key(conf, self.mkfs_path), key)
+
+        conf['n_gc_procs'] = 2
+        self.assertNotEqual(
+                checkpoint.aging_snapshot_key(conf, self.mkfs_path), key)
+
+        conf['n_gc_procs'] = 1
+        with open(self.mkfs_path, 'a') as f:
+            f.write("0 D write 0 4096 0.0 0 False\n")
+        self.assertNotEqual(
+                checkpoint.aging_snapshot_key(conf, self.mkfs_path), key)
+
+    def test_disabled(self):
+        conf = create_config('dftldes', ncq_depth=1)
+        self.setup_workload(conf, None)
+        self.assertEqual(checkpoint.aging_snapshot_path(conf, self.mkfs_path),
+                None)
+        ops = self.event_ops(conf)
+        self.assertNotIn(OP_SAVE_STATE, ops)
+        self.assertNotIn(OP_LOAD_STATE, ops)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import cPickle
+import unittest
+
+from wiscsim.densemap import DenseIntMap
+
+
+class TestDenseIntMap(unittest.TestCase):
+    def check_ops(self, m):
+        self.assertEqual(len(m), 0)
+        self.assertEqual(m.get(3), None)
+        self.assertEqual(m.get(3, 'UNINIT'), 'UNINIT')
+        self.assertRaises(KeyError, m.__getitem__, 3)
+
+        m[3] = 0
+        m[5] = 55
+        m[5] = 555
+        self.assertEqual(m[3], 0)
+        self.assertEqual(m[5], 555)
+        self.assertEqual(len(m), 2)
+        self.assertTrue(3 in m)
+        self.assertFalse(4 in m)
+        self.assertListEqual(m.items(), [(3, 0), (5, 555)])
+
+        del m[3]
+        self.assertFalse(m.has_key(3))
+        self.assertRaises(KeyError, m.__delitem__, 3)
+        self.assertEqual(m.pop(5), 555)
+        self.assertEqual(m.pop(5, None), None)
+        self.assertEqual(len(m), 0)
+
+    def test_array(self):
+        self.check_ops(DenseIntMap(8))
+
+    def test_mmap(self):
+        m = DenseIntMap(8, backing='mmap')
+        self.check_ops(m)
+        m.close()
+
+    def test_pickle(self):
+        for backing in ('array', 'mmap'):
+            m = DenseIntMap(8, backing=backing)
+            m[2] = 22
+            m[7] = 0
+            m2 = cPickle.loads(cPickle.dumps(m, cPickle.HIGHEST_PROTOCOL))
+            self.assertListEqual(m2.items(), [(2, 22), (7, 0)])
+            self.assertEqual(len(m2), 2)
+            m2[3] = 33
+            self.assertFalse(3 in m)
+            m.close()
+            m2.close()
+
+    def test_out_of_range(self):
+        m = DenseIntMap(8)
+        self.assertEqual(m.get(8), None)
+        self.assertFalse(8 in m)
+        self.assertRaises(IndexError, m.__setitem__, 8, 1)
+        self.assertRaises(ValueError, m.__setitem__, 1, -1)
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import shutil
+import tempfile
 import unittest
 import random
 import simpy
@@ -7,13 +9,14 @@ from wiscsim import ftlsim_commons
 from utilities import utils
 import wiscsim
 from wiscsim.ftlsim_commons import Extent
-from wiscsim.dftldes import LpnTable, LpnTableMvpn, UNINITIATED, \
-        split_ext_by_segment
+from wiscsim.dftldes import LpnTable, LpnTableMvpn, ArrayLpnTable, \
+        UNINITIATED, split_ext_by_segment, FREE_AND_LOCKED, USED_AND_HOLD
 from config import WLRUNNER, LBAGENERATOR, LBAMULTIPROC
 from commons import *
 from utilities.utils import get_expname
 import collections
-from workflow import run_workflow
+from workflow import run_workflow, Workflow
+from wiscsim.simulator import create_simulator
 
 class FtlTest(wiscsim.dftldes.Ftl):
     def get_mappings(self):
@@ -267,6 +270,44 @@ class TestMappingCacheLoad(unittest.TestCase):
         env.run()
 
 
+class TestMappingCacheBatch(unittest.TestCase):
+    def batch(self, conf, env, mapping_cache):
+        recorder = mapping_cache.recorder
+        recorder.enable()
+        n = conf.n_mapping_entries_per_page
+
+        # two lpns of m_vpn 0 and two of m_vpn 1
+        lpns = [n - 2, n - 1, n, n + 1]
+        ppns = yield env.process(mapping_cache.lpns_to_ppns(lpns))
+        self.assertListEqual(ppns, [UNINITIATED] * 4)
+        self.assertEqual(recorder.get_count_me('Mapping_Cache', 'miss'), 2)
+        self.assertEqual(recorder.get_count_me('Mapping_Cache', 'hit'), 2)
+
+        updated = []
+        yield env.process(mapping_cache.update_batch(
+            [(lpn, lpn * 10) for lpn in lpns],
+            after_each=lambda lpn, ppn: updated.append((lpn, ppn))))
+        self.assertListEqual(updated, [(lpn, lpn * 10) for lpn in lpns])
+        self.assertEqual(recorder.get_count_me('translation',
+            'overwrite-in-cache'), 4)
+
+        ppns = yield env.process(mapping_cache.lpns_to_ppns(lpns))
+        self.assertListEqual(ppns, [lpn * 10 for lpn in lpns])
+
+    def test_batch(self):
+        conf = create_config()
+        conf['batch_mapping_ops'] = True
+        conf.n_cache_entries = conf.n_mapping_entries_per_page * 4
+        objs = create_obj_set(conf)
+
+        mapping_cache = create_mapping_cache(objs)
+
+        env = objs['env']
+        env.process(self.batch(conf, env, mapping_cache))
+
+        env.run()
+
+
 class TestMappingCacheEviction(unittest.TestCase):
     def load(self, conf, env, mapping_cache):
         lpntable = mapping_cache._lpn_table
@@ -1018,8 +1059,10 @@ class TestDiscard(unittest.TestCase):
 
 
 class TestLpnTable(unittest.TestCase):
+    table_class = LpnTable
+
     def test_init(self):
-        table = LpnTable(8)
+        table = self.table_class(8)
         self.assertEqual(table.n_free_rows(), 8)
         self.assertEqual(table.n_locked_free_rows(), 0)
         self.assertEqual(table.n_used_rows(), 0)
@@ -1028,7 +1071,7 @@ class TestLpnTable(unittest.TestCase):
         """
         lock before adding, also you need to tell it which row you add to
         """
-        table = LpnTable(8)
+        table = self.table_class(8)
 
         rowid = table.lock_free_row()
         self.assertEqual(table.n_free_rows(), 7)
@@ -1062,7 +1105,7 @@ class TestLpnTable(unittest.TestCase):
         self.assertEqual(table.n_used_rows(), 0)
 
     def test_boundaries(self):
-        table = LpnTable(8)
+        table = self.table_class(8)
 
         for i in range(8):
             table.lock_free_row()
@@ -1070,7 +1113,7 @@ class TestLpnTable(unittest.TestCase):
         self.assertEqual(table.lock_free_row(), None)
 
     def test_multiple_adds(self):
-        table = LpnTable(8)
+        table = self.table_class(8)
 
         locked_rows = table.lock_free_rows(3)
         self.assertEqual(len(locked_rows), 3)
@@ -1086,7 +1129,7 @@ class TestLpnTable(unittest.TestCase):
         self.assertEqual(table.lpn_to_ppn(3), 33)
 
     def test_locking_lpn(self):
-        table = LpnTable(8)
+        table = self.table_class(8)
 
         locked_rows = table.lock_free_rows(3)
         self.assertEqual(len(locked_rows), 3)
@@ -1100,6 +1143,85 @@ class TestLpnTable(unittest.TestCase):
         self.assertEqual(table.n_used_rows(), 2)
         self.assertEqual(table.n_locked_used_rows(), 1)
 
+    def test_free_rows_reuse(self):
+        table = self.table_class(8)
+
+        locked_rows = table.lock_free_rows(8)
+        self.assertEqual(table.n_free_rows(), 0)
+        self.assertEqual(table.lock_free_rows(1), [])
+
+        table.unlock_free_rows([5, 2])
+        self.assertEqual(table.n_free_rows(), 2)
+        self.assertEqual(table.n_locked_free_rows(), 6)
+
+        # the lowest free row is used first
+        self.assertEqual(table.lock_free_row(), 2)
+        self.assertEqual(table.lock_free_rows(3), [5])
+        self.assertEqual(table.stats(), {FREE_AND_LOCKED: 8})
+
+    def test_hold_rows(self):
+        table = self.table_class(8)
+
+        locked_rows = table.lock_free_rows(2)
+        table.add_lpns(locked_rows, {1:11, 2:22}, False)
+        table.hold_used_rows(locked_rows)
+        self.assertEqual(table.n_used_rows(), 0)
+        self.assertEqual(table.stats()[USED_AND_HOLD], 2)
+
+        table.unhold_used_rows(locked_rows)
+        self.assertEqual(table.n_used_rows(), 2)
+        self.assertEqual(table.stats()[USED_AND_HOLD], 0)
+
+
+class TestArrayLpnTable(TestLpnTable):
+    table_class = ArrayLpnTable
+
+    def test_row_values(self):
+        table = self.table_class(4)
+        rowid = table.lock_free_row()
+        table.add_lpn(rowid = rowid, lpn = 3, ppn = UNINITIATED, dirty = False)
+        row = table.rows()[rowid]
+        self.assertEqual(row.lpn, 3)
+        self.assertEqual(row.ppn, UNINITIATED)
+        self.assertEqual(row.dirty, False)
+
+        table.overwrite_lpn(lpn = 3, ppn = 0, dirty = True)
+        self.assertEqual(row.ppn, 0)
+        self.assertEqual(row.dirty, True)
+
+        table.delete_lpn_and_lock(3)
+        self.assertEqual(row.lpn, None)
+        self.assertEqual(row.ppn, None)
+        self.assertEqual(row.dirty, None)
+        self.assertEqual(row.state, FREE_AND_LOCKED)
+
+
+class TestDenseMappingTables(unittest.TestCase):
+    def test_mapping_on_flash(self):
+        conf = create_config()
+        conf['mapping_table_storage'] = 'array'
+        gmt = create_mapping_on_flash(conf)
+
+        self.assertEqual(gmt.lpn_to_ppn(3), UNINITIATED)
+        gmt.batch_update({3: 33, 4: UNINITIATED})
+        self.assertEqual(gmt.lpn_to_ppn(3), 33)
+        self.assertEqual(gmt.lpn_to_ppn(4), UNINITIATED)
+        gmt.update(3, UNINITIATED)
+        self.assertEqual(gmt.lpn_to_ppn(3), UNINITIATED)
+
+    def test_oob(self):
+        conf = create_config()
+        conf['mapping_table_storage'] = 'mmap'
+        oob = create_oob(conf)
+
+        oob.relocate_data_page(lpn=7, old_ppn=UNINITIATED, new_ppn=1)
+        oob.data_page_move(lpn=7, old_ppn=1, new_ppn=2)
+        self.assertEqual(oob.ppn_to_lpn_or_mvpn(2), 7)
+        self.assertEqual(oob.timestamp_table[2], oob.timestamp_table[1])
+
+        oob.erase_block(0)
+        self.assertRaises(KeyError, oob.ppn_to_lpn_or_mvpn, 2)
+
 
 class TestLockPool(unittest.TestCase):
     def access_vpn(self, env, respool, vpn):
@@ -1241,6 +1363,95 @@ class TestFTLwithMoreData(unittest.TestCase):
         self.my_run()
 
 
+class TestFTLwithMixedOps(TestFTLwithMoreData):
+    """
+    TestFTLwithMoreData with reads, discards, deeper queue and more traffic,
+    so that mapping entries are written back and blocks are cleaned.
+    """
+    def setup_config(self):
+        super(TestFTLwithMixedOps, self).setup_config()
+        self.conf['SSDFramework']['ncq_depth'] = 8
+
+    def setup_workload(self):
+        super(TestFTLwithMixedOps, self).setup_workload()
+        workload = self.conf["lba_workload_configs"]["TestWorkloadFLEX3"]
+        workload['op_count'] *= 12
+        workload['ops'] = [OP_WRITE, OP_WRITE, OP_READ, OP_DISCARD]
+
+
+def run_simulation_case(case_class, **conf_updates):
+    """
+    Run the simulation of case_class, such as TestParallelDFTL, with
+    conf_updates applied to its config, and return its counters.
+    """
+    case = case_class('test_main')
+    case.setup_config()
+    case.setup_environment()
+    case.setup_workload()
+    case.setup_ftl()
+    case.conf.update(conf_updates)
+    utils.runtime_update(case.conf)
+
+    # the workloads and the block pools draw from random
+    random.seed(1)
+    event_iter = Workflow(case.conf).run_workload()
+    sim = create_simulator(case.conf['simulator_class'], case.conf,
+            event_iter)
+    sim.run()
+    acc = sim.recorder.general_accumulator
+    return {key: acc.get(key) for key in
+            ('flash_ops', 'traffic', 'Mapping_Cache')}
+
+
+class TestLpnTableStorageSimulation(unittest.TestCase):
+    def check_case(self, case_class):
+        objects = run_simulation_case(case_class,
+                lpn_table_storage='object')
+        arrays = run_simulation_case(case_class,
+                lpn_table_storage='array')
+
+        self.assertGreater(objects['Mapping_Cache']['hit'], 0)
+        self.assertDictEqual(objects, arrays)
+        return objects
+
+    def test_parallel_dftl(self):
+        self.check_case(TestParallelDFTL)
+
+    def test_more_data(self):
+        self.check_case(TestFTLwithMoreData)
+
+    def test_mixed_ops(self):
+        counters = self.check_case(TestFTLwithMixedOps)
+        self.assertGreater(counters['flash_ops']['OP_ERASE'], 0)
+
+
+class TestMappingTableStorageSimulation(unittest.TestCase):
+    def check_case(self, case_class):
+        dicts = run_simulation_case(case_class,
+                mapping_table_storage='dict')
+        for storage in ('array', 'mmap'):
+            counters = run_simulation_case(case_class,
+                    mapping_table_storage=storage)
+            self.assertDictEqual(dicts, counters)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            counters = run_simulation_case(case_class,
+                    mapping_table_storage='mmap',
+                    mapping_table_mmap_dir=tmpdir)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertDictEqual(dicts, counters)
+        return dicts
+
+    def test_parallel_dftl(self):
+        self.check_case(TestParallelDFTL)
+
+    def test_mixed_ops(self):
+        counters = self.check_case(TestFTLwithMixedOps)
+        self.assertGreater(counters['flash_ops']['OP_ERASE'], 0)
+
+
 class TestTranslationWithWrite(unittest.TestCase):
     def test(self):
         conf = create_config()
@@ -1576,6 +1787,40 @@ class TestVictimBlocks(unittest.TestCase):
 
         self.assertListEqual(victims, [block1, block0, block2])
 
+    def test_victims_of_changing_states(self):
+        conf = create_config()
+        conf['flash_config']['n_channels_per_dev'] = 1
+        conf['stripe_size'] = 'infinity'
+        block_pool = create_blockpool(conf)
+        oob = create_oob(conf)
+
+        # block i has i + 1 valid pages
+        n = conf.n_pages_per_block
+        blocks = []
+        for i in range(3):
+            ppns = block_pool.next_n_data_pages_to_program_striped(n)
+            oob.validate_ppns(ppns[:i + 1])
+            oob.invalidate_ppns(ppns[i + 1:])
+            blocks.append(conf.page_to_block_off(ppns[0])[0])
+
+        # use one more
+        ppns = block_pool.next_n_data_pages_to_program_striped(1)
+
+        vbs = wiscsim.dftldes.VictimBlocks(conf, block_pool, oob)
+        victim_iter = vbs.iterator()
+        self.assertEqual(next(victim_iter), blocks[0])
+
+        # states change in the middle of iteration. The order is decided
+        # when the iteration started.
+        ppn = conf.block_off_to_page(blocks[2], 0)
+        oob.invalidate_ppn(ppn)
+        oob.invalidate_ppn(ppn + 1)
+        self.assertListEqual(list(victim_iter), [blocks[1], blocks[2]])
+
+        # blocks with the same valid ratio are ordered by block number
+        self.assertListEqual(list(vbs.iterator()),
+                sorted([blocks[0], blocks[2]]) + [blocks[1]])
+
     def test_valid_ratio_stats(self):
         vbs = create_victimblocks()
         conf = vbs._conf
@@ -443,6 +443,34 @@ class TestOutOfBandAreas(unittest.TestCase):
         lpns_with_na = lpns + ['NA'] * (n_pages_per_block - 3)
         self.assertListEqual(sorted(oob.lpns_of_block(1)), sorted(lpns_with_na))
 
+    def test_block_pages(self):
+        conf = create_config()
+        oob = OutOfBandAreas(conf)
+
+        n_pages_per_block = conf.n_pages_per_block
+
+        ppns = range(1*n_pages_per_block, 1*n_pages_per_block+3)
+        for lpn, ppn in zip([3, 88, 23], ppns):
+            oob.remap(lpn=lpn, old_ppn=None, new_ppn=ppn)
+        oob.wipe_ppn(ppns[1])
+
+        states, lpns = oob.block_pages(1)
+        self.assertEqual(list(states[:3]), [oob.states.VALID_CODE,
+            oob.states.INVALID_CODE, oob.states.VALID_CODE])
+        self.assertEqual(list(states[3:]),
+            [oob.states.ERASED_CODE] * (n_pages_per_block - 3))
+        self.assertEqual(lpns, [3, 88, 23] + [None] * (n_pages_per_block - 3))
+
+        self.assertTrue(oob.is_any_page_valid(1))
+        self.assertFalse(oob.are_all_pages_invalid(1))
+        self.assertFalse(oob.are_all_pages_erased(1))
+        self.assertTrue(oob.are_all_pages_erased(2))
+
+        for ppn in range(1*n_pages_per_block, 2*n_pages_per_block):
+            oob.wipe_ppn(ppn)
+        self.assertFalse(oob.is_any_page_valid(1))
+        self.assertTrue(oob.are_all_pages_invalid(1))
+
 
 class TestLogBlockMappingTable(unittest.TestCase):
     def test_init(self):
@@ -502,6 +530,42 @@ class TestLogBlockMappingTable(unittest.TestCase):
         ppns = logmaptable.next_ppns_to_program(dgn=1, n=4, strip_unit_size=4)
         self.assertEqual(len(ppns), 4)
 
+    def test_find_group_by_pbn(self):
+        conf = create_config()
+        rec = create_recorder(conf)
+        helper = create_global_helper(conf)
+        block_pool = NKBlockPool(
+                n_channels=conf.n_channels_per_dev,
+                n_blocks_per_channel=conf.n_blocks_per_channel,
+                n_pages_per_block=conf.n_pages_per_block,
+                tags=[TDATA, TLOG])
+
+        logmaptable = LogMappingTable(conf, block_pool, rec, helper)
+
+        ppns_1 = logmaptable.next_ppns_to_program(dgn=1, n=4, strip_unit_size=4)
+        ppns_2 = logmaptable.next_ppns_to_program(dgn=2, n=4, strip_unit_size=4)
+        pbn_1, _ = conf.page_to_block_off(ppns_1[0])
+        pbn_2, _ = conf.page_to_block_off(ppns_2[0])
+
+        dgn, loggroup = logmaptable.find_group_by_pbn(pbn_1)
+        self.assertEqual(dgn, 1)
+        self.assertIs(loggroup, logmaptable.log_group_info[1])
+        self.assertTrue(logmaptable.is_log_block_of_group(pbn_1, 1))
+        self.assertFalse(logmaptable.is_log_block_of_group(pbn_1, 2))
+
+        dgn, curblock = logmaptable.find_block_by_pbn(pbn_2)
+        self.assertEqual(dgn, 2)
+        self.assertEqual(curblock.blocknum, pbn_2)
+
+        logmaptable.remove_log_block(data_group_no=1, log_pbn=pbn_1)
+        self.assertEqual(logmaptable.find_group_by_pbn(pbn_1), (None, None))
+        self.assertFalse(logmaptable.log_group_info[1].has_log_block(pbn_1))
+        self.assertEqual(logmaptable.log_group_info[1].n_log_blocks(), 0)
+
+        logmaptable.clear_data_group_info(2)
+        self.assertEqual(logmaptable.find_block_by_pbn(pbn_2), (None, None))
+        self.assertEqual(logmaptable.log_group_info[2].log_block_numbers(), [])
+
 
 class TestDataBlockMappingTable(unittest.TestCase):
     def test_init(self):
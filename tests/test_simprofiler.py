@@ -0,0 +1,226 @@
+import marshal
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+import wiscsim
+from wiscsim import simprofiler
+from wiscsim.hostevent import Event, ControlEvent
+from workflow import Workflow
+from commons import *
+from utilities import utils
+
+
+def create_config(result_dir):
+    conf = wiscsim.dftldes.Config()
+    conf['SSDFramework']['ncq_depth'] = 1
+
+    conf['flash_config']['n_pages_per_block'] = 64
+    conf['flash_config']['n_blocks_per_plane'] = 2
+    conf['flash_config']['n_planes_per_chip'] = 1
+    conf['flash_config']['n_chips_per_package'] = 1
+    conf['flash_config']['n_packages_per_channel'] = 1
+    conf['flash_config']['n_channels_per_dev'] = 4
+
+    conf['do_not_check_gc_setting'] = True
+    conf.GC_high_threshold_ratio = 0.96
+    conf.GC_low_threshold_ratio = 0
+
+    conf['enable_simulation'] = True
+
+    utils.set_exp_metadata(conf, save_data = False,
+            expname = 'test_expname',
+            subexpname = 'test_subexpname')
+
+    conf['ftl_type'] = 'dftldes'
+    conf['simulator_class'] = 'SimulatorDESNew'
+
+    logicsize_mb = 16
+    conf.n_cache_entries = conf.n_mapping_entries_per_page * 16
+    conf.set_flash_num_blocks_by_bytes(int(logicsize_mb * 2**20 * 1.28))
+
+    utils.runtime_update(conf)
+    conf['result_dir'] = result_dir
+
+    return conf
+
+
+def create_events(n_aging, n_workload):
+    events = [ControlEvent(OP_DISABLE_RECORDER)]
+    for i in range(n_aging):
+        events.append(Event(512, 0, OP_WRITE, i * 4096, 4096))
+    events.append(ControlEvent(OP_ENABLE_RECORDER))
+    for i in range(n_workload):
+        events.append(Event(512, 0, OP_WRITE, i * 4096, 4096))
+    events.append(ControlEvent(OP_REC_TIMESTAMP,
+        arg1='interest_workload_end'))
+    events.append(Event(512, 0, OP_WRITE, 0, 4096))
+    return events
+
+
+class TestProfileSimulator(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_workflow(self, profiler_type, window):
+        conf = create_config(self.tmpdir)
+        conf['profile_simulator'] = profiler_type
+        conf['profile_window'] = window
+        conf['profile_sampling_interval'] = 0.001
+
+        Workflow(conf).run_simulator(create_events(200, 200))
+
+        stats = pstats.Stats(
+                os.path.join(self.tmpdir, simprofiler.PSTATS_FILENAME))
+        with open(os.path.join(self.tmpdir,
+            simprofiler.COLLAPSED_FILENAME)) as f:
+            lines = f.read().splitlines()
+
+        self.assertGreater(len(lines), 0)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+        return stats, lines
+
+    def test_cprofile(self):
+        stats, lines = self.run_workflow(simprofiler.CPROFILE,
+                simprofiler.RUN_WINDOW)
+        funcnames = set(func[2] for func in stats.stats)
+        self.assertIn('run', funcnames)
+        self.assertTrue(any('write_ext' in line for line in lines))
+
+    def test_sampling(self):
+        self.run_workflow(simprofiler.SAMPLING, simprofiler.RUN_WINDOW)
+
+    def test_no_profiler(self):
+        conf = create_config(self.tmpdir)
+        Workflow(conf).run_simulator(create_events(1, 1))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmpdir, simprofiler.PSTATS_FILENAME)))
+
+    def test_unknown(self):
+        conf = create_config(self.tmpdir)
+        conf['profile_simulator'] = 'gprof'
+        with self.assertRaises(ValueError):
+            simprofiler.create_profiler(conf)
+
+
+class RecordingProfiler(simprofiler.SimulatorProfiler):
+    def __init__(self, window, recorder_results):
+        super(RecordingProfiler, self).__init__(window)
+        self.recorder_results = recorder_results
+        self.marks = []
+
+    def _start(self):
+        self.marks.append(('start', self.recorder_results.get(
+            'interest_workload_end')))
+
+    def _stop(self):
+        self.marks.append(('stop', self.recorder_results.get(
+            'interest_workload_end')))
+
+
+class TestWindow(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def profile(self, window, events):
+        conf = create_config(self.tmpdir)
+        simulator = wiscsim.simulator.create_simulator(
+                conf['simulator_class'], conf, events)
+        profiler = RecordingProfiler(window, simulator.recorder.result_dict)
+        profiler.profile_run(simulator)
+        return profiler.marks
+
+    def test_workload(self):
+        marks = self.profile(simprofiler.WORKLOAD_WINDOW,
+                create_events(10, 10))
+        # started when the recorder is enabled, stopped when
+        # interest_workload_end is recorded
+        self.assertEqual(len(marks), 2)
+        self.assertEqual(marks[0], ('start', None))
+        self.assertEqual(marks[1][0], 'stop')
+        self.assertIsNotNone(marks[1][1])
+
+    def test_workload_without_end(self):
+        events = [ControlEvent(OP_ENABLE_RECORDER),
+                  Event(512, 0, OP_WRITE, 0, 4096)]
+        marks = self.profile(simprofiler.WORKLOAD_WINDOW, events)
+        self.assertEqual(marks, [('start', None), ('stop', None)])
+
+    def test_run(self):
+        marks = self.profile(simprofiler.RUN_WINDOW, create_events(10, 10))
+        self.assertEqual(len(marks), 2)
+        self.assertEqual(marks[0], ('start', None))
+        # stopped after the end of the run
+        self.assertEqual(marks[1][0], 'stop')
+        self.assertIsNotNone(marks[1][1])
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_stats(self):
+        profiler = simprofiler.SamplingProfiler(simprofiler.RUN_WINDOW,
+                interval=0.001)
+        profiler.start()
+        t_end = time.time() + 0.2
+        while time.time() < t_end:
+            sum(range(100))
+        profiler.stop()
+
+        self.assertGreater(profiler.n_samples, 0)
+        stats = profiler.get_stats()
+        funcs = dict((func[2], value) for func, value in stats.stats.items())
+        n, _, _, ct, callers = funcs['test_stats']
+        self.assertEqual(n, profiler.n_samples)
+        self.assertAlmostEqual(ct, profiler.n_samples * 0.001)
+        self.assertEqual(profiler.stack_counts.most_common(1)[0][0][-1][2],
+                'test_stats')
+
+    def test_save_without_samples(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            profiler = simprofiler.SamplingProfiler(simprofiler.RUN_WINDOW)
+            profiler.save(tmpdir)
+            with open(os.path.join(tmpdir,
+                simprofiler.PSTATS_FILENAME), 'rb') as f:
+                self.assertEqual(marshal.load(f), {})
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestEstimateStacks(unittest.TestCase):
+    def test_split(self):
+        a = ('a.py', 1, 'a')
+        b = ('b.py', 1, 'b')
+        c = ('c.py', 1, 'c')
+        d = ('d.py', 1, 'd')
+        # a calls b and c, b and c call d
+        stats = {
+            a: (1, 1, 1.0, 10.0, {}),
+            b: (1, 1, 2.0, 4.0, {a: (1, 1, 2.0, 4.0)}),
+            c: (1, 1, 1.0, 5.0, {a: (1, 1, 1.0, 5.0)}),
+            d: (2, 2, 6.0, 6.0, {b: (1, 1, 2.0, 2.0), c: (1, 1, 4.0, 4.0)}),
+        }
+        stacks = simprofiler.estimate_stacks(stats)
+        self.assertEqual(dict(stacks), {
+            (a,): 1000000,
+            (a, b): 2000000,
+            (a, b, d): 2000000,
+            (a, c): 1000000,
+            (a, c, d): 4000000})
+
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
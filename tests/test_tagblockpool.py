@@ -1,3 +1,5 @@
+import cPickle
+import random
 import unittest
 from wiscsim.tagblockpool import *
 
@@ -158,6 +160,75 @@ class TestTagBlockPool(unittest.TestCase):
         print dist
 
 
+    def test_erased_block_ties(self):
+        pool = TagBlockPool(10, [TDATA, TTRANS])
+
+        # among blocks with the same count, the least erased one is the
+        # one with the largest number and the most erased one is the one
+        # with the smallest number
+        self.assertEqual(pool.get_least_or_most_erased_blocks(TFREE,
+            choice=LEAST_ERASED, nblocks=3), [9, 8, 7])
+        self.assertEqual(pool.get_least_or_most_erased_blocks(TFREE,
+            choice=MOST_ERASED, nblocks=3), [0, 1, 2])
+
+        pool.change_tag(9, TFREE, TDATA)
+        pool.change_tag(9, TDATA, TFREE)
+        self.assertEqual(pool.get_least_or_most_erased_blocks(TFREE,
+            choice=LEAST_ERASED, nblocks=2), [8, 7])
+        self.assertEqual(pool.get_least_or_most_erased_blocks(TFREE,
+            choice=MOST_ERASED, nblocks=2), [9, 0])
+
+    def test_erased_blocks_match_full_scan(self):
+        random.seed(1)
+        n = 200
+        pool = TagBlockPool(n, [TDATA, TTRANS])
+
+        for i in range(3000):
+            blocknum = random.randrange(n)
+            src = [tag for tag in (TFREE, TDATA, TTRANS)
+                    if blocknum in pool.get_blocks_of_tag(tag)][0]
+            dst = random.choice([tag for tag in (TFREE, TDATA, TTRANS)
+                    if tag != src])
+            pool.change_tag(blocknum, src, dst)
+
+            tag = random.choice((TFREE, TDATA, TTRANS))
+            choice = random.choice((LEAST_ERASED, MOST_ERASED))
+            nblocks = random.randint(1, 5)
+
+            counter = pool.get_erasure_count()
+            if choice == LEAST_ERASED:
+                blocks_by_cnt = reversed(counter.most_common())
+            else:
+                blocks_by_cnt = counter.most_common()
+            tag_blocks = pool.get_blocks_of_tag(tag)
+            expected = [blk for blk, _ in blocks_by_cnt
+                    if blk in tag_blocks][:nblocks]
+
+            self.assertEqual(
+                pool.get_least_or_most_erased_blocks(tag, choice, nblocks),
+                expected)
+
+    def test_setting_erasure_count(self):
+        pool = TagBlockPool(10, [TDATA])
+        pool._erasure_cnt[3] = 5
+
+        self.assertEqual(pool.pick(TFREE, choice=MOST_ERASED), 3)
+        self.assertEqual(pool.pick(TFREE, choice=LEAST_ERASED), 9)
+
+    def test_pickle(self):
+        pool = TagBlockPool(10, [TDATA])
+        pool._erasure_cnt[3] = 5
+        pool.change_tag(3, TFREE, TDATA)
+
+        pool2 = cPickle.loads(cPickle.dumps(pool, cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(pool2.get_erasure_count(), pool.get_erasure_count())
+        self.assertEqual(pool2.pick(TDATA, choice=MOST_ERASED), 3)
+
+        # the counter still updates the indexes of its own pool
+        pool2._erasure_cnt[4] = 7
+        self.assertEqual(pool2.pick(TFREE, choice=MOST_ERASED), 4)
+
+
 class TestBlockPoolWithCurBlocks(unittest.TestCase):
     def test_init(self):
         tmp = BlockPoolWithCurBlocks(100, [TDATA, TTRANS], NPAGESPERBLOCK)
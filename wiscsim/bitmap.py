@@ -1,3 +1,6 @@
+import array
+import itertools
+
 import bitarray
 import config
 
@@ -5,6 +8,8 @@ class FlashBitmap2(object):
     "Using two bit to represent state of a page"
     ERASED, VALID, INVALID = (bitarray.bitarray('00'),
         bitarray.bitarray('01'), bitarray.bitarray('10'))
+    # page state codes of block_page_states()
+    ERASED_CODE, VALID_CODE, INVALID_CODE = 0, 1, 2
 
     def __init__(self, conf):
         if not isinstance(conf, config.Config):
@@ -12,18 +17,45 @@ class FlashBitmap2(object):
                format(type(conf).__name__))
 
         self.conf  = conf
+        self.geometry = conf.geometry()
 
         # We use two bits to record state of a page so that
         # we will be able to record ERASED state
         self.bitmap = bitarray.bitarray(2 * conf.total_num_pages())
         self.bitmap.setall(0)
 
+        # Per-block page counts, kept up to date on every state change so
+        # that ratio queries do not have to scan the pages of a block.
+        # The number of erased pages is n_pages_per_block - valid - invalid.
+        self.n_pages_per_block = self.geometry.n_pages_per_block
+        self.n_blocks = self.geometry.n_blocks_per_dev
+        self._reset_counts()
+
+    def _reset_counts(self):
+        self._valid_cnt = array.array('l', [0]) * self.n_blocks
+        self._invalid_cnt = array.array('l', [0]) * self.n_blocks
+
+    def _uncount_page(self, pagenum):
+        """
+        Remove the current state of pagenum from the counts of its block.
+        It returns the block number.
+        """
+        blocknum = pagenum / self.n_pages_per_block
+        s = 2 * pagenum
+        if self.bitmap[s + 1]:
+            # VALID '01'
+            self._valid_cnt[blocknum] -= 1
+        elif self.bitmap[s]:
+            # INVALID '10'
+            self._invalid_cnt[blocknum] -= 1
+        return blocknum
+
     def pagenum_to_slice_range(self, pagenum):
         "2 is the number of bits representing the state of a page"
         return 2 * pagenum, 2 * (pagenum + 1)
 
     def blocknum_to_slice_range(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
+        start, end = self.geometry.block_to_page_range(blocknum)
         s, _ = self.pagenum_to_slice_range(start)
         # not that end is the first page after the block, so
         # the first bit of page end is the first bit after the block,
@@ -33,55 +65,63 @@ class FlashBitmap2(object):
         return s, e
 
     def validate_page(self, pagenum):
+        blocknum = self._uncount_page(pagenum)
         s, e = self.pagenum_to_slice_range(pagenum)
         self.bitmap[s:e] = self.VALID
+        self._valid_cnt[blocknum] += 1
 
     def invalidate_page(self, pagenum):
+        blocknum = self._uncount_page(pagenum)
         s, e = self.pagenum_to_slice_range(pagenum)
         self.bitmap[s:e] = self.INVALID
+        self._invalid_cnt[blocknum] += 1
 
     def validate_block(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
+        start, end = self.geometry.block_to_page_range(blocknum)
         for pg in range(start, end):
             self.validate_page(pg)
 
     def invalidate_block(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
+        start, end = self.geometry.block_to_page_range(blocknum)
         for pg in range(start, end):
             self.validate_page(pg)
 
     def erase_block(self, blocknum):
         s, e = self.blocknum_to_slice_range(blocknum)
         self.bitmap[s:e] = 0
+        self._valid_cnt[blocknum] = 0
+        self._invalid_cnt[blocknum] = 0
 
     def block_invalid_ratio(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
-        cnt = 0
-        for pg in range(start, end):
-            if not self.is_page_valid(pg):
-                cnt += 1
-
-        return cnt / float(self.conf.n_pages_per_block)
+        "Note that erased pages are also counted as invalid here"
+        cnt = self.n_pages_per_block - self._valid_cnt[blocknum]
+        return cnt / float(self.n_pages_per_block)
 
     def block_valid_ratio(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
-        cnt = 0
-        for pg in range(start, end):
-            if self.is_page_valid(pg):
-                cnt += 1
-
-        ret = cnt / float(self.conf.n_pages_per_block)
-        return ret
+        return self._valid_cnt[blocknum] / float(self.n_pages_per_block)
 
     def block_erased_ratio(self, blocknum):
-        start, end = self.conf.block_to_page_range(blocknum)
-        cnt = 0
-        for pg in range(start, end):
-            if self.is_page_erased(pg):
-                cnt += 1
+        cnt = self.n_pages_per_block - self._valid_cnt[blocknum] \
+                - self._invalid_cnt[blocknum]
+        return cnt / float(self.n_pages_per_block)
+
+    def block_valid_count(self, blocknum):
+        return self._valid_cnt[blocknum]
 
-        ret = cnt / float(self.conf.n_pages_per_block)
-        return ret
+    def block_invalid_count(self, blocknum):
+        return self._invalid_cnt[blocknum]
+
+    def block_erased_count(self, blocknum):
+        return self.n_pages_per_block - self._valid_cnt[blocknum] \
+                - self._invalid_cnt[blocknum]
+
+    def block_valid_ratios(self):
+        """
+        Return valid ratios of all blocks in one array, indexed by
+        block number.
+        """
+        npages = float(self.n_pages_per_block)
+        return array.array('d', [cnt / npages for cnt in self._valid_cnt])
 
     def is_page_valid(self, pagenum):
         s, e = self.pagenum_to_slice_range(pagenum)
@@ -103,6 +143,18 @@ class FlashBitmap2(object):
         s, e = self.blocknum_to_slice_range(blocknum)
         return self.bitmap[s:e]
 
+    def block_page_states(self, blocknum):
+        """
+        Return the states of all pages of blocknum in one array of
+        ERASED_CODE/VALID_CODE/INVALID_CODE, in page order.
+        """
+        bits = self.block_bits(blocknum)
+        # '01' is VALID and '10' is INVALID
+        valid = bits[1::2].tolist()
+        invalid = bits[0::2].tolist()
+        return array.array('b',
+            [v + 2 * i for v, i in itertools.izip(valid, invalid)])
+
     def page_state(self, pagenum):
         """
         This is usually for usage:
@@ -128,5 +180,115 @@ class FlashBitmap2(object):
         """ this method should be called in FTL """
         # set the state of all pages to ERASED
         self.bitmap.setall(0)
+        self._reset_counts()
+
+
+
+
+class IndexedFlashBitmap2(FlashBitmap2):
+    """
+    FlashBitmap2 that also indexes used blocks by their number of valid
+    pages, so garbage collectors can find blocks with few valid pages
+    without scanning all blocks.
+
+    A block is in the index if any of its pages is not erased. The index is
+    a bucket queue: bucket i is the set of used blocks with i valid pages.
+    """
+    def __init__(self, conf):
+        super(IndexedFlashBitmap2, self).__init__(conf)
+        self._snapshots = []
+        self._reset_index()
+
+    def _reset_index(self):
+        self._blocks_by_valid_cnt = [set() for _ in
+                range(self.n_pages_per_block + 1)]
+
+    def _indexed_valid_count(self, blocknum):
+        "Return None if blocknum is not in the index"
+        valid_cnt = self._valid_cnt[blocknum]
+        if valid_cnt + self._invalid_cnt[blocknum] == 0:
+            return None
+        return valid_cnt
+
+    def _record_change(self, blocknum):
+        if len(self._snapshots) > 0:
+            old_valid_cnt = self._indexed_valid_count(blocknum)
+            for snapshot in self._snapshots:
+                snapshot.record_change(blocknum, old_valid_cnt)
+
+    def validate_page(self, pagenum):
+        blocknum = pagenum / self.n_pages_per_block
+        self._record_change(blocknum)
+        self._blocks_by_valid_cnt[self._valid_cnt[blocknum]].discard(blocknum)
+        super(IndexedFlashBitmap2, self).validate_page(pagenum)
+        self._blocks_by_valid_cnt[self._valid_cnt[blocknum]].add(blocknum)
+
+    def invalidate_page(self, pagenum):
+        blocknum = pagenum / self.n_pages_per_block
+        self._record_change(blocknum)
+        self._blocks_by_valid_cnt[self._valid_cnt[blocknum]].discard(blocknum)
+        super(IndexedFlashBitmap2, self).invalidate_page(pagenum)
+        self._blocks_by_valid_cnt[self._valid_cnt[blocknum]].add(blocknum)
+
+    def erase_block(self, blocknum):
+        self._record_change(blocknum)
+        self._blocks_by_valid_cnt[self._valid_cnt[blocknum]].discard(blocknum)
+        super(IndexedFlashBitmap2, self).erase_block(blocknum)
+
+    def blocks_of_valid_count(self, valid_cnt):
+        """
+        Return the set of used blocks that have valid_cnt valid pages.
+        The set is owned by the index; do not modify it.
+        """
+        return self._blocks_by_valid_cnt[valid_cnt]
+
+    def snapshot_valid_counts(self):
+        """
+        Return a ValidCountSnapshot of the index. Close it when you are
+        done, otherwise every later change is copied into it.
+        """
+        snapshot = ValidCountSnapshot(self)
+        self._snapshots.append(snapshot)
+        return snapshot
+
+    def _close_snapshot(self, snapshot):
+        self._snapshots.remove(snapshot)
+
+    def initialize(self):
+        super(IndexedFlashBitmap2, self).initialize()
+        self._reset_index()
+        assert len(self._snapshots) == 0
+
+
+class ValidCountSnapshot(object):
+    """
+    The valid count index of IndexedFlashBitmap2 as it was when the
+    snapshot was taken. It is copy-on-write: only blocks changed after
+    that are copied, so taking and reading a snapshot do not have to scan
+    all blocks.
+    """
+    def __init__(self, bitmap):
+        self._bitmap = bitmap
+        # {blocknum: valid count at snapshot time, None if not in index}
+        self._old_valid_cnt = {}
+        # {valid count: set of changed blocks that had the count}
+        self._old_blocks_by_valid_cnt = {}
+
+    def record_change(self, blocknum, old_valid_cnt):
+        if blocknum in self._old_valid_cnt:
+            # only the first change has the state at snapshot time
+            return
+        self._old_valid_cnt[blocknum] = old_valid_cnt
+        if old_valid_cnt is not None:
+            self._old_blocks_by_valid_cnt.setdefault(old_valid_cnt,
+                    set()).add(blocknum)
 
+    def blocks_of_valid_count(self, valid_cnt):
+        blocks = [blocknum for blocknum in
+                self._bitmap.blocks_of_valid_count(valid_cnt)
+                if blocknum not in self._old_valid_cnt]
+        blocks.extend(self._old_blocks_by_valid_cnt.get(valid_cnt, ()))
+        return blocks
 
+    def close(self):
+        self._bitmap._close_snapshot(self)
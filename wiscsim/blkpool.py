@@ -46,6 +46,9 @@ class BlockPool(object):
 
         return blocks1 + blocks2
 
+    def get_tag(self, blocknum):
+        return self.pool.get_tag(blocknum)
+
     def get_wear_status(self):
         return self.pool.get_wear_status()
 
@@ -119,11 +122,12 @@ class BlockPool(object):
 
     def used_ratio(self):
         nfree = self.pool.count_blocks(tag=TFREE)
-        return (self.conf.n_blocks_per_dev - nfree) / float(self.conf.n_blocks_per_dev)
+        n_blocks_per_dev = self.pool.n_blocks_per_dev
+        return (n_blocks_per_dev - nfree) / float(n_blocks_per_dev)
 
     def total_used_blocks(self):
         nfree = self.pool.count_blocks(tag=TFREE)
-        return self.conf.n_blocks_per_dev - nfree
+        return self.pool.n_blocks_per_dev - nfree
 
     def num_freeblocks(self):
         nfree = self.pool.count_blocks(tag=TFREE)
@@ -0,0 +1,187 @@
+"""
+Checkpoints of the state of a simulated SSD.
+
+A checkpoint holds the FTL (mapping tables, OOB, block pool with erasure
+counts, mapping cache, ...) and the recorder results. It is used to skip
+the aging (mkfs) phase of BlktraceEvents: the first run saves the state
+after aging, and later runs with the same config and aging trace load it
+instead of replaying the aging events.
+
+The simpy environment, recorder, config and flash controller are not part
+of a checkpoint. The loaded FTL is attached to those of the new run, and
+its counter handles to the counters of the new recorder.
+simpy resources are recreated empty, so a checkpoint must be taken when no
+request is in flight, for example after a barrier. The simulated time is
+saved too, and Ssd moves the clock of the new run to it after loading, so
+the loaded run gives the same results as the run that saved the checkpoint
+at any ncq depth.
+"""
+import cPickle
+import hashlib
+import json
+import os
+import random
+import tempfile
+
+import simpy
+
+import recorder
+
+CHECKPOINT_VERSION = 3
+
+# Config keys that do not change the state of the FTL after aging. The
+# aging trace is hashed separately. exp_parameters is left out because the
+# parameters that matter to the FTL are copied to their own keys.
+RUN_ONLY_CONF_KEYS = ('result_dir', 'expname', 'subexpname', 'time', 'hash',
+        'exp_parameters', 'lba_workload_class', 'lba_workload_configs',
+        'stop_sim_on_bytes', 'aging_snapshot_dir', 'verbose_level',
+        'output_target', 'print_when_finished', 'timeline_format',
+        'record_request_latency',
+        'profile_simulator', 'profile_window', 'profile_sampling_interval',
+        'linux_version', 'n_online_cpus')
+
+
+def aging_snapshot_key(conf, aging_event_path):
+    """
+    Return a key that changes when the config or the aging trace changes.
+    """
+    conf_items = dict((k, v) for k, v in conf.items()
+            if k not in RUN_ONLY_CONF_KEYS)
+
+    h = hashlib.sha1()
+    h.update(str(CHECKPOINT_VERSION))
+    h.update(json.dumps(conf_items, sort_keys=True, default=repr))
+    with open(aging_event_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), ''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def aging_snapshot_path(conf, aging_event_path):
+    """
+    Return the path of the aging checkpoint, or None if
+    conf['aging_snapshot_dir'] is not set.
+    """
+    snapshot_dir = conf.get('aging_snapshot_dir', None)
+    if snapshot_dir is None:
+        return None
+
+    key = aging_snapshot_key(conf, aging_event_path)
+    return os.path.join(snapshot_dir, 'aging-{}.pickle'.format(key))
+
+
+class _SsdPickler(object):
+    def __init__(self, ssd):
+        self.shared = {
+                id(ssd.env): 'env',
+                id(ssd.recorder): 'recorder',
+                id(ssd.conf): 'conf',
+                id(ssd.flash_controller): 'flash_controller'}
+
+    def persistent_id(self, obj):
+        name = self.shared.get(id(obj), None)
+        if name is not None:
+            return name
+
+        if isinstance(obj, recorder.CounterHandle):
+            return ('CounterHandle', obj.counter_set_name, obj.item_name)
+
+        if isinstance(obj, simpy.Resource):
+            if len(obj.users) > 0 or len(obj.queue) > 0:
+                raise RuntimeError("Cannot checkpoint a resource in use. "
+                    "Is a request in flight?")
+            return ('Resource', obj.capacity)
+
+        if isinstance(obj, simpy.Container):
+            if len(obj.put_queue) > 0 or len(obj.get_queue) > 0:
+                raise RuntimeError("Cannot checkpoint a container in use. "
+                    "Is a request in flight?")
+            return ('Container', obj.capacity, obj.level)
+
+        return None
+
+
+class _SsdUnpickler(object):
+    def __init__(self, ssd):
+        self.env = ssd.env
+        self.recorder = ssd.recorder
+        self.shared = {
+                'env': ssd.env,
+                'recorder': ssd.recorder,
+                'conf': ssd.conf,
+                'flash_controller': ssd.flash_controller}
+
+    def persistent_load(self, pid):
+        if isinstance(pid, tuple):
+            if pid[0] == 'Resource':
+                return simpy.Resource(self.env, capacity=pid[1])
+            elif pid[0] == 'Container':
+                return simpy.Container(self.env, capacity=pid[1],
+                        init=pid[2])
+            elif pid[0] == 'CounterHandle':
+                return self.recorder.counter(pid[1], pid[2])
+        elif pid in self.shared:
+            return self.shared[pid]
+
+        raise cPickle.UnpicklingError(
+                "Unknown persistent id {}".format(pid))
+
+
+def save_ssd_state(ssd, path):
+    """
+    Save the FTL and the recorder results of ssd to path. The file is
+    written under a temporary name and renamed, so runs in parallel never
+    see a partial checkpoint.
+    """
+    state = {'version': CHECKPOINT_VERSION,
+             'ftl': ssd.ftl,
+             'gc_sleep_timer': ssd.gc_sleep_timer,
+             'now': ssd.env.now,
+             # block pools and log groups pick channels randomly
+             'random_state': random.getstate(),
+             'recorder_results': ssd.recorder.get_result_summary(),
+             'recorder_histograms': ssd.recorder.histograms}
+
+    dir_path = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.tmp')
+    try:
+        os.chmod(tmp_path, 0644)
+        with os.fdopen(fd, 'wb') as f:
+            pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = _SsdPickler(ssd).persistent_id
+            pickler.dump(state)
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def load_ssd_state(ssd, path):
+    """
+    Replace the FTL and the recorder results of ssd by the ones saved in
+    path. Return the simulated time when the checkpoint was saved.
+    """
+    with open(path, 'rb') as f:
+        unpickler = cPickle.Unpickler(f)
+        unpickler.persistent_load = _SsdUnpickler(ssd).persistent_load
+        state = unpickler.load()
+
+    if state['version'] != CHECKPOINT_VERSION:
+        raise RuntimeError("Checkpoint {} has version {}, expecting {}"
+            .format(path, state['version'], CHECKPOINT_VERSION))
+
+    ssd.ftl = state['ftl']
+    ssd.gc_sleep_timer = state['gc_sleep_timer']
+    random.setstate(state['random_state'])
+
+    rec = ssd.recorder
+    rec.result_dict.clear()
+    rec.result_dict.update(state['recorder_results'])
+    rec.general_accumulator = rec.result_dict['general_accumulator']
+    rec.histograms = state.get('recorder_histograms', {})
+
+    return state['now']
@@ -1,6 +1,6 @@
 import simpy
 import wiscsim
-from collections import Counter
+from collections import Counter, OrderedDict
 from commons import *
 
 class FlashAddress(object):
@@ -93,6 +93,9 @@ def create_flashrequest(addr, op):
     return req
 
 
+FLASH_OPS = {'read': OP_READ, 'write': OP_WRITE, 'erase': OP_ERASE}
+
+
 class Controller(object):
     """
     This base class implements the core functions of a flash controller.
@@ -101,6 +104,7 @@ class Controller(object):
     def __init__(self, simpy_env, conf):
         self.env = simpy_env
         self.conf = conf
+        self.geometry = conf.geometry()
 
         # TODO: should these be in config?
         self.page_size = self.conf['flash_config']['page_size']
@@ -168,10 +172,7 @@ class Controller(object):
 
         # page_hierarchy has [channel, package, ..., block]
         # location has       [channel, package, ..., block, page]
-        for i, count in enumerate(self.page_hierarchy):
-            addr.location[i] = page_no / count
-            page_no = page_no % count
-        addr.location[-1] = page_no
+        addr.location = self.geometry.page_to_location(page_no)
 
         return addr
 
@@ -247,9 +248,24 @@ class Controller3(Controller):
         super(Controller3, self).__init__(simpy_env, conf)
 
         self.recorder = recorderobj
-        self.channels = [Channel3(self.env, conf, self.recorder, i)
+        channel_class = CHANNEL_MODELS[self.conf.get('channel_model',
+            'resource')]
+        self.channels = [channel_class(self.env, conf, self.recorder, i)
                 for i in range( self.n_channels_per_dev)]
 
+        # {OP_READ: CounterHandle, ...}
+        self._flash_op_counters = dict(
+                (operation, self.recorder.counter('flash_ops', operation))
+                for operation in FLASH_OPS.values())
+
+    def _count_flash_op(self, operation, n_ops=1):
+        counter = self._flash_op_counters.get(operation, None)
+        if counter is None:
+            self.recorder.add_to_general_accumulater('flash_ops', operation,
+                    n_ops)
+        else:
+            counter.add(n_ops)
+
     def execute_request_list(self, flash_request_list, tag):
         procs = []
         for request in flash_request_list:
@@ -273,29 +289,72 @@ class Controller3(Controller):
             self.channels[addr.channel].erase_block(tag = tag, addr = None))
 
     def rw_ppns(self, ppns, op, tag):
-        procs = []
-        for ppn in ppns:
-            p = self.env.process(
-                    self.rw_ppn_extent(ppn, 1, op, tag))
-            procs.append(p)
+        """
+        op is 'read' or 'write'
+        """
+        if self.conf['coalesce_channel_ops'] is True:
+            n_pages_per_channel = self.n_pages_per_channel
+            yield self.env.process(self.execute_coalesced(
+                [ppn / n_pages_per_channel for ppn in ppns], op, tag))
+        else:
+            procs = []
+            for ppn in ppns:
+                p = self.env.process(
+                        self.rw_ppn_extent(ppn, 1, op, tag))
+                procs.append(p)
 
-        yield simpy.events.AllOf(self.env, procs)
+            yield simpy.events.AllOf(self.env, procs)
 
     def rw_ppn_extent(self, ppn_start, ppn_count, op, tag):
         """
         op is 'read' or 'write'
         """
-        flash_reqs = self.get_flash_requests_for_ppns(ppn_start, ppn_count,
-            op = op)
-        yield self.env.process( self.execute_request_list(flash_reqs, tag) )
+        if self.conf['coalesce_channel_ops'] is True:
+            n_pages_per_channel = self.n_pages_per_channel
+            yield self.env.process(self.execute_coalesced(
+                [ppn / n_pages_per_channel
+                    for ppn in range(ppn_start, ppn_start + ppn_count)],
+                op, tag))
+        else:
+            flash_reqs = self.get_flash_requests_for_ppns(ppn_start,
+                ppn_count, op = op)
+            yield self.env.process(self.execute_request_list(flash_reqs, tag))
 
     def erase_pbn_extent(self, pbn_start, pbn_count, tag):
-        flash_reqs = self.get_flash_requests_for_pbns(pbn_start, pbn_count,
-                op = 'erase')
-        yield self.env.process( self.execute_request_list(flash_reqs, tag) )
+        if self.conf['coalesce_channel_ops'] is True:
+            n_blocks_per_channel = \
+                    self.n_pages_per_channel / self.n_pages_per_block
+            yield self.env.process(self.execute_coalesced(
+                [pbn / n_blocks_per_channel
+                    for pbn in range(pbn_start, pbn_start + pbn_count)],
+                'erase', tag))
+        else:
+            flash_reqs = self.get_flash_requests_for_pbns(pbn_start,
+                pbn_count, op = 'erase')
+            yield self.env.process(self.execute_request_list(flash_reqs, tag))
+
+    def execute_coalesced(self, channel_ids, op, tag):
+        """
+        Do one op ('read', 'write' or 'erase') for each channel id in
+        channel_ids. Operations on the same channel are done back to back by
+        one process holding the channel, instead of one process per page.
+        The timing is the same as executing one request per page if no other
+        request comes to the channel in the middle.
+        """
+        n_ops_of_channel = OrderedDict()
+        for channel_id in channel_ids:
+            n_ops_of_channel[channel_id] = \
+                    n_ops_of_channel.get(channel_id, 0) + 1
+
+        if len(channel_ids) > 0:
+            self._count_flash_op(FLASH_OPS[op], len(channel_ids))
+
+        events = [self.channels[channel_id].ops_event(op, n_ops, tag)
+                for channel_id, n_ops in n_ops_of_channel.items()]
+        yield simpy.events.AllOf(self.env, events)
 
     def execute_request(self, flash_request, tag):
-        self.recorder.count_me('flash_ops', flash_request.operation)
+        self._count_flash_op(flash_request.operation)
         if flash_request.operation == OP_READ:
             yield self.env.process(
                     self.read_page(addr = flash_request.addr, tag = tag))
@@ -416,9 +475,33 @@ class Channel3(Channel2):
     """
     Operations can be tagged
     """
+    def __init__(self, simpy_env, conf, recorderobj, channel_id = None):
+        super(Channel3, self).__init__(simpy_env, conf, recorderobj,
+                channel_id)
+        # {(op, tag group): CounterHandle}
+        self._busy_time_counters = {}
+
     def counter_set_name(self):
         return "channel_busy_time"
 
+    def _add_busy_time(self, op, tag, duration):
+        tag_group = self.recorder.tag_group(tag)
+        if not isinstance(tag_group, str):
+            # tags of unknown groups have their own counters
+            self.recorder.add_to_timer(self.counter_set_name(),
+                "channel_{id}-{op}-{tag}".format(id = self.channel_id, op = op,
+                    tag = tag_group),
+                duration)
+            return
+
+        counter = self._busy_time_counters.get((op, tag_group), None)
+        if counter is None:
+            counter = self.recorder.counter(self.counter_set_name(),
+                "channel_{id}-{op}-{tag}".format(id = self.channel_id, op = op,
+                    tag = tag_group))
+            self._busy_time_counters[(op, tag_group)] = counter
+        counter.add(duration)
+
     def _convert_tag(self, tag):
         if isinstance(tag, dict):
             return tag
@@ -429,7 +512,7 @@ class Channel3(Channel2):
         write = self.conf.get("write_channel_timeline", False)
         if write is True:
             tag = self._convert_tag(tag)
-            self.recorder.write_file('channel_timeline.txt',
+            self.recorder.write_timeline('channel_timeline.txt',
                 channel=channel_id, start_time=start_time, end_time=end_time,
                 **tag)
 
@@ -444,11 +527,7 @@ class Channel3(Channel2):
             s = self.env.now
             yield self.env.timeout( self.program_time )
             e = self.env.now
-            self.recorder.add_to_timer(
-                self.counter_set_name(),
-                "channel_{id}-write-{tag}".format(id = self.channel_id,
-                    tag = self.recorder.tag_group(tag)),
-                e - s)
+            self._add_busy_time('write', tag, e - s)
             self._write_channel_timeline(channel_id=self.channel_id,
                     start_time=s, end_time=e, tag=tag)
 
@@ -458,11 +537,7 @@ class Channel3(Channel2):
             s = self.env.now
             yield self.env.timeout( self.read_time )
             e = self.env.now
-            self.recorder.add_to_timer(
-                self.counter_set_name(),
-                "channel_{id}-read-{tag}".format(id = self.channel_id,
-                    tag = self.recorder.tag_group(tag)),
-                e - s)
+            self._add_busy_time('read', tag, e - s)
             self._write_channel_timeline(channel_id=self.channel_id,
                     start_time=s, end_time=e, tag=tag)
 
@@ -472,11 +547,91 @@ class Channel3(Channel2):
             s = self.env.now
             yield self.env.timeout( self.erase_time )
             e = self.env.now
-            self.recorder.add_to_timer(
-                self.counter_set_name(),
-                "channel_{id}-erase-{tag}".format(id = self.channel_id,
-                    tag = self.recorder.tag_group(tag)),
-                e - s)
+            self._add_busy_time('erase', tag, e - s)
             self._write_channel_timeline(channel_id=self.channel_id,
                     start_time=s, end_time=e, tag=tag)
 
+    def execute_ops(self, op, n_ops, tag):
+        """
+        Do n_ops operations of op ('read', 'write' or 'erase') back to back
+        with the channel requested once.
+        """
+        op_time = {'read': self.read_time, 'write': self.program_time,
+                'erase': self.erase_time}[op]
+        with self.resource.request() as request:
+            yield request
+            s = self.env.now
+            yield self.env.timeout(op_time * n_ops)
+            e = self.env.now
+            self._add_busy_time(op, tag, e - s)
+            for i in range(n_ops):
+                self._write_channel_timeline(channel_id=self.channel_id,
+                        start_time=s + i * op_time,
+                        end_time=s + (i + 1) * op_time, tag=tag)
+
+    def ops_event(self, op, n_ops, tag):
+        """
+        Return an event that happens when execute_ops() is done.
+        """
+        return self.env.process(self.execute_ops(op, n_ops, tag))
+
+
+class AnalyticalChannel3(Channel3):
+    """
+    Channel3 without a simpy resource. Since a channel serves operations
+    one at a time in FIFO order and each takes a fixed time, it only keeps
+    the time it becomes free. An operation starts at
+    max(now, next_free_time) and the caller waits for it with a single
+    timeout, instead of a resource request, a release and a timeout.
+
+    Busy time and the channel timeline are recorded when the operation
+    ends, as Channel3 does, and have the same values for the same
+    operations. The caller is woken up with fewer simpy events than with
+    Channel3, so processes woken up at the same time may run in another
+    order, and FTLs with concurrent processes (e.g. GC) may issue
+    different operations.
+    """
+    def __init__(self, simpy_env, conf, recorderobj, channel_id = None):
+        super(AnalyticalChannel3, self).__init__(simpy_env, conf,
+                recorderobj, channel_id)
+        self.resource = None
+        self.next_free_time = self.env.now
+
+    def ops_event(self, op, n_ops, tag):
+        """
+        Reserve the channel for n_ops operations of op ('read', 'write' or
+        'erase') back to back and return the timeout that ends them.
+        """
+        op_time = {'read': self.read_time, 'write': self.program_time,
+                'erase': self.erase_time}[op]
+        now = self.env.now
+        s = max(now, self.next_free_time)
+        e = s + op_time * n_ops
+        self.next_free_time = e
+
+        def record(event):
+            self._add_busy_time(op, tag, e - s)
+            for i in range(n_ops):
+                self._write_channel_timeline(channel_id=self.channel_id,
+                        start_time=s + i * op_time,
+                        end_time=s + (i + 1) * op_time, tag=tag)
+
+        timeout = self.env.timeout(e - now)
+        timeout.callbacks.append(record)
+        return timeout
+
+    def write_page(self, tag, addr = None , data = None):
+        yield self.ops_event('write', 1, tag)
+
+    def read_page(self, tag, addr = None):
+        yield self.ops_event('read', 1, tag)
+
+    def erase_block(self, tag, addr = None):
+        yield self.ops_event('erase', 1, tag)
+
+    def execute_ops(self, op, n_ops, tag):
+        yield self.ops_event(op, n_ops, tag)
+
+
+# conf['channel_model'] -> channel class of Controller3
+CHANNEL_MODELS = {'resource': Channel3, 'analytical': AnalyticalChannel3}
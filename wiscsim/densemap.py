@@ -0,0 +1,154 @@
+import array
+import ctypes
+import mmap
+import tempfile
+
+
+ABSENT = 0
+
+
+class DenseIntMap(object):
+    """
+    A dict-like map from integers in [0, n_keys) to non-negative integers,
+    kept in one preallocated array instead of a dict. It costs 8 bytes per
+    key instead of ~100 bytes per dict entry, which matters for tables that
+    eventually cover every page of the device, such as the global mapping
+    table and the OOB reverse map.
+
+    Value v is stored as v + 1, so 0 means the key is absent and a new map
+    is all zeros.
+
+    backing:
+        'array': array.array in memory.
+        'mmap': anonymous mmap, or a sparse temporary file in mmap_dir if
+            it is given. Pages of the map that are never written are never
+            allocated, and a file-backed map can be larger than memory.
+    """
+    def __init__(self, n_keys, backing='array', mmap_dir=None):
+        self.n_keys = n_keys
+        self._backing = backing
+        self._mmap_dir = mmap_dir
+        self._n_present = 0
+        self._file = None
+        self._mmap = None
+
+        if backing == 'array':
+            self._values = array.array('l', [ABSENT]) * n_keys
+        elif backing == 'mmap':
+            n_bytes = max(n_keys, 1) * ctypes.sizeof(ctypes.c_long)
+            if mmap_dir is None:
+                self._mmap = mmap.mmap(-1, n_bytes)
+            else:
+                self._file = tempfile.TemporaryFile(dir=mmap_dir)
+                self._file.truncate(n_bytes)
+                self._mmap = mmap.mmap(self._file.fileno(), n_bytes)
+            self._values = (ctypes.c_long * n_keys).from_buffer(self._mmap)
+        else:
+            raise ValueError("backing {} is not supported".format(backing))
+
+    def _check_key(self, key):
+        if not 0 <= key < self.n_keys:
+            raise IndexError("key {} is out of range [0, {})".format(
+                key, self.n_keys))
+
+    def __getitem__(self, key):
+        if 0 <= key < self.n_keys:
+            v = self._values[key]
+            if v != ABSENT:
+                return v - 1
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if 0 <= key < self.n_keys:
+            v = self._values[key]
+            if v != ABSENT:
+                return v - 1
+        return default
+
+    def __setitem__(self, key, value):
+        self._check_key(key)
+        if value < 0:
+            raise ValueError("value {} is negative".format(value))
+        if self._values[key] == ABSENT:
+            self._n_present += 1
+        self._values[key] = value + 1
+
+    def __delitem__(self, key):
+        if not key in self:
+            raise KeyError(key)
+        self._values[key] = ABSENT
+        self._n_present -= 1
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if len(default) > 0:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def has_key(self, key):
+        return 0 <= key < self.n_keys and self._values[key] != ABSENT
+
+    def __contains__(self, key):
+        return self.has_key(key)
+
+    def __len__(self):
+        return self._n_present
+
+    def iteritems(self):
+        values = self._values
+        for key in xrange(self.n_keys):
+            v = values[key]
+            if v != ABSENT:
+                yield key, v - 1
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return [key for key, _ in self.iteritems()]
+
+    def values(self):
+        return [value for _, value in self.iteritems()]
+
+    def __iter__(self):
+        for key, _ in self.iteritems():
+            yield key
+
+    def close(self):
+        """
+        Release the mmap and its file, if any. The map cannot be used after.
+        """
+        if self._mmap is not None:
+            self._values = None
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __getstate__(self):
+        if self._mmap is not None:
+            data = self._mmap[:]
+        else:
+            data = self._values.tostring()
+        return {'n_keys': self.n_keys, 'backing': self._backing,
+                'mmap_dir': self._mmap_dir, 'n_present': self._n_present,
+                'data': data}
+
+    def __setstate__(self, state):
+        self.__init__(state['n_keys'], backing=state['backing'],
+                mmap_dir=state['mmap_dir'])
+        if self._mmap is not None:
+            self._mmap[:] = state['data']
+        else:
+            self._values = array.array('l')
+            self._values.fromstring(state['data'])
+        self._n_present = state['n_present']
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
@@ -55,6 +55,10 @@ class MultiChannelBlockPoolBase(object):
 
         return ret
 
+    def get_tag(self, blocknum):
+        channel_id, block_off = self._global_to_channel(blocknum)
+        return self._channel_pool[channel_id].get_tag(block_off)
+
     def get_erasure_count_dist(self):
         aggregated_dist = Counter()
         for pool in self._channel_pool:
@@ -102,25 +106,27 @@ class MultiChannelBlockPoolBase(object):
             return False
 
     def get_least_or_most_erased_blocks(self, tag, choice, nblocks):
-        global_counter = self.get_erasure_count()
+        """
+        The global top nblocks must be among the top nblocks of each
+        channel, so we only merge the per-channel candidates.
+        """
         if choice == LEAST_ERASED:
-            blocks_by_cnt = reversed(global_counter.most_common())
+            sort_key = lambda (cnt, blocknum): (cnt, -blocknum)
         elif choice == MOST_ERASED:
-            blocks_by_cnt = global_counter.most_common()
+            sort_key = lambda (cnt, blocknum): (-cnt, blocknum)
         else:
             raise NotImplementedError
 
-        tag_blocks = self.get_blocks_of_tag(tag)
-
-        # iterate from least used to most used
-        blocks = []
-        for blocknum, count in blocks_by_cnt:
-            if blocknum in tag_blocks:
-                blocks.append(blocknum)
-                if len(blocks) == nblocks:
-                    break
-
-        return blocks
+        candidates = []
+        for pool in self._channel_pool:
+            blocks = pool.get_least_or_most_erased_blocks(tag, choice,
+                    nblocks)
+            for block_off in blocks:
+                candidates.append((pool.get_erasure_count(block_off),
+                    self._channel_to_global(pool.channel_id, block_off)))
+
+        candidates.sort(key=sort_key)
+        return [blocknum for _, blocknum in candidates[:nblocks]]
 
     def get_erasure_count(self):
         global_counter = Counter()
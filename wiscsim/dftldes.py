@@ -1,3 +1,4 @@
+import array
 import bitarray
 from collections import deque, Counter
 import csv
@@ -13,15 +14,16 @@ import simpy
 import bidict
 
 import config
+from densemap import DenseIntMap
 import flash
 import ftlbuilder
-from lrulist import LruDict, SegmentedLruCache, LruCache
+from lrulist import LruDict, SegmentedLruCache, LruCache, SlotLruCache
 import recorder
 from utilities import utils
 from commons import *
 from ftlsim_commons import *
-from .blkpool import BlockPool, MOST_ERASED, LEAST_ERASED
-from .bitmap import FlashBitmap2
+from .blkpool import BlockPool, MOST_ERASED, LEAST_ERASED, TDATA, TTRANS
+from .bitmap import FlashBitmap2, IndexedFlashBitmap2
 
 
 
@@ -34,6 +36,13 @@ LOGICAL_READ, LOGICAL_WRITE, LOGICAL_DISCARD = ('LOGICAL_READ', \
 PURPOSE_GC = 'PURPOSE_GC'
 PURPOSE_WEAR_LEVEL = 'PURPOSE_WEAR_LEVEL'
 
+# items of the 'translation' counter set of the recorder
+TRANSLATION_EVENTS = ('read_trans_page-for-write-back',
+        'write-back-dirty-for-insert', 'delete-lpn-in-table-for-insert',
+        'write-back-dirty-for-load', 'delete-lpn-in-table-for-load',
+        'read-trans-for-load', 'write-back-dirty-for-flush',
+        'overwrite-in-cache', 'insert-to-free', 'delete-lpn-in-table-for-drop')
+
 #
 # - translation pages
 #   - cache miss read (trans.cache.load)
@@ -80,10 +89,16 @@ class Ftl(object):
                format(type(confobj).__name__))
 
         self.conf = confobj
+        self.geometry = confobj.geometry()
         self.recorder = recorderobj
         self.flash = flashcontrollerobj
         self.env = env
 
+        # {'read': CounterHandle, 'write': ..., 'discard': ...}
+        self._traffic_counters = dict(
+                (op, self.recorder.counter('traffic', op))
+                for op in ('read', 'write', 'discard'))
+
         self.block_pool = BlockPool(confobj)
         self.oob = OutOfBandAreas(confobj)
 
@@ -163,7 +178,7 @@ class Ftl(object):
 
     def write_ext(self, extent):
         req_size = extent.lpn_count * self.conf.page_size
-        self.recorder.add_to_general_accumulater('traffic', 'write', req_size)
+        self._traffic_counters['write'].add(req_size)
         self.written_bytes += req_size
         if self.written_bytes > self.pre_written_bytes + self.display_interval:
             print 'Written (MB)', self.pre_written_bytes / MB, 'writing', round(float(req_size) / MB, 2)
@@ -192,7 +207,7 @@ class Ftl(object):
 
     def _write_single_mvpngroup(self, ext_single_m_vpn, ppns_to_write,
             tag=None):
-        m_vpn = self.conf.lpn_to_m_vpn(ext_single_m_vpn.lpn_start)
+        m_vpn = self.geometry.lpn_to_m_vpn(ext_single_m_vpn.lpn_start)
 
         p_relocate = self.env.process(
             self._update_metadata_for_relocating_lpns(
@@ -218,15 +233,31 @@ class Ftl(object):
 
     def _update_metadata_for_relocating_lpns(self, lpns, new_ppns, tag=None):
         """
-        This may be parallelized.
+        Batched _update_metadata_for_relocating_lpn(). Each m_vpn is locked
+        once for the lpns of it.
         """
         old_ppns = yield self.env.process(
                 self._mappings.lpns_to_ppns(lpns, tag))
 
-        for lpn, old_ppn, new_ppn in zip(lpns, old_ppns, new_ppns):
-            yield self.env.process(
-                self._update_metadata_for_relocating_lpn(
-                    lpn, old_ppn, new_ppn, tag))
+        if self.conf['batch_mapping_ops'] is False:
+            for lpn, old_ppn, new_ppn in zip(lpns, old_ppns, new_ppns):
+                yield self.env.process(
+                    self._update_metadata_for_relocating_lpn(
+                        lpn, old_ppn, new_ppn, tag))
+            return
+
+        old_ppn_of_lpn = dict(zip(lpns, old_ppns))
+
+        def relocate(lpn, new_ppn):
+            # oob state
+            # oob ppn->lpn/vpn
+            self.oob.relocate_data_page(lpn=lpn, old_ppn=old_ppn_of_lpn[lpn],
+                    new_ppn=new_ppn, update_time=True)
+
+        # mappings in cache, see _update_metadata_for_relocating_lpn()
+        yield self.env.process(
+                self._mappings.update_batch(zip(lpns, new_ppns), tag=tag,
+                    after_each=relocate))
 
     def _update_metadata_for_relocating_lpn(self, lpn, old_ppn, new_ppn,
             tag=None):
@@ -273,7 +304,7 @@ class Ftl(object):
 
     def read_ext(self, extent):
         req_size = extent.lpn_count * self.conf.page_size
-        self.recorder.add_to_general_accumulater('traffic', 'read', req_size)
+        self._traffic_counters['read'].add(req_size)
         self.read_bytes += req_size
         if self.read_bytes > self.pre_read_bytes + self.display_interval:
             print 'Read (MB)', self.pre_read_bytes / MB, 'reading', round(float(req_size) / MB, 2)
@@ -299,7 +330,7 @@ class Ftl(object):
             start_time = start_time, end_time = self.env.now)
 
     def _read_single_mvpngroup(self, ext_single_m_vpn, tag=None):
-        m_vpn = self.conf.lpn_to_m_vpn(ext_single_m_vpn.lpn_start)
+        m_vpn = self.geometry.lpn_to_m_vpn(ext_single_m_vpn.lpn_start)
 
 
         ppns_to_read = yield self.env.process(
@@ -321,7 +352,7 @@ class Ftl(object):
 
     def discard_ext(self, extent):
         req_size = extent.lpn_count * self.conf.page_size
-        self.recorder.add_to_general_accumulater('traffic', 'discard', req_size)
+        self._traffic_counters['discard'].add(req_size)
         self.discarded_bytes += req_size
         if self.discarded_bytes > self.pre_discarded_bytes + self.display_interval:
             print 'Discarded (MB)', self.pre_discarded_bytes / MB, 'discarding', round(float(req_size) / MB, 2)
@@ -338,7 +369,7 @@ class Ftl(object):
         yield simpy.events.AllOf(self.env, procs)
 
     def _discard_single_mvpngroup(self, ext_single_m_vpn):
-        m_vpn = self.conf.lpn_to_m_vpn(ext_single_m_vpn.lpn_start)
+        m_vpn = self.geometry.lpn_to_m_vpn(ext_single_m_vpn.lpn_start)
 
         ppns_to_invalidate = yield self.env.process(
                 self._mappings.lpns_to_ppns(ext_single_m_vpn.lpn_iter()))
@@ -397,23 +428,16 @@ def split_ext_to_mvpngroups(conf, extent):
     """
     return a list of extents, each belongs to one m_vpn
     """
+    n_entries_per_page = conf.n_mapping_entries_per_page
     group_extent_list = []
-    for i, lpn in enumerate(extent.lpn_iter()):
-        cur_m_vpn = conf.lpn_to_m_vpn(lpn)
-        if i == 0:
-            # intialization
-            cur_group_extent = Extent(lpn_start = extent.lpn_start,
-                lpn_count = 1)
-            group_extent_list.append(cur_group_extent)
-        else:
-            if cur_m_vpn == last_m_vpn:
-                cur_group_extent.lpn_count += 1
-            else:
-                cur_group_extent = Extent(lpn_start = lpn,
-                    lpn_count = 1)
-                group_extent_list.append(cur_group_extent)
-
-        last_m_vpn = cur_m_vpn
+    lpn = extent.lpn_start
+    lpn_end = extent.lpn_start + extent.lpn_count
+    while lpn < lpn_end:
+        group_end = min((lpn / n_entries_per_page + 1) * n_entries_per_page,
+                lpn_end)
+        group_extent_list.append(Extent(lpn_start = lpn,
+            lpn_count = group_end - lpn))
+        lpn = group_end
 
     return group_extent_list
 
@@ -437,7 +461,7 @@ class FlashTransmitMixin(object):
 
         if len(mapping_in_cache) < self.conf.n_mapping_entries_per_page:
             # Not all mappings are in cache
-            self.recorder.count_me("translation", 'read_trans_page-for-write-back')
+            self._translation_counters['read_trans_page-for-write-back'].add()
             mapping_in_flash = yield self.env.process(
                     self._read_translation_page(m_vpn, tag))
             latest_mapping = mapping_in_flash
@@ -476,7 +500,7 @@ class FlashTransmitMixin(object):
         """
         # mapping_dict has to have all and only the entries of m_vpn
         lpn_sample = mapping_dict.keys()[0]
-        tmp_m_vpn = self.conf.lpn_to_m_vpn(lpn_sample)
+        tmp_m_vpn = self.geometry.lpn_to_m_vpn(lpn_sample)
         assert tmp_m_vpn == m_vpn
         assert len(mapping_dict) == self.conf.n_mapping_entries_per_page
 
@@ -542,13 +566,13 @@ class InsertMixin(object):
         yield self._concurrent_trans_quota.get(1)
 
         # lock m_vpn
-        m_vpn = self.conf.lpn_to_m_vpn(lpn = victim_row.lpn)
+        m_vpn = self.geometry.lpn_to_m_vpn(victim_row.lpn)
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
         self._trans_page_locks.locked_addrs.add(m_vpn)
 
         if victim_row.dirty == True:
-            self.recorder.count_me('translation', 'write-back-dirty-for-insert')
+            self._translation_counters['write-back-dirty-for-insert'].add()
             yield self.env.process(self._write_back(m_vpn, tag))
 
         assert self._lpn_table.has_lpn(victim_row.lpn), \
@@ -561,7 +585,7 @@ class InsertMixin(object):
         assert victim_row.state == USED_AND_HOLD
         victim_row.state = USED
 
-        self.recorder.count_me('translation', 'delete-lpn-in-table-for-insert')
+        self._translation_counters['delete-lpn-in-table-for-insert'].add()
         locked_row_id = self._lpn_table.delete_lpn_and_lock(victim_row.lpn)
 
         self._trans_page_locks.release_request(m_vpn, tp_req)
@@ -624,14 +648,14 @@ class LoadMixin(object):
                 [loading_m_vpn] + list(self._trans_page_locks.locked_addrs))
         victim_row.state = USED_AND_HOLD
 
-        m_vpn = self.conf.lpn_to_m_vpn(lpn = victim_row.lpn)
+        m_vpn = self.geometry.lpn_to_m_vpn(victim_row.lpn)
 
         tp_req = self._trans_page_locks.get_request(m_vpn)
         yield tp_req
         self._trans_page_locks.locked_addrs.add(m_vpn)
 
         if victim_row.dirty == True:
-            self.recorder.count_me('translation', 'write-back-dirty-for-load')
+            self._translation_counters['write-back-dirty-for-load'].add()
             yield self.env.process(self._write_back(m_vpn, tag))
 
         # after writing back, this lpn could already been deleted
@@ -643,7 +667,7 @@ class LoadMixin(object):
         victim_row.state = USED
 
         # This is the only place that we delete a lpn
-        self.recorder.count_me('translation', 'delete-lpn-in-table-for-load')
+        self._translation_counters['delete-lpn-in-table-for-load'].add()
         locked_row_id = self._lpn_table.delete_lpn_and_lock(victim_row.lpn)
 
         self._trans_page_locks.release_request(m_vpn, tp_req)
@@ -656,7 +680,7 @@ class LoadMixin(object):
         It should not call _write_back() directly or indirectly as it
         will deadlock.
         """
-        self.recorder.count_me('translation', 'read-trans-for-load')
+        self._translation_counters['read-trans-for-load'].add()
         mapping_dict = yield self.env.process(
                 self._read_translation_page(m_vpn, tag))
         uncached_mapping = self.__get_uncached_mappings(mapping_dict)
@@ -687,13 +711,13 @@ class FlushMixin(object):
         for lpn, row in self._lpn_table.least_to_most_lpn_items():
             if row.dirty is True:
                 # write back this m_vpn
-                m_vpn = self.conf.lpn_to_m_vpn(lpn)
+                m_vpn = self.geometry.lpn_to_m_vpn(lpn)
 
                 tp_req = self._trans_page_locks.get_request(m_vpn)
                 yield tp_req
                 self._trans_page_locks.locked_addrs.add(m_vpn)
 
-                self.recorder.count_me('translation', 'write-back-dirty-for-flush')
+                self._translation_counters['write-back-dirty-for-flush'].add()
                 yield self.env.process(self._write_back(m_vpn, tag))
 
                 self._trans_page_locks.release_request(m_vpn, tp_req)
@@ -707,6 +731,7 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
     def __init__(self, confobj, block_pool, flashobj, oobobj, recorderobj,
             envobj, directory, mapping_on_flash, trans_page_locks):
         self.conf = confobj
+        self.geometry = confobj.geometry()
         self.flash = flashobj
         self.oob = oobobj
         self.block_pool = block_pool
@@ -715,7 +740,10 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
         self.directory = directory
         self.mapping_on_flash = mapping_on_flash
 
-        self._lpn_table = LpnTableMvpn(confobj)
+        if self.conf['lpn_table_storage'] == 'array':
+            self._lpn_table = ArrayLpnTableMvpn(confobj)
+        else:
+            self._lpn_table = LpnTableMvpn(confobj)
 
         self._trans_page_locks = trans_page_locks
 
@@ -726,39 +754,106 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
                 capacity=capsize)
         self._m_vpn_interface_lock = LockPool(self.env)
 
-    def update_batch(self, mapping_dict, tag=None):
-        for lpn, ppn in mapping_dict.items():
-            yield self.env.process(self.update(lpn, ppn, tag))
+        self._hit_counter = self.recorder.counter('Mapping_Cache', 'hit')
+        self._miss_counter = self.recorder.counter('Mapping_Cache', 'miss')
+        # {event: CounterHandle}
+        self._translation_counters = dict(
+                (event, self.recorder.counter('translation', event))
+                for event in TRANSLATION_EVENTS)
+
+    def update_batch(self, mapping_dict, tag=None, after_each=None):
+        """
+        mapping_dict is a dict or a sequence of (lpn, ppn). Each run of lpns
+        of the same m_vpn is updated in this process with the m_vpn locked
+        once, instead of one update() process per lpn.
+
+        after_each(lpn, ppn) is called right after lpn is updated, while
+        its m_vpn is still locked.
+        """
+        if isinstance(mapping_dict, dict):
+            mapping_dict = mapping_dict.items()
+
+        if self.conf['batch_mapping_ops'] is False:
+            for lpn, ppn in mapping_dict:
+                yield self.env.process(self.update(lpn, ppn, tag))
+                if after_each is not None:
+                    after_each(lpn, ppn)
+            return
+
+        for m_vpn, items in itertools.groupby(mapping_dict,
+                key=lambda item: self.geometry.lpn_to_m_vpn(item[0])):
+            req = self._m_vpn_interface_lock.get_request(m_vpn)
+            yield req
+
+            for lpn, ppn in items:
+                if self._update_cached_or_free(lpn, ppn) is False:
+                    yield self.env.process(
+                            self._insert_new_mapping(lpn, ppn, tag))
+                if after_each is not None:
+                    after_each(lpn, ppn)
+
+            self._m_vpn_interface_lock.release_request(m_vpn, req)
 
     def update(self, lpn, ppn, tag=None):
         """
         All translation and update of the same m_vpn are serialized.
         """
-        m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        m_vpn = self.geometry.lpn_to_m_vpn(lpn)
         req = self._m_vpn_interface_lock.get_request(m_vpn)
         yield req
 
+        if self._update_cached_or_free(lpn, ppn) is False:
+            yield self.env.process(self._insert_new_mapping(lpn, ppn, tag))
+
+        self._m_vpn_interface_lock.release_request(m_vpn, req)
+
+    def _update_cached_or_free(self, lpn, ppn):
+        """
+        Update lpn in cache if it is cached or there is a free row for it.
+        Return False if an entry has to be evicted to insert lpn.
+        The m_vpn of lpn must be locked.
+        """
         if self._lpn_table.has_lpn(lpn):
-            self.recorder.count_me('translation', 'overwrite-in-cache')
+            self._translation_counters['overwrite-in-cache'].add()
             self._lpn_table.overwrite_lpn(lpn, ppn, dirty=True)
+        elif self._lpn_table.n_free_rows() > 0:
+            self._translation_counters['insert-to-free'].add()
+            self._add_to_free(lpn, ppn)
         else:
-            if self._lpn_table.n_free_rows() > 0:
-                self.recorder.count_me('translation', 'insert-to-free')
-                self._add_to_free(lpn, ppn)
-            else:
-                yield self.env.process(self._insert_new_mapping(lpn, ppn, tag))
-
-        self._m_vpn_interface_lock.release_request(m_vpn, req)
+            return False
+        return True
 
     def lpns_to_ppns(self, lpns, tag=None):
         """
-        If lpns are of the same m_vpn, this process will only
-        have one cache miss.
+        Each run of lpns of the same m_vpn is translated in this process
+        with the m_vpn locked once. If lpns are of the same m_vpn, this
+        process will only have one cache miss.
         """
         ppns = []
-        for lpn in lpns:
-            ppn = yield self.env.process(self.lpn_to_ppn(lpn, tag))
-            ppns.append(ppn)
+        if self.conf['batch_mapping_ops'] is False:
+            for lpn in lpns:
+                ppn = yield self.env.process(self.lpn_to_ppn(lpn, tag))
+                ppns.append(ppn)
+            self.env.exit(ppns)
+
+        for m_vpn, lpns_of_m_vpn in itertools.groupby(lpns,
+                key=self.geometry.lpn_to_m_vpn):
+            req = self._m_vpn_interface_lock.get_request(m_vpn)
+            yield req
+
+            for lpn in lpns_of_m_vpn:
+                ppn = self._lpn_table.lpn_to_ppn(lpn)
+                if ppn == MISS:
+                    loaded, ppn = yield self.env.process(
+                        self._load_missing(m_vpn, wanted_lpn=lpn, tag=tag))
+                    assert ppn != MISS
+                else:
+                    loaded = False
+                self._count_translation(loaded)
+                ppns.append(ppn)
+
+            self._m_vpn_interface_lock.release_request(m_vpn, req)
+
         self.env.exit(ppns)
 
     def lpn_to_ppn(self, lpn, tag=None):
@@ -766,7 +861,7 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
         Note that the return can be UNINITIATED
         All translation and update of the same m_vpn are serialized.
         """
-        m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        m_vpn = self.geometry.lpn_to_m_vpn(lpn)
 
         req = self._m_vpn_interface_lock.get_request(m_vpn)
         yield req
@@ -779,28 +874,31 @@ class MappingCache(FlashTransmitMixin, InsertMixin, LoadMixin, FlushMixin):
         else:
             loaded = False
 
-        if loaded == True:
-            self.recorder.count_me("Mapping_Cache", "miss")
-        else:
-            self.recorder.count_me("Mapping_Cache", "hit")
+        self._count_translation(loaded)
 
         self._m_vpn_interface_lock.release_request(m_vpn, req)
         self.env.exit(ppn)
 
+    def _count_translation(self, loaded):
+        if loaded == True:
+            self._miss_counter.add()
+        else:
+            self._hit_counter.add()
+
     def flush(self):
         yield self.env.process(self._flush())
 
     def drop(self):
         "flush before dropping, otherwise mapping will be lost"
         for lpn, row in self._lpn_table.least_to_most_lpn_items():
-            self.recorder.count_me('translation', 'delete-lpn-in-table-for-drop')
+            self._translation_counters['delete-lpn-in-table-for-drop'].add()
             self._lpn_table.delete_lpn_and_lock(lpn)
             row.state = FREE
 
     def _victim_row(self, avoid_m_vpns):
         for lpn, row in self._lpn_table.least_to_most_lpn_items():
             if row.state == USED:
-                m_vpn = self.conf.lpn_to_m_vpn(lpn)
+                m_vpn = self.geometry.lpn_to_m_vpn(lpn)
                 if not m_vpn in avoid_m_vpns:
                     return row
         raise RuntimeError("Cannot find a victim. Current stats: {}"\
@@ -815,49 +913,67 @@ class LpnTable(object):
     def __init__(self, n_rows):
         self._n_rows = n_rows
 
+        # Rows report their state changes to the table, so the number of
+        # rows in each state and the free rows are known without scanning
+        # all rows.
+        # {state: number of rows in the state}
+        self._state_cnt = Counter()
+        self._state_cnt[FREE] = n_rows
+        # heap of ids of FREE rows, so the lowest free row is used first.
+        # A row id may stay in the heap after the row is not FREE; it is
+        # checked when popped.
+        self._free_row_ids = range(n_rows)
+
         self._rows = self._fresh_rows()
 
         # lpns to Row instances, it is a dict
         # {lpn1: row1, lpn2: row2, ...}
-        # self._lpn_to_row = SegmentedLruCache(n_rows, 0.5)
-        # self._lpn_to_row = LruDict()
-        self._lpn_to_row = LruCache()
+        self._lpn_to_row = self._fresh_lpn_to_row()
 
     def _fresh_rows(self):
          return [
-            Row(lpn = None, ppn = None, dirty = False, state = FREE, rowid = i)
+            Row(lpn = None, ppn = None, dirty = False, state = FREE, rowid = i,
+                table = self)
             for i in range(self._n_rows) ]
 
+    def _fresh_lpn_to_row(self):
+        # return SegmentedLruCache(n_rows, 0.5)
+        # return LruDict()
+        return LruCache()
+
     def rows(self):
         return self._rows
 
+    def _row_state_changed(self, rowid, old_state, new_state):
+        self._state_cnt[old_state] -= 1
+        self._state_cnt[new_state] += 1
+        if new_state == FREE:
+            heapq.heappush(self._free_row_ids, rowid)
+
     def _count_states(self):
-        """
-        slower but reduces duplication
-        """
-        counter = Counter()
-        for row in self._rows:
-            counter[row.state] += 1
-        return counter
+        return Counter({state: cnt for state, cnt in self._state_cnt.items()
+            if cnt > 0})
 
     def n_free_rows(self):
-        return self._count_states()[FREE]
+        return self._state_cnt[FREE]
 
     def n_locked_free_rows(self):
-        return self._count_states()[FREE_AND_LOCKED]
+        return self._state_cnt[FREE_AND_LOCKED]
 
     def n_used_rows(self):
-        return self._count_states()[USED]
+        return self._state_cnt[USED]
 
     def n_locked_used_rows(self):
-        return self._count_states()[USED_AND_LOCKED]
+        return self._state_cnt[USED_AND_LOCKED]
 
     def lock_free_row(self):
         """FREE TO FREE_AND_LOCKED"""
-        for row in self._rows:
+        while len(self._free_row_ids) > 0:
+            rowid = heapq.heappop(self._free_row_ids)
+            row = self._rows[rowid]
             if row.state == FREE:
                 row.state = FREE_AND_LOCKED
-                return row.rowid
+                return rowid
         return None
 
     def lock_used_rows(self, row_ids):
@@ -878,15 +994,11 @@ class LpnTable(object):
 
     def lock_free_rows(self, n):
         row_ids = []
-        got = 0
-        for row in self._rows:
-            if row.state == FREE:
-                row.state = FREE_AND_LOCKED
-                row_ids.append(row.rowid)
-                got += 1
-
-                if got == n:
-                    break
+        while len(row_ids) < n:
+            rowid = self.lock_free_row()
+            if rowid is None:
+                break
+            row_ids.append(rowid)
         return row_ids
 
     def unlock_free_row(self, rowid):
@@ -1050,6 +1162,39 @@ class LpnTableMvpn(LpnTable):
         return uncached_lpns
 
 
+def assert_row_modification_allowed(state):
+     assert state in (FREE_AND_LOCKED, USED, USED_AND_HOLD), \
+            "current state {}".format(state)
+
+
+def check_row_state_transition(cur_state, state_value):
+    """
+    State graph:
+        FREE <----> FREE & LOCKED <----> USED <----> USED & LOCKED
+                                          ^
+                                          |
+                                          v
+                                    USED & HOLD
+    """
+    if state_value == FREE:
+        assert cur_state == FREE_AND_LOCKED, \
+                "current state {}".format(cur_state)
+    elif state_value == FREE_AND_LOCKED:
+        assert cur_state in (FREE, USED), \
+                "current state {}".format(cur_state)
+    elif state_value == USED:
+        assert cur_state in (FREE_AND_LOCKED, USED_AND_LOCKED, USED_AND_HOLD), \
+                "current state {}".format(cur_state)
+    elif state_value == USED_AND_LOCKED:
+        assert cur_state == USED, \
+                "current state {}".format(cur_state)
+    elif state_value == USED_AND_HOLD:
+        assert cur_state == USED, \
+                "current state {}".format(cur_state)
+    else:
+        raise RuntimeError("{} is not a valid state".format(state_value))
+
+
 class _Row(object):
     def __init__(self, lpn, ppn, dirty, state, rowid):
         self.lpn = lpn
@@ -1065,16 +1210,17 @@ class _Row(object):
 
 
 class Row(object):
-    def __init__(self, lpn, ppn, dirty, state, rowid):
+    def __init__(self, lpn, ppn, dirty, state, rowid, table=None):
         self._lpn = lpn
         self._ppn = ppn
         self._dirty = dirty
         self._state = state
         self._rowid = rowid
+        # the LpnTable to notify when state changes
+        self._table = table
 
     def _assert_modification_allowed(self):
-         assert self._state in (FREE_AND_LOCKED, USED, USED_AND_HOLD), \
-                "current state {}".format(self._state)
+        assert_row_modification_allowed(self._state)
 
     @property
     def lpn(self):
@@ -1109,32 +1255,10 @@ class Row(object):
 
     @state.setter
     def state(self, state_value):
-        """
-        State graph:
-            FREE <----> FREE & LOCKED <----> USED <----> USED & LOCKED
-                                              ^
-                                              |
-                                              v
-                                        USED & HOLD
-        """
-        # check state transition
-        if state_value == FREE:
-            assert self._state == FREE_AND_LOCKED, \
-                    "current state {}".format(self._state)
-        elif state_value == FREE_AND_LOCKED:
-            assert self._state in (FREE, USED), \
-                    "current state {}".format(self._state)
-        elif state_value == USED:
-            assert self._state in (FREE_AND_LOCKED, USED_AND_LOCKED, USED_AND_HOLD), \
-                    "current state {}".format(self._state)
-        elif state_value == USED_AND_LOCKED:
-            assert self._state == USED, \
-                    "current state {}".format(self._state)
-        elif state_value == USED_AND_HOLD:
-            assert self._state == USED, \
-                    "current state {}".format(self._state)
-        else:
-            raise RuntimeError("{} is not a valid state".format(state_value))
+        check_row_state_transition(self._state, state_value)
+        if self._table is not None:
+            self._table._row_state_changed(self._rowid, self._state,
+                    state_value)
         self._state = state_value
 
     @property
@@ -1151,6 +1275,157 @@ class Row(object):
             self.ppn, self.dirty, self._rowid)
 
 
+ROW_STATES = (FREE, FREE_AND_LOCKED, USED, USED_AND_LOCKED, USED_AND_HOLD)
+ROW_STATE_CODES = {state: code for code, state in enumerate(ROW_STATES)}
+# codes of non-integer values in RowArrays
+NONE_CODE, UNINITIATED_CODE = -1, -2
+
+
+class RowArrays(object):
+    """
+    Rows of an LpnTable kept in parallel typed arrays indexed by row id,
+    instead of one Row object per row. rows[rowid] returns a RowView,
+    which has the same interfaces as Row.
+    """
+    def __init__(self, n_rows, table=None):
+        self.n_rows = n_rows
+        self.lpns = array.array('l', [NONE_CODE]) * n_rows
+        self.ppns = array.array('l', [NONE_CODE]) * n_rows
+        # -1: None, 0: False, 1: True
+        self.dirties = array.array('b', [0]) * n_rows
+        self.states = array.array('b', [ROW_STATE_CODES[FREE]]) * n_rows
+        # the LpnTable to notify when state changes
+        self.table = table
+
+    def __getitem__(self, rowid):
+        if not 0 <= rowid < self.n_rows:
+            raise IndexError("row id {} out of range".format(rowid))
+        return RowView(self, rowid)
+
+    def __len__(self):
+        return self.n_rows
+
+    def __iter__(self):
+        for rowid in range(self.n_rows):
+            yield RowView(self, rowid)
+
+
+class RowView(object):
+    """
+    A row in RowArrays.
+    """
+    __slots__ = ('_arrays', '_rowid')
+
+    def __init__(self, row_arrays, rowid):
+        self._arrays = row_arrays
+        self._rowid = rowid
+
+    def _assert_modification_allowed(self):
+        assert_row_modification_allowed(self.state)
+
+    @property
+    def lpn(self):
+        lpn = self._arrays.lpns[self._rowid]
+        return None if lpn == NONE_CODE else lpn
+
+    @lpn.setter
+    def lpn(self, lpn):
+        self._assert_modification_allowed()
+        self._arrays.lpns[self._rowid] = NONE_CODE if lpn is None else lpn
+
+    @property
+    def ppn(self):
+        ppn = self._arrays.ppns[self._rowid]
+        if ppn == NONE_CODE:
+            return None
+        elif ppn == UNINITIATED_CODE:
+            return UNINITIATED
+        else:
+            return ppn
+
+    @ppn.setter
+    def ppn(self, ppn):
+        self._assert_modification_allowed()
+        if ppn is None:
+            ppn = NONE_CODE
+        elif ppn == UNINITIATED:
+            ppn = UNINITIATED_CODE
+        self._arrays.ppns[self._rowid] = ppn
+
+    @property
+    def dirty(self):
+        dirty = self._arrays.dirties[self._rowid]
+        return None if dirty == NONE_CODE else dirty == 1
+
+    @dirty.setter
+    def dirty(self, dirty):
+        self._assert_modification_allowed()
+        self._arrays.dirties[self._rowid] = \
+                NONE_CODE if dirty is None else int(dirty)
+
+    @property
+    def state(self):
+        return ROW_STATES[self._arrays.states[self._rowid]]
+
+    @state.setter
+    def state(self, state_value):
+        cur_state = self.state
+        check_row_state_transition(cur_state, state_value)
+        if self._arrays.table is not None:
+            self._arrays.table._row_state_changed(self._rowid, cur_state,
+                    state_value)
+        self._arrays.states[self._rowid] = ROW_STATE_CODES[state_value]
+
+    @property
+    def rowid(self):
+        return self._rowid
+
+    def clear_data(self):
+        self.lpn = None
+        self.ppn = None
+        self.dirty = None
+
+    def __repr__(self):
+        return "lpn:{}, ppn:{}, dirty:{}, rowid:{}".format(self.lpn,
+            self.ppn, self.dirty, self._rowid)
+
+
+class RowLruCache(SlotLruCache):
+    """
+    LRU cache of lpn -> row, where the slots are the row ids of RowArrays.
+    """
+    def __init__(self, row_arrays):
+        super(RowLruCache, self).__init__(len(row_arrays))
+        self._row_arrays = row_arrays
+
+    def _to_slot(self, row):
+        return row.rowid
+
+    def _to_value(self, slot):
+        return RowView(self._row_arrays, slot)
+
+
+class ArrayRowsMixin(object):
+    """
+    Make an LpnTable keep its rows in RowArrays and its LRU list in
+    arrays, so a large mapping cache does not need millions of Row and
+    Node objects.
+    """
+    def _fresh_rows(self):
+        return RowArrays(self._n_rows, table=self)
+
+    def _fresh_lpn_to_row(self):
+        return RowLruCache(self._rows)
+
+
+class ArrayLpnTable(ArrayRowsMixin, LpnTable):
+    pass
+
+
+class ArrayLpnTableMvpn(ArrayRowsMixin, LpnTableMvpn):
+    pass
+
+
 class CacheEntryData(object):
     """
     This is a helper class that store entry data for a LPN
@@ -1165,6 +1440,22 @@ class CacheEntryData(object):
             self.ppn, self.dirty)
 
 
+def create_page_map(conf, n_keys):
+    """
+    Return an empty map from page numbers in [0, n_keys) to integers, as
+    configured by conf['mapping_table_storage'].
+    """
+    storage = conf['mapping_table_storage']
+    if storage == 'dict':
+        return {}
+    elif storage in ('array', 'mmap'):
+        return DenseIntMap(n_keys, backing=storage,
+                mmap_dir=conf['mapping_table_mmap_dir'])
+    else:
+        raise ValueError("mapping_table_storage {} is not supported".format(
+            storage))
+
+
 class MappingOnFlash(object):
     """
     This mapping table is for data pages, not for translation pages.
@@ -1179,9 +1470,8 @@ class MappingOnFlash(object):
 
         self.n_entries_per_page = self.conf.n_mapping_entries_per_page
 
-        # do the easy thing first, if necessary, we can later use list or
-        # other data structure
-        self.entries = {}
+        # lpn -> ppn
+        self.entries = create_page_map(self.conf, self.conf.total_num_pages())
 
     def lpn_to_ppn(self, lpn):
         """
@@ -1192,7 +1482,11 @@ class MappingOnFlash(object):
         return self.entries.get(lpn, UNINITIATED)
 
     def update(self, lpn, ppn):
-        self.entries[lpn] = ppn
+        if ppn == UNINITIATED:
+            # an absent lpn is UNINITIATED
+            self.entries.pop(lpn, None)
+        else:
+            self.entries[lpn] = ppn
 
     def batch_update(self, mapping_dict):
         for lpn, ppn in mapping_dict.items():
@@ -1216,6 +1510,7 @@ class GlobalTranslationDirectory(object):
     """
     def __init__(self, confobj, oob, block_pool):
         self.conf = confobj
+        self.geometry = confobj.geometry()
 
         self.flash_npage_per_block = self.conf.n_pages_per_block
         self.flash_num_blocks = self.conf.n_blocks_per_dev
@@ -1272,7 +1567,7 @@ class GlobalTranslationDirectory(object):
         del self.mapping[m_vpn]
 
     def lpn_to_m_ppn(self, lpn):
-        m_vpn = self.conf.lpn_to_m_vpn(lpn)
+        m_vpn = self.geometry.lpn_to_m_vpn(lpn)
         m_ppn = self.m_vpn_to_m_ppn(m_vpn)
         return m_ppn
 
@@ -1337,63 +1632,64 @@ class VictimBlocks(object):
         return repr(list(self.iterator_verbose()))
 
     def iterator_verbose(self):
-        candidate_tuples = self._candidate_priorityq()
-        while True:
-            try:
-                valid_ratio, block_type, block_num = heapq.heappop(candidate_tuples)
-                yield valid_ratio, block_type, block_num
-            except IndexError:
-                # Out of victim blocks
-                raise StopIteration
+        """
+        Yield (valid_ratio, block_type, block_num) from the block with the
+        fewest valid pages. Blocks are read lazily from the valid count
+        index of OOB states, so GC that stops early does not pay for
+        looking at all used blocks. The order is decided by the state when
+        the iteration starts, even if pages change between yields.
+        """
+        states = self._oob.states
+        n_pages_per_block = self._conf.n_pages_per_block
+        max_valid_ratio = self._conf['max_victim_valid_ratio']
+
+        snapshot = states.snapshot_valid_counts()
+        try:
+            self._block_pool.remove_full_cur_blocks()
+            cur_blocks = set(self._block_pool.current_blocks())
+
+            # all-valid blocks are skipped
+            for valid_cnt in range(n_pages_per_block):
+                valid_ratio = valid_cnt / float(n_pages_per_block)
+                if valid_ratio > max_valid_ratio:
+                    # If valid ratio is too big, moving it does not provide
+                    # too much benefit.
+                    break
+
+                candidates = []
+                for block in snapshot.blocks_of_valid_count(valid_cnt):
+                    if block in cur_blocks:
+                        # skip current blocks
+                        continue
+                    block_type = self._block_type(block)
+                    if block_type is not None:
+                        candidates.append((block_type, block))
+                candidates.sort()
+
+                for block_type, block in candidates:
+                    yield valid_ratio, block_type, block
+        finally:
+            snapshot.close()
+
+    def _block_type(self, blocknum):
+        tag = self._block_pool.get_tag(blocknum)
+        if tag == TDATA:
+            return self.TYPE_DATA
+        elif tag == TTRANS:
+            return self.TYPE_TRANS
+        else:
+            return None
 
     def get_valid_ratio_counter_of_used_blocks(self):
         used_blocks = self._block_pool.used_blocks
+        valid_ratios = self._oob.states.block_valid_ratios()
         counter = Counter()
         for block in used_blocks:
-            valid_ratio = self._oob.states.block_valid_ratio(block)
+            valid_ratio = valid_ratios[block]
             ratio_str = "{0:.2f}".format(valid_ratio)
             counter[ratio_str] += 1
         return counter
 
-    def _candidate_priorityq(self):
-        candidate_tuples = self._victim_candidates()
-        heapq.heapify(candidate_tuples)
-        return candidate_tuples
-
-    def _form_tuples(self, used_blocks, block_type):
-        assert block_type in (self.TYPE_DATA, self.TYPE_TRANS)
-
-        self._block_pool.remove_full_cur_blocks()
-        cur_blocks = self._block_pool.current_blocks()
-
-        victim_candidates = []
-        for block in used_blocks:
-            if block in cur_blocks:
-                # skip current blocks
-                continue
-
-            valid_ratio = self._oob.states.block_valid_ratio(block)
-            if valid_ratio == 1:
-                # skip all-valid blocks
-                continue
-            if valid_ratio > self._conf['max_victim_valid_ratio']:
-                # If valid ratio is too big, moving it does not provide
-                # too much benefit.
-                continue
-
-            victim_candidates.append( (valid_ratio, block_type, block) )
-
-        return victim_candidates
-
-    def _victim_candidates(self):
-        used_data_blocks = self._block_pool.data_usedblocks
-        used_trans_blocks = self._block_pool.trans_usedblocks
-
-        candidate_tuples = self._form_tuples(used_data_blocks, self.TYPE_DATA) + \
-            self._form_tuples(used_trans_blocks, self.TYPE_TRANS)
-
-        return candidate_tuples
-
 
 class Cleaner(object):
     def __init__(self, conf, flash, oob, block_pool, mappings, directory, rec,
@@ -1515,13 +1811,19 @@ class Cleaner(object):
             self.gc_time_recorded = True
             print 'GC time recorded!........!'
 
-        all_victim_tuples = list(victim_blocks.iterator_verbose())
-        batches = utils.group_to_batches(all_victim_tuples, self.n_victim_per_batch)
-
-        for batch in batches:
-            if self.is_stopping_needed():
-                break
-            yield self.env.process(self._clean_batch(batch, purpose=PURPOSE_GC))
+        victim_iter = victim_blocks.iterator_verbose()
+        try:
+            while not self.is_stopping_needed():
+                batch = list(itertools.islice(victim_iter,
+                    self.n_victim_per_batch))
+                if len(batch) == 0:
+                    break
+                yield self.env.process(
+                        self._clean_batch(batch, purpose=PURPOSE_GC))
+        finally:
+            # release the snapshot held by the iterator, also when this
+            # process is interrupted or a batch fails
+            victim_iter.close()
 
         self._cleaner_res.release(req)
 
@@ -1555,6 +1857,7 @@ class DataBlockCleaner(object):
     """
     def __init__(self, conf, flash, oob, block_pool, mappings, rec, env):
         self.conf = conf
+        self.geometry = conf.geometry()
         self.flash = flash
         self.oob = oob
         self.block_pool = block_pool
@@ -1572,7 +1875,7 @@ class DataBlockCleaner(object):
         if valid_ratio == 0:
             return
 
-        ppn_start, ppn_end = self.conf.block_to_page_range(blocknum)
+        ppn_start, ppn_end = self.geometry.block_to_page_range(blocknum)
         for ppn in range(ppn_start, ppn_end):
             try:
                 lpn = self.oob.ppn_to_lpn_or_mvpn(ppn)
@@ -1596,7 +1899,7 @@ class DataBlockCleaner(object):
 
         self.log(blocknum)
 
-        ppn_start, ppn_end = self.conf.block_to_page_range(blocknum)
+        ppn_start, ppn_end = self.geometry.block_to_page_range(blocknum)
         for ppn in range(ppn_start, ppn_end):
             if self.oob.states.is_page_valid(ppn):
                 yield self.env.process(self._clean_page(ppn, purpose))
@@ -1666,6 +1969,7 @@ class TransBlockCleaner(object):
     def __init__(self, conf, flash, oob, block_pool, mappings, directory, rec,
             env, trans_page_locks):
         self.conf = conf
+        self.geometry = conf.geometry()
         self.flash = flash
         self.oob = oob
         self.block_pool = block_pool
@@ -1679,7 +1983,7 @@ class TransBlockCleaner(object):
         assert blocknum in self.block_pool.used_blocks
         # assert blocknum not in self.block_pool.current_blocks()
 
-        ppn_start, ppn_end = self.conf.block_to_page_range(blocknum)
+        ppn_start, ppn_end = self.geometry.block_to_page_range(blocknum)
         for ppn in range(ppn_start, ppn_end):
             if self.oob.states.is_page_valid(ppn):
                 yield self.env.process(self._clean_page(ppn, purpose))
@@ -1755,16 +2059,17 @@ class OutOfBandAreas(object):
     """
     def __init__(self, confobj):
         self.conf = confobj
+        self.geometry = confobj.geometry()
 
         self.flash_num_blocks = confobj.n_blocks_per_dev
         self.flash_npage_per_block = confobj.n_pages_per_block
         self.total_pages = self.flash_num_blocks * self.flash_npage_per_block
 
         # Key data structures
-        self.states = FlashBitmap2(confobj)
+        self.states = IndexedFlashBitmap2(confobj)
         # ppn->lpn mapping stored in OOB, Note that for translation pages, this
         # mapping is ppn -> m_vpn
-        self.ppn_to_lpn_mvpn = {}
+        self.ppn_to_lpn_mvpn = create_page_map(confobj, self.total_pages)
         # Timestamp table PPN -> timestamp
         # Here are the rules:
         # 1. only programming a PPN updates the timestamp of PPN
@@ -1775,7 +2080,7 @@ class OutOfBandAreas(object):
         # 2. discarding, and reading a ppn does not change it.
         # 3. erasing a block will remove all the timestamps of the block
         # 4. so cur_timestamp can only be advanced by LBA operations
-        self.timestamp_table = {}
+        self.timestamp_table = create_page_map(confobj, self.total_pages)
         self.cur_timestamp = 0
 
         # flash block -> last invalidation time
@@ -1803,7 +2108,7 @@ class OutOfBandAreas(object):
     def erase_block(self, flash_block):
         self.states.erase_block(flash_block)
 
-        start, end = self.conf.block_to_page_range(flash_block)
+        start, end = self.geometry.block_to_page_range(flash_block)
         for ppn in range(start, end):
             try:
                 del self.ppn_to_lpn_mvpn[ppn]
@@ -1849,7 +2154,7 @@ class OutOfBandAreas(object):
 
     def invalidate_ppn(self, ppn):
         self.states.invalidate_page(ppn)
-        block, _ = self.conf.page_to_block_off(ppn)
+        block = self.geometry.page_to_block(ppn)
         self.last_inv_time_of_block[block] = datetime.datetime.now()
 
     def validate_ppns(self, ppns):
@@ -1866,7 +2171,7 @@ class OutOfBandAreas(object):
         self.relocate_data_page(lpn, old_ppn, new_ppn, update_time=False)
 
     def lpns_of_block(self, flash_block):
-        s, e = self.conf.block_to_page_range(flash_block)
+        s, e = self.geometry.block_to_page_range(flash_block)
         lpns = []
         for ppn in range(s, e):
             lpns.append(self.ppn_to_lpn_mvpn.get(ppn, 'NA'))
@@ -1888,6 +2193,22 @@ class Config(config.ConfigNCQFTL):
             "mapping_cache_bytes": None, # cmt: cached mapping table
             "do_not_check_gc_setting": False,
             "write_gc_log": True,
+            # how mapping cache rows are stored, 'object' or 'array'.
+            # 'array' uses much less memory for large mapping caches.
+            "lpn_table_storage": 'object',
+            # how the global mapping table and the OOB ppn->lpn and
+            # timestamp tables are stored, 'dict', 'array' or 'mmap'.
+            # 'array' and 'mmap' preallocate 8 bytes per page of the device.
+            "mapping_table_storage": 'dict',
+            # translate and update a run of lpns of the same m_vpn with the
+            # m_vpn locked once in one process. This is faster, but other
+            # processes no longer interleave between the lpns of a run, so
+            # cache misses and GC work differ from the default, where each
+            # lpn is done in its own process.
+            "batch_mapping_ops": False,
+            # directory of the sparse files backing 'mmap' tables. If None,
+            # anonymous memory is mapped.
+            "mapping_table_mmap_dir": None,
             }
         self.update(local_itmes)
         self['segment_bytes'] = 1*TB
@@ -1981,6 +2302,10 @@ class Config(config.ConfigNCQFTL):
             page_count += 1
         return page, page_count
 
+    def geometry(self):
+        return config.FlashGeometry(self['flash_config'],
+                n_mapping_entries_per_page=self.n_mapping_entries_per_page)
+
     def lpn_to_m_vpn(self, lpn):
         return lpn / self.n_mapping_entries_per_page
 
@@ -2003,7 +2328,7 @@ class Config(config.ConfigNCQFTL):
 
 def write_timeline(conf, recorder, op_id, op, arg, start_time, end_time):
     if conf.get('write_timeline', False) is True:
-        recorder.write_file('timeline.txt',
+        recorder.write_timeline('timeline.txt',
             op_id = op_id, op = op, arg = arg,
             start_time = start_time, end_time = end_time)
 
@@ -1,6 +1,16 @@
 import simpy
 import random
 
+from commons import OP_BARRIER, OP_LOAD_STATE, OP_READ, OP_WRITE, \
+        OP_DISCARD
+
+# operations of the requests counted by NCQSingleQueue.track_depth()
+DEPTH_OPS = frozenset([OP_READ, OP_WRITE, OP_DISCARD])
+# operations after which NCQSingleQueue hands out nothing until barrier()
+# ends. Nothing may run while a checkpoint is loaded and the clock moves to
+# the time of the checkpoint.
+BARRIER_OPS = frozenset([OP_BARRIER, OP_LOAD_STATE])
+
 class Extent(object):
     def __init__(self, lpn_start, lpn_count):
         assert lpn_count > 0
@@ -66,18 +76,120 @@ def create_ssd_request(conf, event):
             event.operation)
 
 
+class _BarrierStore(simpy.Store):
+    """
+    Store of NCQSingleQueue. It counts the requests taken from it, and once
+    one of BARRIER_OPS is taken, it hands out nothing until the barrier
+    ends.
+    """
+    def __init__(self, env, ncq, capacity):
+        super(_BarrierStore, self).__init__(env, capacity)
+        self.ncq = ncq
+
+    def _do_put(self, event):
+        proceed = super(_BarrierStore, self)._do_put(event)
+        if event.triggered and self.ncq._depth_histogram is not None and \
+                event.item.operation in DEPTH_OPS:
+            self.ncq._change_depth(1)
+        return proceed
+
+    def _do_get(self, event):
+        if not self.items or self.ncq.in_barrier is True:
+            return False
+
+        item = self.items.pop(0)
+        self.ncq.n_in_flight += 1
+        if item.operation in BARRIER_OPS:
+            self.ncq.in_barrier = True
+        event.succeed(item)
+        # keep serving waiting getters, as items may be left after a
+        # barrier ends
+        return True
+
+
 class NCQSingleQueue(object):
     """
     User of the queue can take up to depth # of request without
     returning
+
+    With drain_on_barrier, OP_BARRIER is a barrier: requests put after it
+    are not taken from the queue until all requests taken before it are
+    done (finish_request()) and its holder has run barrier(). The same
+    holds for OP_LOAD_STATE.
+
+    queue holds at most queue_capacity requests not taken yet, None for
+    unbounded.
     """
-    def __init__(self, ncq_depth, simpy_env):
+    def __init__(self, ncq_depth, simpy_env, drain_on_barrier=True,
+            queue_capacity=None):
         self.ncq_depth = ncq_depth
         self.env = simpy_env
-        self.queue = simpy.Store(self.env)
+        if queue_capacity is None:
+            queue_capacity = float('inf')
+        if drain_on_barrier is True:
+            self.queue = _BarrierStore(self.env, self, queue_capacity)
+        else:
+            self.queue = simpy.Store(self.env, queue_capacity)
         # ssd need to grab a slot before get item from queue
         self.slots = simpy.Resource(self.env, capacity=ncq_depth)
 
+        # requests taken from the queue and not finished yet
+        self.n_in_flight = 0
+        self.in_barrier = False
+        self._drained = None
+
+        # reads, writes and discards put and not finished yet, counted
+        # after track_depth()
+        self.n_outstanding = 0
+        self._depth_histogram = None
+        self._depth_since = None
+
+    def track_depth(self, histogram):
+        """
+        Add the time spent with each number of outstanding reads, writes and
+        discards (put to the queue and not finished) to histogram, as
+        histogram.add(depth, duration). Call it before requests are put. It
+        needs drain_on_barrier.
+        """
+        self.n_outstanding = 0
+        self._depth_histogram = histogram
+        self._depth_since = self.env.now
+
+    def _change_depth(self, delta):
+        now = self.env.now
+        if now > self._depth_since:
+            self._depth_histogram.add(self.n_outstanding,
+                    now - self._depth_since)
+            self._depth_since = now
+        self.n_outstanding += delta
+
+    def finish_request(self, request):
+        """
+        Tell the queue that request, taken from it, is done.
+        """
+        self.n_in_flight -= 1
+        if self._depth_histogram is not None and \
+                request.operation in DEPTH_OPS:
+            self._change_depth(-1)
+        if self._drained is not None and self.n_in_flight == 1:
+            drained = self._drained
+            self._drained = None
+            drained.succeed()
+
+    def barrier(self):
+        """
+        Process run by the taker of an OP_BARRIER. It waits until the other
+        requests taken from the queue are done, then lets the queue hand out
+        requests again. The barrier itself is still in flight until
+        finish_request().
+        """
+        if self.n_in_flight > 1:
+            self._drained = self.env.event()
+            yield self._drained
+
+        self.in_barrier = False
+        self.queue._trigger_get(None)
+
     def hold_all_slots(self):
         held_slot_reqs = []
         for i in range(self.ncq_depth):
@@ -125,8 +237,10 @@ class LockPool(object):
         self.locked_addrs = set()
 
     def get_request(self, addr):
-        res = self.resources.setdefault(addr,
-                                    simpy.Resource(self.env, capacity = 1))
+        res = self.resources.get(addr, None)
+        if res is None:
+            res = simpy.Resource(self.env, capacity = 1)
+            self.resources[addr] = res
         return res.request()
 
     def release_request(self, addr, request):
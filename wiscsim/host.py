@@ -4,6 +4,24 @@ import hostevent
 
 
 class Host(object):
+    """
+    Host puts the events of event_iter to the ncq of the Ssd.
+
+    With conf['host_replay'] 'closed', it puts them as fast as the ncq takes
+    them. With 'open', it puts each event at its timestamp in the trace
+    (seconds, as blkparse writes them) instead, with the gaps between
+    timestamps multiplied by conf['host_time_scale']. Timestamps are taken
+    relative to the first event after the last OP_BARRIER, since workloads
+    such as BlktraceEvents chain traces that each start at 0 with barriers
+    between them. After putting an OP_BARRIER, Host waits until the Ssd has
+    drained the queue for it, so the next trace starts when the ssd is
+    past the barrier. Other control events do not drain the queue and do
+    not restart the timestamps. Control events and events without
+    timestamps are put right away.
+    Requests wait in the host queue until the ssd takes them. It holds at
+    most conf['host_queue_depth'] requests, or any number if it is None;
+    when it is full, Host waits for room.
+    """
     def __init__(self, conf, simpy_env, event_iter):
         self.conf = conf
         self.env = simpy_env
@@ -11,7 +29,8 @@ class Host(object):
 
         self._ncq = NCQSingleQueue(
                 ncq_depth = self.conf['SSDFramework']['ncq_depth'],
-                simpy_env = self.env)
+                simpy_env = self.env,
+                queue_capacity = self.conf.get('host_queue_depth', None))
 
     def get_ncq(self):
         return self._ncq
@@ -25,8 +44,52 @@ class Host(object):
             if event.action == 'D':
                 yield self._ncq.queue.put(event)
 
-    def run(self):
-        yield self.env.process(self._process())
-        yield self._ncq.queue.put(hostevent.ControlEvent(OP_SHUT_SSD))
+    def _process_open_loop(self):
+        env = self.env
+        put = self._ncq.queue.put
+        # putting to an unbounded queue never waits
+        wait_for_put = self.conf.get('host_queue_depth', None) is not None
+        nsec_per_sec = SEC * self.conf.get('host_time_scale', 1.0)
+        Event = hostevent.Event
+
+        # simulated time of the event with timestamp first_timestamp
+        base_time = None
+        first_timestamp = None
+        for event in self.event_iter:
+            if event.action != 'D':
+                continue
 
+            if type(event) is not Event:
+                if event.operation == OP_BARRIER:
+                    event.barrier_done = env.event()
+            elif event.offset < 0:
+                # due to padding, accesing disk head will be negative.
+                continue
+            elif event.timestamp is not None:
+                timestamp = float(event.timestamp)
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                    base_time = env.now
+                issue_time = base_time + \
+                        (timestamp - first_timestamp) * nsec_per_sec
+                if issue_time > env.now:
+                    yield env.timeout(issue_time - env.now)
+                event.enqueue_time = env.now
+            else:
+                event.enqueue_time = env.now
+
+            if wait_for_put is True:
+                yield put(event)
+            else:
+                put(event)
 
+            if event.barrier_done is not None:
+                yield event.barrier_done
+                first_timestamp = None
+
+    def run(self):
+        if self.conf.get('host_replay', 'closed') == 'open':
+            yield self.env.process(self._process_open_loop())
+        else:
+            yield self.env.process(self._process())
+        yield self._ncq.queue.put(hostevent.ControlEvent(OP_SHUT_SSD))
@@ -1,7 +1,18 @@
+import mmap
+import os
+import struct
+
 from ftlsim_commons import Extent
 from commons import *
 
 class HostEventBase(object):
+    # simulated time when the request arrives at the host queue, set by
+    # Host in open-loop replay
+    enqueue_time = None
+    # for OP_BARRIER in open-loop replay, an event that Ssd triggers when
+    # the barrier has drained the queue
+    barrier_done = None
+
     def get_operation(self):
         raise NotImplementedError
 
@@ -28,6 +39,20 @@ class ControlEvent(HostEventBase):
                 self.arg1, self.arg2, self.arg3)
 
 
+class BarrierGen(object):
+    """
+    NCQSingleQueue drains on OP_BARRIER, so a barrier no longer needs
+    OP_NOOPs around it to fill the ncq slots.
+
+    n_ncq_slots is deprecated and ignored.
+    """
+    def __init__(self, n_ncq_slots=None):
+        pass
+
+    def barrier_events(self):
+        yield ControlEvent(operation=OP_BARRIER)
+
+
 class Event(HostEventBase):
     def __init__(self, sector_size, pid, operation, offset, size,
             timestamp = None, pre_wait_time = None, sync = True, action = 'D'):
@@ -120,3 +145,147 @@ class EventIterator(object):
             yield self.str_to_event(line)
 
 
+# Binary event file
+#
+# A binary event file has the magic string followed by fixed-width records
+# of BINARY_EVENT_RECORD, one per line of the text event file:
+#   pid, action, operation code, offset, size, timestamp in nanoseconds,
+#   pre_wait_time (NaN for 'NA'), sync (0 or 1)
+BINARY_EVENT_MAGIC = 'WSEVENT1'
+BINARY_EVENT_RECORD = struct.Struct('<qcBqqqdB')
+BINARY_EVENT_SUFFIX = '.bin'
+BINARY_EVENT_OPS = ('read', 'write', 'discard')
+DEFAULT_EVENT_COLUMN_NAMES = ['pid', 'action', 'operation', 'offset', 'size',
+        'timestamp', 'pre_wait_time', 'sync']
+
+
+def binary_event_path(text_path):
+    return text_path + BINARY_EVENT_SUFFIX
+
+
+def _timestamp_to_ns(timestamp):
+    """
+    blkparse timestamps are seconds with 9 decimal places, '0.000223461'.
+    """
+    sec, _, frac = timestamp.partition('.')
+    if len(frac) > 9:
+        raise ValueError("timestamp {} has more than 9 decimal places"\
+                .format(timestamp))
+    return int(sec) * 10**9 + int(frac.ljust(9, '0'))
+
+
+def _ns_to_timestamp(ns):
+    return '{}.{:09d}'.format(ns / 10**9, ns % 10**9)
+
+
+def convert_event_file(text_path, binary_path=None, column_names=None):
+    """
+    Convert a text event file (blkparse-events-for-ftlsim.txt) to the binary
+    event file format. It only needs to be done once per trace.
+    Return the path of the binary file.
+    """
+    if binary_path is None:
+        binary_path = binary_event_path(text_path)
+    if column_names is None:
+        column_names = DEFAULT_EVENT_COLUMN_NAMES
+    op_codes = {op: code for code, op in enumerate(BINARY_EVENT_OPS)}
+
+    tmp_path = binary_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        out.write(BINARY_EVENT_MAGIC)
+        for line in FileLineIterator(text_path):
+            items = line.split()
+            if len(column_names) != len(items):
+                raise RuntimeError("Lengths not equal: {} {}".format(
+                    column_names, items))
+            dic = dict(zip(column_names, items))
+            if not dic['action'] in ('D', 'C'):
+                raise RuntimeError("action:{}".format(dic['action']))
+            if dic['pre_wait_time'] == 'NA':
+                pre_wait_time = float('nan')
+            else:
+                pre_wait_time = float(dic['pre_wait_time'])
+            out.write(BINARY_EVENT_RECORD.pack(
+                int(dic['pid']),
+                dic['action'],
+                op_codes[dic['operation']],
+                int(dic['offset']),
+                int(dic['size']),
+                _timestamp_to_ns(dic['timestamp']),
+                pre_wait_time,
+                {'False': 0, 'True': 1}[dic['sync']]))
+    os.rename(tmp_path, binary_path)
+
+    return binary_path
+
+
+class BinaryEventIterator(object):
+    """
+    Iterate events of a binary event file through mmap. The events are the
+    same as the ones EventIterator gets from the text file.
+    """
+    def __init__(self, conf, binary_path):
+        self.conf = conf
+        self.sector_size = self.conf['sector_size']
+        self.binary_path = binary_path
+
+        self._translation = {0: OP_READ, 1: OP_WRITE, 2: OP_DISCARD}
+
+    def __iter__(self):
+        sector_size = self.sector_size
+        translation = self._translation
+        unpack_from = BINARY_EVENT_RECORD.unpack_from
+        new_event = Event.__new__
+        record_size = BINARY_EVENT_RECORD.size
+
+        with open(self.binary_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == len(BINARY_EVENT_MAGIC):
+                # mmap cannot map an empty range
+                return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if buf[:len(BINARY_EVENT_MAGIC)] != BINARY_EVENT_MAGIC:
+                    raise RuntimeError("{} is not a binary event file".format(
+                        self.binary_path))
+                for off in xrange(len(BINARY_EVENT_MAGIC), len(buf),
+                        record_size):
+                    pid, action, op, offset, size, ts_ns, pre_wait_time, \
+                        sync = unpack_from(buf, off)
+                    if pre_wait_time != pre_wait_time:
+                        # NaN
+                        pre_wait_time = 'NA'
+                    if offset % sector_size != 0 or size % sector_size != 0:
+                        raise RuntimeError("Event offset {} or size {} is not "
+                            "aligned with sector size {}".format(offset, size,
+                            sector_size))
+                    # Fields are typed and checked, so the attributes are set
+                    # directly instead of going through Event.__init__.
+                    # Like EventIterator, the timestamp and sync are strings
+                    # as in the text file.
+                    event = new_event(Event)
+                    event.pid = pid
+                    event.operation = translation[op]
+                    event.offset = offset
+                    event.size = size
+                    event.sync = 'True' if sync else 'False'
+                    event.timestamp = _ns_to_timestamp(ts_ns)
+                    event.pre_wait_time = pre_wait_time
+                    event.action = action
+                    event.sector = offset / sector_size
+                    event.sector_count = size / sector_size
+                    yield event
+            finally:
+                buf.close()
+
+
+def event_file_iterator(conf, text_path):
+    """
+    Iterate the events of text_path. If the binary event file converted from
+    text_path exists and is not older than text_path, read it instead.
+    """
+    bin_path = binary_event_path(text_path)
+    if os.path.exists(bin_path) and (not os.path.exists(text_path) or
+            os.path.getmtime(bin_path) >= os.path.getmtime(text_path)):
+        return BinaryEventIterator(conf, bin_path)
+    else:
+        return EventIterator(conf, FileLineIterator(text_path))
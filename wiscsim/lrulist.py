@@ -1,3 +1,4 @@
+import array
 import collections
 
 class Node(object):
@@ -87,6 +88,9 @@ class LinkedList(object):
         self.add_before(node, old_head)
 
     def add_to_tail(self, node):
+        if self._head is self._end_guard:
+            # the list is empty, node is also the head
+            self._head = node
         self.add_before(node, self._end_guard)
 
     def move_toward_head_by_one(self, node):
@@ -174,6 +178,204 @@ class LinkedList(object):
 
         return listview
 
+class IndexLinkedList(object):
+    """
+    Doubly linked list of integer slots 0, 1, ..., n_slots - 1. The links
+    are kept in two arrays instead of in Node objects, so a list of
+    millions of slots only costs a few bytes per slot.
+
+    It behaves the same as LinkedList. For example, a deleted slot keeps
+    its links, so a list can be iterated while the current slot is deleted.
+    """
+    def __init__(self, n_slots):
+        # slot n_slots is the end guard
+        self._end_guard = n_slots
+        self._prev = array.array('l', [n_slots]) * (n_slots + 1)
+        self._next = array.array('l', [n_slots]) * (n_slots + 1)
+        # head is newer than tail
+        self._head = self._end_guard
+
+        self.size = 0
+
+    def add_before(self, new_slot, slot):
+        """
+        add new_slot before slot
+        Note: this does not handle list head
+        """
+        slot1 = self._prev[slot]
+
+        self._next[new_slot] = slot
+        self._prev[new_slot] = slot1
+
+        self._next[slot1] = new_slot
+        self._prev[slot] = new_slot
+
+        self.size += 1
+
+    def add_to_head(self, slot):
+        old_head = self._head
+        self._head = slot
+
+        self.add_before(slot, old_head)
+
+    def add_to_tail(self, slot):
+        if self._head == self._end_guard:
+            # the list is empty, slot is also the head
+            self._head = slot
+        self.add_before(slot, self._end_guard)
+
+    def move_to_head(self, slot):
+        if self.size <= 0:
+            raise RuntimeError("List size should be larger than 0")
+        self.delete(slot)
+        self.add_to_head(slot)
+
+    def delete(self, slot):
+        if self.size <= 0:
+            raise RuntimeError("List size should be larger than 0")
+
+        if slot == self._head:
+            self._head = self._next[slot]
+
+        prev_slot = self._prev[slot]
+        next_slot = self._next[slot]
+
+        self._next[prev_slot] = next_slot
+        self._prev[next_slot] = prev_slot
+
+        self.size -= 1
+
+    def head(self):
+        if self.size == 0:
+            return None
+        else:
+            return self._head
+
+    def tail(self):
+        if self.size == 0:
+            return None
+        else:
+            return self._prev[self._end_guard]
+
+    def __iter__(self):
+        slot = self._head
+        while slot != self._end_guard:
+            yield slot
+            slot = self._next[slot]
+
+    def __reversed__(self):
+        slot = self._prev[self._end_guard]
+        while slot != self._end_guard:
+            yield slot
+            slot = self._prev[slot]
+
+    def __len__(self):
+        return self.size
+
+
+class SlotLruCache(object):
+    """
+    LruCache whose values are stored in fixed slots 0 ... n_slots - 1,
+    such as rows of a table. The recency list is an IndexLinkedList of the
+    slots, so no Node object is created per key.
+
+    Subclasses can override _to_slot() and _to_value() to store values
+    other than the slot numbers themselves.
+    """
+    def __init__(self, n_slots):
+        # {key: slot}
+        self.table = {}
+        self.linked_list = IndexLinkedList(n_slots)
+        # key of each slot. Like Node.key, it is kept after the slot is
+        # deleted from the list.
+        self._keys = [None] * n_slots
+
+    def _to_slot(self, value):
+        return value
+
+    def _to_value(self, slot):
+        return slot
+
+    def has_key(self, key):
+        return self.table.has_key(key)
+
+    def __contains__(self, key):
+        return key in self.table
+
+    def keys(self):
+        return self.table.keys()
+
+    def get(self, key, default = None):
+        if self.table.has_key(key):
+            # will affect list order
+            return self.__getitem__(key)
+        else:
+            # will not affect list order
+            return default
+
+    def __getitem__(self, key):
+        slot = self.table[key]
+        self.linked_list.move_to_head(slot)
+        return self._to_value(slot)
+
+    def __delitem__(self, key):
+        slot = self.table.pop(key)
+        self.linked_list.delete(slot)
+
+    def __setitem__(self, key, value):
+        slot = self._to_slot(value)
+        if self.table.has_key(key):
+            if self.table[key] == slot:
+                self.linked_list.move_to_head(slot)
+                return
+            del self[key]
+        self.linked_list.add_to_head(slot)
+        self.table[key] = slot
+        self._keys[slot] = key
+
+    def add_as_least_used(self, key, value):
+        assert not self.table.has_key(key)
+        slot = self._to_slot(value)
+        self.linked_list.add_to_tail(slot)
+        self.table[key] = slot
+        self._keys[slot] = key
+
+    def __iter__(self):
+        # most recent -> least recent
+        for slot in self.linked_list:
+            yield self._keys[slot]
+
+    def __reversed__(self):
+        for slot in reversed(self.linked_list):
+            yield self._keys[slot]
+
+    def items(self):
+        return self.least_to_most_items()
+
+    def __len__(self):
+        return len(self.linked_list)
+
+    def peek(self, key):
+        return self._to_value(self.table[key])
+
+    def least_to_most_items(self):
+        for slot in reversed(self.linked_list):
+            yield self._keys[slot], self._to_value(slot)
+
+    def least_recently_used_key(self):
+        return self._keys[self.linked_list.tail()]
+
+    def most_recently_used_key(self):
+        return self._keys[self.linked_list.head()]
+
+    def victim_key(self):
+        return self.least_recently_used_key()
+
+    def __repr__(self):
+        return str([(self._keys[slot], self._to_value(slot))
+            for slot in self.linked_list])
+
+
 class LruCache(collections.MutableMapping):
     """
     Geting and setting (recent use) a value will move it to the head
@@ -268,6 +470,16 @@ class LruCache(collections.MutableMapping):
     def victim_key(self):
         return self.linked_list.tail().key
 
+    def __getstate__(self):
+        # the linked list is too deep for pickle to follow node by node
+        return list(self.least_to_most_items())
+
+    def __setstate__(self, items):
+        self.table = {}
+        self.linked_list = LinkedList()
+        for key, value in items:
+            self[key] = value
+
     def __repr__(self):
         t = []
         for node in self.linked_list:
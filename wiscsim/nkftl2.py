@@ -146,6 +146,7 @@ class GlobalHelper(object):
 class OutOfBandAreas(object):
     def __init__(self, confobj):
         self.conf = confobj
+        self.geometry = confobj.geometry()
 
         self.flash_num_blocks = confobj.n_blocks_per_dev
         self.flash_npage_per_block = confobj.n_pages_per_block
@@ -156,8 +157,8 @@ class OutOfBandAreas(object):
         self.ppn_to_lpn = {}
 
     def display_bitmap_by_block(self):
-        npages_per_block = self.conf.n_pages_per_block
-        nblocks = self.conf.n_blocks_per_dev
+        npages_per_block = self.geometry.n_pages_per_block
+        nblocks = self.geometry.n_blocks_per_dev
         totalpages =  nblocks * npages_per_block
         line = ''
         for i in range(totalpages):
@@ -184,7 +185,7 @@ class OutOfBandAreas(object):
         """
         self.states.erase_block(flash_block)
 
-        start, end = self.conf.block_to_page_range(flash_block)
+        start, end = self.geometry.block_to_page_range(flash_block)
         for ppn in range(start, end):
             try:
                 del self.ppn_to_lpn[ppn]
@@ -209,33 +210,34 @@ class OutOfBandAreas(object):
 
 
     def lpns_of_block(self, flash_block):
-        s, e = self.conf.block_to_page_range(flash_block)
+        s, e = self.geometry.block_to_page_range(flash_block)
         lpns = []
         for ppn in range(s, e):
             lpns.append(self.ppn_to_lpn.get(ppn, 'NA'))
 
         return lpns
 
+    def block_pages(self, flash_block):
+        """
+        Return states, lpns of all pages of flash_block in one call.
+        states[i] is the state code (FlashBitmap2.VALID_CODE, ...) of page i
+        of the block, lpns[i] is the LPN in the OOB of page i or None.
+        """
+        ppn_start, ppn_end = self.geometry.block_to_page_range(flash_block)
+        states = self.states.block_page_states(flash_block)
+        lpns = map(self.ppn_to_lpn.get, xrange(ppn_start, ppn_end))
+        return states, lpns
+
     def is_any_page_valid(self, flash_block):
-        ppn_start, ppn_end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(ppn_start, ppn_end):
-            if self.states.is_page_valid(ppn):
-                return True
-        return False
+        return self.states.block_valid_count(flash_block) > 0
 
     def are_all_pages_invalid(self, flash_block):
-        ppn_start, ppn_end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(ppn_start, ppn_end):
-            if not self.states.is_page_invalid(ppn):
-                return False
-        return True
+        return self.states.block_invalid_count(flash_block) == \
+                self.geometry.n_pages_per_block
 
     def are_all_pages_erased(self, flash_block):
-        ppn_start, ppn_end = self.conf.block_to_page_range(flash_block)
-        for ppn in range(ppn_start, ppn_end):
-            if not self.states.is_page_erased(ppn):
-                return False
-        return True
+        return self.states.block_erased_count(flash_block) == \
+                self.geometry.n_pages_per_block
 
 
 
@@ -247,6 +249,7 @@ class MappingBase(object):
     """
     def __init__(self, confobj, recorderobj, global_helper_obj):
         self.conf = confobj
+        self.geometry = confobj.geometry()
         self.recorder = recorderobj
         self.global_helper = global_helper_obj
 
@@ -286,12 +289,12 @@ class DataBlockMappingTable(MappingBase):
 
         Return: found, ppn
         """
-        logical_block, off = self.conf.page_to_block_off(lpn)
+        logical_block, off = self.geometry.page_to_block_off(lpn)
         found, pbn = self.lbn_to_pbn(logical_block)
         if not found:
             return False, None
 
-        ppn = self.conf.block_off_to_page(pbn, off)
+        ppn = self.geometry.block_off_to_page(pbn, off)
         return True, ppn
 
     def add_data_block_mapping(self, lbn, pbn):
@@ -359,9 +362,15 @@ class LogGroup2(object):
     - keep track of log blocks of this group
     - allocate pages from blocks of this group
     - report need to merge
+
+    If block_index (a dict) is given, the group keeps
+    block_index[pbn] = (dgn, CurrentBlock) for each of its log blocks, so
+    the owner can find the group of a block without scanning all groups.
     """
-    def __init__(self, conf, block_pool, max_n_log_blocks):
+    def __init__(self, conf, block_pool, max_n_log_blocks, dgn=None,
+            block_index=None):
         self.conf = conf
+        self.geometry = conf.geometry()
         self.block_pool = block_pool
         self.n_channels = block_pool.n_channels
         self.n_pages_per_block = block_pool.n_pages_per_block
@@ -374,20 +383,29 @@ class LogGroup2(object):
 
         self._page_map = bidict.bidict() # lpn->ppn
 
+        # pbn -> CurrentBlock of the log blocks in log_channels
+        self._log_blocks = {}
+        self.dgn = dgn
+        self._block_index = block_index
+
     def update_block_use_time(self, blocknum):
         pass
 
     def clear(self):
         self._page_map.clear()
         self.log_channels = [[] for i in range(self.n_channels)]
+        if self._block_index is not None:
+            for blocknum in self._log_blocks:
+                del self._block_index[blocknum]
+        self._log_blocks.clear()
 
     def add_mapping(self, lpn, ppn):
         """
         Note that this function may overwrite existing mapping. If later you
         need keeping everything, add one data structure.
         """
-        blk, off = self.conf.page_to_block_off(ppn)
-        assert blk in self.log_block_numbers()
+        blk, off = self.geometry.page_to_block_off(ppn)
+        assert blk in self._log_blocks
         self._page_map[lpn] = ppn
 
     def remove_lpn(self, lpn):
@@ -416,6 +434,15 @@ class LogGroup2(object):
             ret.append(cur_block.blocknum)
         return ret
 
+    def has_log_block(self, blocknum):
+        return blocknum in self._log_blocks
+
+    def get_cur_block(self, blocknum):
+        """
+        Return the CurrentBlock of log block blocknum, or None
+        """
+        return self._log_blocks.get(blocknum, None)
+
     def _incr_cur_channel(self):
         self._cur_channel = (self._cur_channel + 1) % self.n_channels
 
@@ -424,7 +451,7 @@ class LogGroup2(object):
 
     def remove_log_block(self, log_pbn):
         # remove all page maps
-        ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
+        ppn_start, ppn_end = self.geometry.block_to_page_range(log_pbn)
         for ppn in range(ppn_start, ppn_end):
             try:
                 # del self._page_map[:ppn]
@@ -434,25 +461,24 @@ class LogGroup2(object):
 
         self._remove_block(log_pbn)
 
+    def _add_block(self, channel_id, cur_block):
+        self.log_channels[channel_id].append(cur_block)
+        self._log_blocks[cur_block.blocknum] = cur_block
+        if self._block_index is not None:
+            self._block_index[cur_block.blocknum] = (self.dgn, cur_block)
+
     def _remove_block(self, blocknum):
-        channel_id = blocknum / self.conf.n_blocks_per_channel
-        channel_blocks = self.log_channels[channel_id]
-        to_del = None
-        for cur_block in channel_blocks:
-            if cur_block.blocknum == blocknum:
-                to_del = cur_block
-                break
-        channel_blocks.remove(to_del)
+        channel_id = blocknum / self.geometry.n_blocks_per_channel
+        to_del = self._log_blocks.pop(blocknum)
+        self.log_channels[channel_id].remove(to_del)
+        if self._block_index is not None:
+            del self._block_index[blocknum]
 
     def reached_max_log_blocks(self):
         return self.n_log_blocks() == self.max_n_log_blocks
 
     def n_log_blocks(self):
-        total = 0
-        for channel_id in range(self.n_channels):
-            total += len(self.log_channels[channel_id])
-
-        return total
+        return len(self._log_blocks)
 
     def n_free_pages(self):
         total = 0
@@ -535,13 +561,13 @@ class LogGroup2(object):
         return ret_ppns
 
     def register_pbn(self, pbn):
-        channel_id = pbn / self.conf.n_blocks_per_channel
+        channel_id = pbn / self.geometry.n_blocks_per_channel
 
         curblock = CurrentBlock(self.n_pages_per_block, pbn)
         # set the curblock as fully used so nobody accidentally use it
-        curblock.next_page_offset = self.conf.n_pages_per_block
+        curblock.next_page_offset = self.geometry.n_pages_per_block
 
-        self.log_channels[channel_id].append( curblock )
+        self._add_block(channel_id, curblock)
 
     def _allocate_block_in_channel(self, channel_id):
         cnt = self.block_pool.count_blocks(tag=TFREE, channels=[channel_id])
@@ -553,8 +579,8 @@ class LogGroup2(object):
 
         blocknum = self.block_pool.pick(tag=TFREE, channel_id=channel_id)
         self.block_pool.change_tag(blocknum, src=TFREE, dst=TLOG)
-        self.log_channels[channel_id].append(
-                CurrentBlock(self.n_pages_per_block, blocknum) )
+        self._add_block(channel_id,
+                CurrentBlock(self.n_pages_per_block, blocknum))
 
         assert self.n_log_blocks() <= self.max_n_log_blocks, "{} > {}".format(
                 self.n_log_blocks(), self.max_n_log_blocks)
@@ -633,21 +659,33 @@ class LogMappingTable(MappingBase):
 
         # dgn -> log block info of data group (LogGroup2)
         self.log_group_info = {}
+        # pbn -> (dgn, CurrentBlock) of all log blocks, kept by the groups
+        self._log_block_index = {}
 
     def find_group_by_pbn(self, pbn):
-        dgn = None
-        loggroup = None
-        for i_dgn, i_loggroup in self.log_group_info.items():
-            if pbn in i_loggroup.log_block_numbers():
-                dgn = i_dgn
-                loggroup = i_loggroup
+        """
+        Return dgn, LogGroup2 of log block pbn, or None, None
+        """
+        dgn, _ = self._log_block_index.get(pbn, (None, None))
+        if dgn is None:
+            return None, None
+        return dgn, self.log_group_info[dgn]
+
+    def find_block_by_pbn(self, pbn):
+        """
+        Return dgn, CurrentBlock of log block pbn, or None, None
+        """
+        return self._log_block_index.get(pbn, (None, None))
 
-        return dgn, loggroup
+    def is_log_block_of_group(self, pbn, dgn):
+        dgn_of_pbn, _ = self._log_block_index.get(pbn, (None, None))
+        return dgn_of_pbn is not None and dgn_of_pbn == dgn
 
     def next_ppns_to_program(self, dgn, n, strip_unit_size):
         loggroup = self.log_group_info.setdefault(dgn,
             LogGroup2(self.conf, self.block_pool,
-                max_n_log_blocks=self.conf['nkftl']['max_blocks_in_log_group']))
+                max_n_log_blocks=self.conf['nkftl']['max_blocks_in_log_group'],
+                dgn=dgn, block_index=self._log_block_index))
         return loggroup.next_ppns(n, strip_unit_size=strip_unit_size)
 
     def add_mapping(self, lpn, ppn):
@@ -871,6 +909,7 @@ class GarbageCollector(object):
             translatorobj, global_helper_obj, log_mapping, data_block_mapping,
             simpy_env, des_flash, logical_block_locks):
         self.conf = confobj
+        self.geometry = confobj.geometry()
         self.flash = flashobj
         self.oob = oobobj
         self.block_pool = block_pool
@@ -974,8 +1013,8 @@ class GarbageCollector(object):
 
         # Check to see if it is really the log block of the speicfed data
         # group
-        if log_pbn not in self.translator.log_mapping_table\
-                .log_group_info[data_group_no].log_block_numbers():
+        if not self.translator.log_mapping_table.is_log_block_of_group(
+                log_pbn, data_group_no):
             self._cleaner_res.release(req)
             return
 
@@ -1029,15 +1068,12 @@ class GarbageCollector(object):
         self.recorder.count_me("garbage_collection", 'full_merge')
 
         # Find all the logical blocks
-        ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
+        n_pages_per_block = self.geometry.n_pages_per_block
+        states, lpns = self.oob.block_pages(log_pbn)
         logical_blocks = set()
-        for ppn in range(ppn_start, ppn_end):
-            is_valid = self.oob.states.is_page_valid(ppn)
-            # print 'ppn {} is valid: {}'.format(ppn, is_valid)
-            if is_valid == True:
-                lpn = self.oob.ppn_to_lpn[ppn]
-                logical_block, _ = self.conf.page_to_block_off(lpn)
-                logical_blocks.add(logical_block)
+        for off, state in enumerate(states):
+            if state == FlashBitmap2.VALID_CODE:
+                logical_blocks.add(lpns[off] / n_pages_per_block)
 
         # Move all the pages of a logical block to new block
         for logical_block in logical_blocks:
@@ -1093,10 +1129,10 @@ class GarbageCollector(object):
         if dst_phy_block_num is None:
             raise OutOfSpaceError("Fail to find free block for full merge")
 
-        lpn_start, lpn_end = self.conf.block_to_page_range(lbn)
+        lpn_start, lpn_end = self.geometry.block_to_page_range(lbn)
         for lpn in range(lpn_start, lpn_end):
             in_block_page_off = lpn - lpn_start
-            dst_ppn = self.conf.block_off_to_page(dst_phy_block_num,
+            dst_ppn = self.geometry.block_off_to_page(dst_phy_block_num,
                 in_block_page_off)
             data_group_no = self.conf.nkftl_data_group_number_of_lpn(lpn)
 
@@ -1112,7 +1148,7 @@ class GarbageCollector(object):
                 self.oob.remap(lpn = lpn, old_ppn = src_ppn,
                     new_ppn = dst_ppn)
 
-                src_block, _ = self.conf.page_to_block_off(src_ppn)
+                src_block = self.geometry.page_to_block(src_ppn)
                 if self.conf['write_gc_log'] is True:
                     self.recorder.write_file('gc.log',
                         gcid=self.gcid,
@@ -1130,7 +1166,7 @@ class GarbageCollector(object):
                 # After moving, you need to check if the source block of src_ppn
                 # is totally free. If it is, we have to erase it and put it to
                 # free block pool
-                src_pbn, _ = self.conf.page_to_block_off(src_ppn)
+                src_pbn = self.geometry.page_to_block(src_ppn)
                 if not self.oob.is_any_page_valid(src_pbn):
                     if loc == IN_DATA_BLOCK:
                         yield self.env.process(
@@ -1166,7 +1202,7 @@ class GarbageCollector(object):
         self.logical_block_locks.release_request(lbn, req)
 
     def _is_any_lpn_in_logmapping(self, lbn):
-        start, end = self.conf.block_to_page_range(lbn)
+        start, end = self.geometry.block_to_page_range(lbn)
         for lpn in range(start, end):
             found, _ = self.log_mapping_table.lpn_to_ppn(lpn)
             if found is True:
@@ -1194,46 +1230,39 @@ class GarbageCollector(object):
 
         Return: True/False, logical block, offset of the first erased page
         """
-        ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
-
         # log_pbn must be a log block
         if not log_pbn in self.block_pool.log_usedblocks:
             return False, None, None
 
-        # first k pages must be valid
-        last_valid_ppn = None
-        for ppn in range(ppn_start, ppn_end):
-            if self.oob.states.is_page_valid(ppn):
-                last_valid_ppn = ppn
-            else:
-                break
+        states, lpns = self.oob.block_pages(log_pbn)
+        n_pages = len(states)
 
-        if last_valid_ppn == None or last_valid_ppn == ppn_end - 1:
+        # first k pages must be valid
+        n_valid = states.count(FlashBitmap2.VALID_CODE)
+        if n_valid == 0 or n_valid == n_pages:
             # nobody is valid or everybody is valid
             # if everybody is valid, it could be switch mergable, but not
             # partial mergable.
             return False, None, None
 
         # the rest must be erased
-        for ppn in range(last_valid_ppn + 1, ppn_end):
-            if not self.oob.states.is_page_erased(ppn):
-                return False, None, None
+        if states.count(FlashBitmap2.ERASED_CODE) != n_pages - n_valid or \
+                states.index(FlashBitmap2.ERASED_CODE) != n_valid:
+            return False, None, None
 
         # the valid pages must be aligned between logical and physical address
-        lpn_start = self.oob.ppn_to_lpn[ppn_start]
-        logical_block, off = self.conf.page_to_block_off(lpn_start)
+        lpn_start = lpns[0]
+        logical_block, off = self.geometry.page_to_block_off(lpn_start)
         if off != 0:
             # the first lpn is not aligned
             return False, None, None
 
-        for ppn in range(ppn_start, last_valid_ppn + 1):
-            lpn = self.oob.ppn_to_lpn[ppn]
-            if lpn - lpn_start != ppn - ppn_start:
-                # not aligned
-                return False, None, None
+        if lpns[:n_valid] != range(lpn_start, lpn_start + n_valid):
+            # not aligned
+            return False, None, None
 
         # now we know it is parital mergable
-        return True, logical_block, last_valid_ppn + 1 - ppn_start
+        return True, logical_block, n_valid
 
     def partial_merge(self, log_pbn, lbn, first_free_offset):
         """
@@ -1271,9 +1300,9 @@ class GarbageCollector(object):
             lbn)
         # Copy
         for offset in range(first_free_offset,
-                self.conf.n_pages_per_block):
-            lpn = self.conf.block_off_to_page(lbn, offset)
-            dst_ppn = self.conf.block_off_to_page(log_pbn, offset)
+                self.geometry.n_pages_per_block):
+            lpn = self.geometry.block_off_to_page(lbn, offset)
+            dst_ppn = self.geometry.block_off_to_page(log_pbn, offset)
 
             found, src_ppn, location = self.translator.lpn_to_ppn(lpn)
             if not found or not self.oob.states.is_page_valid(src_ppn):
@@ -1282,7 +1311,7 @@ class GarbageCollector(object):
                 # 2. found, but not valid
                 self.oob.states.invalidate_page(dst_ppn)
             elif found == True and location == IN_DATA_BLOCK:
-                src_block, _ = self.conf.page_to_block_off(src_ppn)
+                src_block = self.geometry.page_to_block(src_ppn)
                 data = self.flash.page_read(src_ppn, cat = TAG_PARTIAL_MERGE)
                 yield self.env.process(
                     self.des_flash.rw_ppns([src_ppn], 'read', tag=TAG_PARTIAL_MERGE))
@@ -1326,7 +1355,7 @@ class GarbageCollector(object):
                 # self.recycle_empty_data_block(src_block,
                     # tag = TAG_PARTIAL_MERGE ) # check and then recycle
             elif found == True and location == IN_LOG_BLOCK:
-                src_block, _ = self.conf.page_to_block_off(src_ppn)
+                src_block = self.geometry.page_to_block(src_ppn)
                 # If the lpn is in log block
                 data = self.flash.page_read(src_ppn, cat = TAG_PARTIAL_MERGE)
                 yield self.env.process(
@@ -1383,19 +1412,18 @@ class GarbageCollector(object):
 
         Return Mergable?, logical_block
         """
-        ppn_start, ppn_end = self.conf.block_to_page_range(log_pbn)
-        lpn_start = None
-
         if not log_pbn in self.block_pool.log_usedblocks:
             return False, None
 
+        n_pages_per_block = self.geometry.n_pages_per_block
+        states, lpns = self.oob.block_pages(log_pbn)
+
         logical_blocks = set()
         # valid pages should be aligned to the same logical block
-        for ppn in range(ppn_start, ppn_end):
-            if self.oob.states.is_page_valid(ppn) is True:
-                lpn = self.oob.ppn_to_lpn[ppn]
-                logical_block, logical_off = self.conf.page_to_block_off(lpn)
-                _, physical_off = self.conf.page_to_block_off(ppn)
+        for physical_off, state in enumerate(states):
+            if state == FlashBitmap2.VALID_CODE:
+                logical_block, logical_off = divmod(lpns[physical_off],
+                        n_pages_per_block)
 
                 if logical_off != physical_off:
                     return False, None
@@ -1407,10 +1435,10 @@ class GarbageCollector(object):
 
         # invalid pages should not be anywhere
         logical_block = logical_blocks.pop()
-        for ppn in range(ppn_start, ppn_end):
-            if self.oob.states.is_page_valid(ppn) is False:
-                _, physical_off = self.conf.page_to_block_off(ppn)
-                lpn = self.conf.block_off_to_page(logical_block, physical_off)
+        for physical_off, state in enumerate(states):
+            if state != FlashBitmap2.VALID_CODE:
+                lpn = self.geometry.block_off_to_page(logical_block,
+                        physical_off)
                 found, _ = self.log_mapping_table.lpn_to_ppn(lpn)
                 if found is True:
                     return False, None
@@ -1509,8 +1537,8 @@ class GarbageCollector(object):
 
         is_log_block = log_pbn in self.block_pool.log_usedblocks
         has_valid_pages = self.oob.is_any_page_valid(log_pbn)
-        is_in_dg = log_pbn in self.log_mapping_table\
-                .log_group_info[data_group_no].log_block_numbers()
+        is_in_dg = self.log_mapping_table.is_log_block_of_group(
+                log_pbn, data_group_no)
         if all([is_log_block, has_valid_pages, is_in_dg]):
             self.translator.log_mapping_table.remove_log_block(
                     data_group_no = data_group_no,
@@ -1528,8 +1556,8 @@ class GarbageCollector(object):
 
         is_log_block = log_pbn in self.block_pool.log_usedblocks
         no_valid_pages = not self.oob.is_any_page_valid(log_pbn)
-        is_in_dg = log_pbn in self.log_mapping_table\
-                .log_group_info[data_group_no].log_block_numbers()
+        is_in_dg = self.log_mapping_table.is_log_block_of_group(
+                log_pbn, data_group_no)
         if all([is_log_block, no_valid_pages, is_in_dg]):
             # all true, it should be OK to delete it
 
@@ -1606,17 +1634,17 @@ class GarbageCollector(object):
         loggroup.register_pbn(dst_pbn)
 
         # move data
-        start, end = self.conf.block_to_page_range(src_pbn)
+        start, end = self.geometry.block_to_page_range(src_pbn)
         for src_ppn in range(start, end):
             if self.oob.states.is_page_valid(src_ppn):
                 lpn = self.oob.translate_ppn_to_lpn(src_ppn)
-                lbn, _ = self.conf.page_to_block_off(lpn)
+                lbn = self.geometry.page_to_block(lpn)
 
                 req = self.logical_block_locks.get_request(lbn)
                 yield req
 
                 offset = src_ppn - start
-                dst_ppn = self.conf.block_off_to_page(dst_pbn, offset)
+                dst_ppn = self.geometry.block_off_to_page(dst_pbn, offset)
                 yield self.env.process(
                     self._move_page(src_ppn, dst_ppn, tag='wearleveling'))
 
@@ -1653,11 +1681,11 @@ class GarbageCollector(object):
         self.data_block_mapping_table.add_data_block_mapping(lbn, dst_pbn)
 
     def _move_block_data(self, src_pbn, dst_pbn, tag):
-        start, end = self.conf.block_to_page_range(src_pbn)
+        start, end = self.geometry.block_to_page_range(src_pbn)
         for src_ppn in range(start, end):
             if self.oob.states.is_page_valid(src_ppn):
                 offset = src_ppn - start
-                dst_ppn = self.conf.block_off_to_page(dst_pbn, offset)
+                dst_ppn = self.geometry.block_off_to_page(dst_pbn, offset)
                 yield self.env.process(
                     self._move_page(src_ppn, dst_ppn, tag=tag))
 
@@ -1724,13 +1752,19 @@ class Ftl(ftlbuilder.FtlBuilder):
     """
     def __init__(self, confobj, recorderobj, flashobj, simpy_env, des_flash):
         super(Ftl, self).__init__(confobj, recorderobj, flashobj)
+        self.geometry = confobj.geometry()
 
         self.des_flash = des_flash
         self.env = simpy_env
+
+        # {'read': CounterHandle, 'write': ..., 'discard': ...}
+        self._traffic_counters = dict(
+                (op, self.recorder.counter('traffic', op))
+                for op in ('read', 'write', 'discard'))
         self.block_pool = NKBlockPool(
             n_channels=self.conf.n_channels_per_dev,
-            n_blocks_per_channel=self.conf.n_blocks_per_channel,
-            n_pages_per_block=self.conf.n_pages_per_block,
+            n_blocks_per_channel=self.geometry.n_blocks_per_channel,
+            n_pages_per_block=self.geometry.n_pages_per_block,
             tags=[TDATA, TLOG],
             leveling_factor=self.conf['wear_leveling_factor'],
             leveling_diff=self.conf['wear_leveling_diff']
@@ -1795,14 +1829,14 @@ class Ftl(ftlbuilder.FtlBuilder):
 
     def read_ext(self, extent):
         req_size = extent.lpn_count * self.conf.page_size
-        self.recorder.add_to_general_accumulater('traffic', 'read', req_size)
+        self._traffic_counters['read'].add(req_size)
         self.read_bytes += req_size
         if self.read_bytes > self.pre_read_bytes + self.display_interval:
             print 'Read (MB)', self.pre_read_bytes / MB, 'reading', round(float(req_size) / MB, 2)
             sys.stdout.flush()
             self.pre_read_bytes = self.read_bytes
 
-        extents = split_ext(self.conf.n_pages_per_block, extent)
+        extents = split_ext(self.geometry.n_pages_per_block, extent)
         ext_data = []
         for logical_block_ext in extents:
             ret_data = yield self.env.process(self.read_logical_block(logical_block_ext))
@@ -1811,7 +1845,7 @@ class Ftl(ftlbuilder.FtlBuilder):
         self.env.exit(ext_data)
 
     def read_logical_block(self, extent):
-        block_id, _ = self.conf.page_to_block_off(extent.lpn_start)
+        block_id = self.geometry.page_to_block(extent.lpn_start)
         req = self.logical_block_locks.get_request(block_id)
         yield req
 
@@ -1845,7 +1879,7 @@ class Ftl(ftlbuilder.FtlBuilder):
 
     def write_ext(self, extent, data=None):
         req_size = extent.lpn_count * self.conf.page_size
-        self.recorder.add_to_general_accumulater('traffic', 'write', req_size)
+        self._traffic_counters['write'].add(req_size)
         self.written_bytes += req_size
         if self.written_bytes > self.pre_written_bytes + self.display_interval:
             print 'Written (MB)', self.pre_written_bytes / MB, 'writing', round(float(req_size) / MB, 2)
@@ -1866,8 +1900,8 @@ class Ftl(ftlbuilder.FtlBuilder):
         yield simpy.AllOf(self.env, data_group_procs)
 
     def _block_iter_of_extent(self, extent):
-        block_start, _ = self.conf.page_to_block_off(extent.lpn_start)
-        block_last, _ = self.conf.page_to_block_off(extent.last_lpn())
+        block_start = self.geometry.page_to_block(extent.lpn_start)
+        block_last = self.geometry.page_to_block(extent.last_lpn())
 
         return range(block_start, block_last + 1)
 
@@ -1940,13 +1974,13 @@ class Ftl(ftlbuilder.FtlBuilder):
     def print_mappings(self, mappings):
         block = 1136
         for lpn, ppn in mappings.items():
-            blk, _ = self.conf.page_to_block_off(lpn)
+            blk = self.geometry.page_to_block(lpn)
             # blk, _ = self.conf.page_to_block_off(ppn)
             if blk == block:
                 print lpn, '->', ppn
 
     def write_logical_block(self, extent, data=None):
-        block_id, _ = self.conf.page_to_block_off(extent.lpn_start)
+        block_id = self.geometry.page_to_block(extent.lpn_start)
         req = self.logical_block_locks.get_request(block_id)
         yield req
 
@@ -2055,22 +2089,22 @@ class Ftl(ftlbuilder.FtlBuilder):
 
     def discard_ext(self, extent):
         req_size = extent.lpn_count * self.conf.page_size
-        self.recorder.add_to_general_accumulater('traffic', 'discard', req_size)
+        self._traffic_counters['discard'].add(req_size)
         self.discarded_bytes += req_size
         if self.discarded_bytes > self.pre_discarded_bytes + self.display_interval:
             print 'Discarded (MB)', self.pre_discarded_bytes / MB, 'discarding', round(float(req_size) / MB, 2)
             sys.stdout.flush()
             self.pre_discarded_bytes = self.discarded_bytes
 
-        self.recorder.add_to_general_accumulater('traffic', 'discard',
+        self._traffic_counters['discard'].add(
                 extent.lpn_count*self.conf.page_size)
 
-        extents = split_ext(self.conf.n_pages_per_block, extent)
+        extents = split_ext(self.geometry.n_pages_per_block, extent)
         for logical_block_ext in extents:
             yield self.env.process(self._discard_logical_block(logical_block_ext))
 
     def _discard_logical_block(self, extent):
-        block_id, _ = self.conf.page_to_block_off(extent.lpn_start)
+        block_id = self.geometry.page_to_block(extent.lpn_start)
         req = self.logical_block_locks.get_request(block_id)
         yield req
 
@@ -1,20 +1,27 @@
 import collections
+import math
 import os
 import pprint
 import sys
 
 from utilities import utils
+import timelinewriter
 
 FILE_TARGET, STDOUT_TARGET = ('file', 'stdout')
+TEXT_TIMELINE, COLUMNAR_TIMELINE = ('text', 'columnar')
+
+
+def _raise_not_switched():
+    raise RuntimeError("You need to explicity enable/disable Recorder."
+        " We raise exception here because we think you will create"
+        " unexpected behaviors that are hard to debug.")
 
 
 def switchable(function):
     "decrator for class Recorder's method, so they can be switched on/off"
     def wrapper(self, *args, **kwargs):
         if self.enabled == None:
-            raise RuntimeError("You need to explicity enable/disable Recorder."
-                " We raise exception here because we think you will create"
-                " unexpected behaviors that are hard to debug.")
+            _raise_not_switched()
         if self.enabled == False:
             return
         else:
@@ -22,24 +29,192 @@ def switchable(function):
     return wrapper
 
 
+class CounterHandle(object):
+    """
+    One counter of the general accumulator, resolved once by
+    Recorder.counter() so hot paths can count with handle.add(n) instead of
+    add_to_general_accumulater(counter_set_name, item_name, n).
+
+    The count lives in the handle and is copied to the general accumulator
+    when the accumulator is read. add is swapped by the recorder: it does
+    nothing while the recorder is disabled.
+    """
+    def __init__(self, counter_set_name, item_name, value, enabled):
+        self.counter_set_name = counter_set_name
+        self.item_name = item_name
+        self.value = value
+        self.switch(enabled)
+
+    def switch(self, enabled):
+        if enabled is True:
+            self.add = self._add
+        elif enabled is False:
+            self.add = self._skip
+        else:
+            self.add = self._not_switched
+
+    def _add(self, addition=1):
+        self.value += addition
+
+    def _skip(self, addition=1):
+        pass
+
+    def _not_switched(self, addition=1):
+        _raise_not_switched()
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of non-negative integer values (e.g. latencies in ns) in
+    log-scaled buckets, as HdrHistogram does, resolved once by
+    Recorder.histogram() and filled with handle.add(value).
+
+    Values below 2**SUB_BUCKET_BITS have a bucket each. Larger values share
+    a bucket with values that differ by less than 2**-(SUB_BUCKET_BITS-1)
+    of them, so percentiles are within ~1.6% of the exact ones. The counts
+    are a list of a few thousand ints, however many values are added. add
+    is swapped by the recorder as CounterHandle.add is.
+
+    add(value, weight) counts value weight times, e.g. weight is the time
+    spent at a queue depth of value. count is then the total weight.
+    """
+    SUB_BUCKET_BITS = 7
+    # values up to 2**64 - 1
+    N_BUCKETS = (64 - SUB_BUCKET_BITS + 2) << (SUB_BUCKET_BITS - 1)
+    PERCENTILES = (('p50', 50), ('p99', 99), ('p99.9', 99.9))
+
+    def __init__(self, counter_set_name, item_name, enabled):
+        self.counter_set_name = counter_set_name
+        self.item_name = item_name
+        self.load(None)
+        self.switch(enabled)
+
+    def load(self, histogram):
+        "Replace the values by those of histogram, or clear them if None"
+        if histogram is None:
+            self.counts = [0] * self.N_BUCKETS
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+        else:
+            self.counts = list(histogram.counts)
+            self.count = histogram.count
+            self.total = histogram.total
+            self.min = histogram.min
+            self.max = histogram.max
+
+    def __getstate__(self):
+        # add is a bound method, which cannot be pickled
+        state = self.__dict__.copy()
+        del state['add']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.switch(None)
+
+    def switch(self, enabled):
+        if enabled is True:
+            self.add = self._add
+        elif enabled is False:
+            self.add = self._skip
+        else:
+            self.add = self._not_switched
+
+    def _add(self, value, weight=1):
+        value = int(value)
+        shift = value.bit_length() - self.SUB_BUCKET_BITS
+        if shift > 0:
+            self.counts[(shift << (self.SUB_BUCKET_BITS - 1)) +
+                    (value >> shift)] += weight
+        else:
+            self.counts[value] += weight
+
+        self.count += weight
+        self.total += value * weight
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def _skip(self, value, weight=1):
+        pass
+
+    def _not_switched(self, value, weight=1):
+        _raise_not_switched()
+
+    def bucket_range(self, index):
+        "Return the lowest and highest values of bucket index"
+        half = 1 << (self.SUB_BUCKET_BITS - 1)
+        if index < 2 * half:
+            return index, index
+        shift = (index >> (self.SUB_BUCKET_BITS - 1)) - 1
+        sub_bucket = index - (shift << (self.SUB_BUCKET_BITS - 1))
+        return sub_bucket << shift, ((sub_bucket + 1) << shift) - 1
+
+    def value_at_percentile(self, percentile):
+        """
+        Return the highest value of the bucket of the value at percentile,
+        but no more than the largest value added.
+        """
+        if self.count == 0:
+            return None
+        rank = max(1, int(math.ceil(percentile / 100.0 * self.count)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.bucket_range(index)[1], self.max)
+
+    def summary(self):
+        """
+        Return a dict with the count, min, mean, percentiles and max of the
+        values, and the non-empty buckets as [lowest value, count].
+        """
+        if self.count == 0:
+            return {'count': 0}
+
+        summary = {'count': self.count, 'min': self.min, 'max': self.max,
+                'mean': float(self.total) / self.count}
+        for name, percentile in self.PERCENTILES:
+            summary[name] = self.value_at_percentile(percentile)
+        summary['buckets'] = [[self.bucket_range(index)[0], n]
+                for index, n in enumerate(self.counts) if n > 0]
+        return summary
+
+
 class Recorder(object):
     def __init__(self, output_target,
             output_directory = None,
             verbose_level = 1,
-            print_when_finished = False):
+            print_when_finished = False,
+            timeline_format = TEXT_TIMELINE):
         self.output_target = output_target
         self.output_directory = output_directory
         self.verbose_level = verbose_level
         self.print_when_finished = print_when_finished
+        if timeline_format not in (TEXT_TIMELINE, COLUMNAR_TIMELINE):
+            raise ValueError("Unknown timeline format {}"
+                    .format(timeline_format))
+        self.timeline_format = timeline_format
 
         assert len(self.output_target) > 0
 
         self.file_pool = {} # {filename:descriptor}
         self.file_colnames = {} # {filename:[colname1, 2, ...]
+        self.timeline_writers = {} # {filename: ColumnarTimelineWriter}
 
         # {set name: collections.counter}
-        self.general_accumulator = {}
-        self.result_dict = {'general_accumulator': self.general_accumulator}
+        self._general_accumulator = {}
+        self.result_dict = {'general_accumulator': self._general_accumulator}
+        # {(set name, item name): CounterHandle}
+        self._counter_handles = {}
+        # {(set name, item name): LatencyHistogram}
+        self._histograms = {}
+        # functions called as listener(action, key) after enable(),
+        # disable() and set_result_by_one_key()
+        self._listeners = []
 
         self.enabled = None
 
@@ -53,7 +228,23 @@ class Recorder(object):
             'read_trans': 'background',
             'prog_trans': 'background'}
 
+    @property
+    def general_accumulator(self):
+        self._sync_counter_handles()
+        return self._general_accumulator
+
+    @general_accumulator.setter
+    def general_accumulator(self, accumulator):
+        self._general_accumulator = accumulator
+        self.result_dict['general_accumulator'] = accumulator
+        for (counter_set_name, item_name), handle in \
+                self._counter_handles.items():
+            handle.value = accumulator.get(counter_set_name, {}).get(
+                    item_name, 0)
+
     def close(self):
+        self._sync_counter_handles()
+        self._sync_histograms()
         self.__close_log_file()
         self.__save_accumulator()
         self.__save_result_dict()
@@ -62,17 +253,81 @@ class Recorder(object):
     def enable(self):
         print "....Recorder is enabled...."
         self.enabled = True
+        self._switch_counter_handles()
+        self._notify_listeners('enable')
 
     def disable(self):
         "Note that this will not clear the previous records"
         print "....Recorder is DIS-abled. Now not counting anything."
         self.enabled = False
+        self._switch_counter_handles()
+        self._notify_listeners('disable')
+
+    def add_listener(self, listener):
+        """
+        listener(action, key) is called after the recorder is enabled
+        (action 'enable'), disabled ('disable') or a result is set by
+        set_result_by_one_key() ('set_result', key is the result key). It
+        marks points of a run, such as the start of the target workload,
+        when the simulator processes them.
+        """
+        self._listeners.append(listener)
+
+    def _notify_listeners(self, action, key=None):
+        for listener in self._listeners:
+            listener(action, key)
+
+    def _switch_counter_handles(self):
+        for handle in self._counter_handles.values():
+            handle.switch(self.enabled)
+        for histogram in self._histograms.values():
+            histogram.switch(self.enabled)
+
+    def _sync_counter_handles(self):
+        "copy the counts of handles to the general accumulator"
+        accumulator = self._general_accumulator
+        for handle in self._counter_handles.values():
+            if handle.value == 0 and handle.item_name not in \
+                    accumulator.get(handle.counter_set_name, {}):
+                # never counted
+                continue
+            counter_dict = accumulator.setdefault(handle.counter_set_name,
+                    collections.Counter())
+            counter_dict[handle.item_name] = handle.value
+
+    @property
+    def histograms(self):
+        "{(set name, item name): LatencyHistogram}"
+        return self._histograms
+
+    @histograms.setter
+    def histograms(self, histograms):
+        # keep the handles, as users hold them
+        for key, histogram in self._histograms.items():
+            histogram.load(histograms.get(key, None))
+        for key, histogram in histograms.items():
+            self.histogram(*key).load(histogram)
+
+    def _sync_histograms(self):
+        """
+        put the summaries of histograms in the result dict:
+        {'histograms': {set name: {item name: summary}}}
+        """
+        if len(self._histograms) == 0:
+            return
+        summaries = self.result_dict.setdefault('histograms', {})
+        for histogram in self._histograms.values():
+            summaries.setdefault(histogram.counter_set_name, {})[
+                    histogram.item_name] = histogram.summary()
 
     def _close_file_pool(self):
         for _, file_handle in self.file_pool.items():
             os.fsync(file_handle)
             file_handle.close()
 
+        for _, writer in self.timeline_writers.items():
+            writer.close()
+
     def __save_result_dict(self):
         result_path = os.path.join(self.output_directory, 'recorder.json')
         utils.dump_json(self.result_dict, result_path)
@@ -105,10 +360,13 @@ class Recorder(object):
             sys.stdout.write(line)
 
     def get_result_summary(self):
+        self._sync_counter_handles()
+        self._sync_histograms()
         return self.result_dict
 
     def set_result_by_one_key(self, key, value):
         self.result_dict[key] = value
+        self._notify_listeners('set_result', key)
 
     def get_result_by_one_key(self, key):
         return self.result_dict[key]
@@ -133,10 +391,43 @@ class Recorder(object):
 
     def get_general_accumulater_cnt(self,
             counter_set_name, item_name):
-        counter_dict = self.general_accumulator.setdefault(counter_set_name,
+        handle = self._counter_handles.get((counter_set_name, item_name), None)
+        if handle is not None:
+            return handle.value
+
+        counter_dict = self._general_accumulator.setdefault(counter_set_name,
                 collections.Counter())
         return counter_dict[item_name]
 
+    def counter(self, counter_set_name, item_name):
+        """
+        Return the CounterHandle of item_name in counter_set_name. Get
+        handles once (for example, in __init__) and call handle.add(n) in
+        hot paths.
+        """
+        key = (counter_set_name, item_name)
+        handle = self._counter_handles.get(key, None)
+        if handle is None:
+            value = self._general_accumulator.get(counter_set_name, {}).get(
+                    item_name, 0)
+            handle = CounterHandle(counter_set_name, item_name, value,
+                    self.enabled)
+            self._counter_handles[key] = handle
+        return handle
+
+    def histogram(self, counter_set_name, item_name):
+        """
+        Return the LatencyHistogram of item_name in counter_set_name. Like
+        counter(), get it once and call histogram.add(value) in hot paths.
+        """
+        key = (counter_set_name, item_name)
+        histogram = self._histograms.get(key, None)
+        if histogram is None:
+            histogram = LatencyHistogram(counter_set_name, item_name,
+                    self.enabled)
+            self._histograms[key] = histogram
+        return histogram
+
     @switchable
     def add_to_general_accumulater(self,
             counter_set_name, item_name, addition):
@@ -149,7 +440,12 @@ class Recorder(object):
              counter 2: #},
         }
         """
-        counter_dict = self.general_accumulator.setdefault(counter_set_name,
+        handle = self._counter_handles.get((counter_set_name, item_name), None)
+        if handle is not None:
+            handle.value += addition
+            return
+
+        counter_dict = self._general_accumulator.setdefault(counter_set_name,
                 collections.Counter())
         counter_dict[item_name] += addition
 
@@ -219,6 +515,27 @@ class Recorder(object):
         args = [str(kwargs[colname]).rjust(width) for colname in colnames]
         fd.write(' '.join(args) + '\n')
 
+    def write_timeline(self, filename, **kwargs):
+        """
+        Write a row of a timeline, one row per op.
+
+        With the text format, this is write_file(filename, **kwargs). With
+        the columnar format, rows are buffered and written in chunks to
+        filename with its extension replaced by .cols. See timelinewriter.
+        """
+        if self.timeline_format == TEXT_TIMELINE:
+            self.write_file(filename, **kwargs)
+            return
+
+        writer = self.timeline_writers.get(filename, None)
+        if writer is None:
+            path = os.path.join(self.output_directory,
+                    timelinewriter.columnar_filename(filename))
+            writer = timelinewriter.ColumnarTimelineWriter(path,
+                    kwargs.keys())
+            self.timeline_writers[filename] = writer
+        writer.append(kwargs)
+
     def debug(self, *args):
         if self.verbose_level >= 3:
             self.__write_log('DEBUG', *args)
@@ -0,0 +1,280 @@
+"""
+Profilers of simulator runs.
+
+Workflow._run_simulator profiles the simulator if conf['profile_simulator']
+is set:
+
+    'cprofile': deterministic profiling by cProfile. Exact call counts, but
+                every function call is slowed down.
+    'sampling': the stack of the main thread is sampled every
+                conf['profile_sampling_interval'] seconds of CPU time by a
+                SIGPROF timer. Little overhead. Unix only.
+
+conf['profile_window'] selects what is profiled:
+
+    'run':      the whole simulator.run()
+    'workload': only the target workload, from the moment the simulator
+                enables the recorder (OP_ENABLE_RECORDER) to the moment it
+                records interest_workload_end, or to the end of the run.
+
+Both profilers write two files to result_dir:
+
+    simulator.pstats:    load it with pstats.Stats(path)
+    simulator.collapsed: one 'frame;frame;...;frame count' line per stack,
+                         the input of flamegraph.pl and speedscope
+
+A sampling profile has no call counts, so in its pstats the number of calls
+of a function is the number of samples it appears in. cProfile does not
+record stacks, so its collapsed file is estimated from the caller-callee
+times and counts microseconds.
+"""
+import collections
+import cProfile
+import marshal
+import os
+import pstats
+import signal
+
+CPROFILE, SAMPLING = ('cprofile', 'sampling')
+RUN_WINDOW, WORKLOAD_WINDOW = ('run', 'workload')
+
+PSTATS_FILENAME = 'simulator.pstats'
+COLLAPSED_FILENAME = 'simulator.collapsed'
+
+WORKLOAD_END_KEY = 'interest_workload_end'
+
+
+def create_profiler(conf):
+    """
+    Return the profiler selected by conf, or None if profiling is off.
+    """
+    profiler_type = conf.get('profile_simulator', None)
+    if profiler_type is None:
+        return None
+
+    window = conf.get('profile_window', RUN_WINDOW)
+    if profiler_type == CPROFILE:
+        return CProfileProfiler(window)
+    elif profiler_type == SAMPLING:
+        return SamplingProfiler(window,
+                interval=conf.get('profile_sampling_interval', 0.005))
+    else:
+        raise ValueError("Unknown simulator profiler {}".format(profiler_type))
+
+
+def frame_label(func):
+    """
+    func is a pstats key (filename, first line number, function name)
+    """
+    filename, lineno, funcname = func
+    if filename == '~':
+        # built-in functions
+        return funcname
+    return '{} ({}:{})'.format(funcname, filename, lineno)
+
+
+def write_collapsed(stack_counts, path):
+    """
+    stack_counts is {(root func, ..., leaf func): count}
+    """
+    with open(path, 'w') as f:
+        for stack, count in sorted(stack_counts.items()):
+            if count > 0:
+                f.write('{} {}\n'.format(
+                    ';'.join(frame_label(func) for func in stack), count))
+
+
+class SimulatorProfiler(object):
+    """
+    Subclasses implement _start(), _stop() and save().
+    """
+    def __init__(self, window):
+        if window not in (RUN_WINDOW, WORKLOAD_WINDOW):
+            raise ValueError("Unknown profile window {}".format(window))
+        self.window = window
+        self.running = False
+        self.done = False
+
+    def start(self):
+        if self.running or self.done:
+            return
+        self.running = True
+        self._start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop()
+        self.running = False
+        self.done = True
+
+    def profile_run(self, simulator):
+        """
+        Run simulator and profile the window of the run.
+        """
+        if self.window == WORKLOAD_WINDOW:
+            simulator.recorder.add_listener(self._on_recorder_action)
+        else:
+            self.start()
+
+        try:
+            simulator.run()
+        finally:
+            self.stop()
+
+    def _on_recorder_action(self, action, key):
+        if action == 'enable':
+            self.start()
+        elif action == 'set_result' and key == WORKLOAD_END_KEY:
+            self.stop()
+
+    def save(self, result_dir):
+        raise NotImplementedError
+
+
+class CProfileProfiler(SimulatorProfiler):
+    def __init__(self, window):
+        super(CProfileProfiler, self).__init__(window)
+        self.profile = cProfile.Profile()
+
+    def _start(self):
+        self.profile.enable()
+
+    def _stop(self):
+        self.profile.disable()
+
+    def get_stats(self):
+        return pstats.Stats(self.profile)
+
+    def save(self, result_dir):
+        self.profile.dump_stats(os.path.join(result_dir, PSTATS_FILENAME))
+        write_collapsed(estimate_stacks(self.get_stats().stats),
+                os.path.join(result_dir, COLLAPSED_FILENAME))
+
+
+def estimate_stacks(stats, min_fraction=1e-4, max_depth=64):
+    """
+    Estimate {stack: microseconds} from the stats of pstats, in which each
+    function only has the time spent in it when called from each caller.
+    The time of a function on a stack is split among its callees in
+    proportion to their time when called from the function. Recursion is
+    cut at the first repeated function. Stacks under min_fraction of the
+    total time are dropped.
+    """
+    callees = collections.defaultdict(list) # {caller: [(callee, ct)]}
+    roots = []
+    for func, (_, _, _, _, callers) in stats.items():
+        if len(callers) == 0:
+            roots.append(func)
+        for caller, caller_stats in callers.items():
+            if isinstance(caller_stats, tuple):
+                ct = caller_stats[3]
+            else:
+                # an int number of calls, no times
+                ct = 0
+            callees[caller].append((func, ct))
+
+    total_time = sum(stats[func][3] for func in roots)
+    min_time = total_time * min_fraction
+    stack_counts = collections.Counter()
+
+    def visit(stack, func, budget):
+        _, _, tt, ct, _ = stats[func]
+        ratio = budget / ct if ct > 0 else 0.0
+        stack = stack + (func,)
+        stack_counts[stack] += int(round(tt * ratio * 1e6))
+
+        if len(stack) >= max_depth:
+            return
+        for callee, edge_ct in callees[func]:
+            callee_budget = edge_ct * ratio
+            if callee_budget >= min_time and callee_budget > 0 and \
+                    callee not in stack:
+                visit(stack, callee, callee_budget)
+
+    for func in roots:
+        visit((), func, stats[func][3])
+
+    return stack_counts
+
+
+class SamplingProfiler(SimulatorProfiler):
+    def __init__(self, window, interval=0.005):
+        super(SamplingProfiler, self).__init__(window)
+        self.interval = interval
+        self.stack_counts = collections.Counter()
+        self.n_samples = 0
+        self._old_handler = None
+        # {code object: pstats key}
+        self._funcs = {}
+
+    def _start(self):
+        self._old_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def _stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._old_handler)
+
+    def _sample(self, signum, frame):
+        funcs = self._funcs
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            func = funcs.get(code)
+            if func is None:
+                func = (code.co_filename, code.co_firstlineno, code.co_name)
+                funcs[code] = func
+            stack.append(func)
+            frame = frame.f_back
+        stack.reverse()
+        self.stack_counts[tuple(stack)] += 1
+        self.n_samples += 1
+
+    def create_stats(self):
+        """
+        Fill self.stats like cProfile.Profile does, so pstats.Stats(self)
+        works. Times are the number of samples times the interval.
+        """
+        # {func: [n samples, time in leaf, cumulative time, {caller: edge}]}
+        # edge is [n samples, n samples, time in leaf, cumulative time]
+        entries = {}
+        for stack, count in self.stack_counts.items():
+            seconds = count * self.interval
+            seen = set()
+            caller = None
+            edge = None
+            for func in stack:
+                entry = entries.setdefault(func, [0, 0.0, 0.0, {}])
+                if func not in seen:
+                    seen.add(func)
+                    entry[0] += count
+                    entry[2] += seconds
+                if caller is None:
+                    edge = None
+                else:
+                    edge = entry[3].setdefault(caller, [0, 0, 0.0, 0.0])
+                    edge[0] += count
+                    edge[1] += count
+                    edge[3] += seconds
+                caller = func
+            entry[1] += seconds
+            if edge is not None:
+                edge[2] += seconds
+
+        self.stats = dict(
+            (func, (n, n, tt, ct,
+                dict((caller, tuple(edge)) for caller, edge in callers.items())))
+            for func, (n, tt, ct, callers) in entries.items())
+
+    def get_stats(self):
+        return pstats.Stats(self)
+
+    def save(self, result_dir):
+        self.create_stats()
+        with open(os.path.join(result_dir, PSTATS_FILENAME), 'wb') as f:
+            # what pstats.Stats.dump_stats() writes, which also works
+            # without samples
+            marshal.dump(self.stats, f)
+        write_collapsed(self.stack_counts,
+                os.path.join(result_dir, COLLAPSED_FILENAME))
@@ -51,7 +51,8 @@ class Simulator(object):
         self.recorder = recorder.Recorder(output_target = self.conf['output_target'],
             output_directory = self.conf['result_dir'],
             verbose_level = self.conf['verbose_level'],
-            print_when_finished = self.conf['print_when_finished']
+            print_when_finished = self.conf['print_when_finished'],
+            timeline_format = self.conf['timeline_format']
             )
 
         if self.conf.has_key('enable_e2e_test'):
@@ -66,6 +67,11 @@ class SimulatorDESNew(Simulator):
         self.host = Host(self.conf, self.env, event_iter)
         self.ssd = ssdframework.Ssd(self.conf, self.env,
                 self.host.get_ncq(), self.recorder)
+        if self.conf.get('host_replay', 'closed') == 'open':
+            # time spent with each number of requests put by the host and
+            # not finished by the ssd
+            self.host.get_ncq().track_depth(
+                    self.recorder.histogram('queue_depth', 'outstanding'))
 
     def run(self):
         self.env.process(self.host.run())
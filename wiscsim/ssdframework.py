@@ -15,6 +15,7 @@ import bidict
 import config
 from commons import *
 from ftlsim_commons import *
+import checkpoint
 import flash
 import controller
 import ftlbuilder
@@ -28,6 +29,137 @@ import nkftl2
 from pyreuse.sysutils import blocktrace, blockclassifiers, dumpe2fsparser
 
 class SsdBase(object):
+    # operations that take no simulated time
+    INSTANT_OPS = set([OP_ENABLE_RECORDER, OP_DISABLE_RECORDER,
+        OP_WORKLOADSTART, OP_NOOP, OP_CALC_GC_DURATION,
+        OP_CALC_NON_MERGE_GC_DURATION, OP_DROP_TRANS_CACHE, OP_REC_TIMESTAMP,
+        OP_REC_FLASH_OP_CNT, OP_REC_FOREGROUND_OP_CNT, OP_REC_CACHE_HITMISS,
+        OP_REC_BW, OP_FALLOCATE, OP_SAVE_STATE])
+    # requests of the host to data
+    HOST_OPS = set([OP_READ, OP_WRITE, OP_DISCARD])
+
+    def _handle_instant_op(self, host_event):
+        operation = host_event.get_operation()
+
+        if operation == OP_ENABLE_RECORDER:
+            self.recorder.enable()
+
+        elif operation == OP_DISABLE_RECORDER:
+            self.recorder.disable()
+
+        elif operation == OP_WORKLOADSTART:
+            pass
+
+        elif operation == OP_NOOP:
+            pass
+
+        elif operation == OP_CALC_GC_DURATION:
+            dur = self.recorder.get_result_by_one_key('gc_end') - \
+                    self.recorder.get_result_by_one_key('gc_start')
+            self.recorder.set_result_by_one_key('gc_duration', dur)
+            self.recorder.set_result_by_one_key('gc_duration_sec', dur/SEC)
+
+        elif operation == OP_CALC_NON_MERGE_GC_DURATION:
+            dur = self.recorder.get_result_by_one_key('non_merge_gc_end') - \
+                    self.recorder.get_result_by_one_key('non_merge_gc_start')
+            self.recorder.set_result_by_one_key('non_merge_gc_duration', dur)
+            self.recorder.set_result_by_one_key('non_merge_gc_duration_sec', dur/SEC)
+
+        elif operation == OP_DROP_TRANS_CACHE:
+            if self.conf['ftl_type'] == 'dftldes':
+                self.ftl.drop_trans_cache()
+
+        elif operation == OP_REC_TIMESTAMP:
+            self.recorder.set_result_by_one_key(host_event.arg1,
+                    self.env.now)
+
+        elif operation == OP_REC_FLASH_OP_CNT:
+            result_dict = self.recorder.get_result_summary()
+            flashops = copy.deepcopy(
+                result_dict['general_accumulator'].get('flash_ops', {}))
+            self.recorder.set_result_by_one_key(host_event.arg1,
+                    flashops)
+
+        elif operation == OP_REC_FOREGROUND_OP_CNT:
+            result_dict = self.recorder.get_result_summary()
+            traffic = copy.deepcopy(
+                result_dict['general_accumulator'].get('traffic', {}))
+            self.recorder.set_result_by_one_key(host_event.arg1,
+                    traffic)
+
+        elif operation == OP_REC_CACHE_HITMISS:
+            result_dict = self.recorder.get_result_summary()
+            data = copy.deepcopy(
+                result_dict['general_accumulator'].get('Mapping_Cache', {}))
+            self.recorder.set_result_by_one_key(host_event.arg1,
+                    data)
+
+        elif operation == OP_REC_BW:
+            dur = self.recorder.get_result_by_one_key('interest_workload_end') - \
+                    self.recorder.get_result_by_one_key('interest_workload_start')
+            self.recorder.set_result_by_one_key('workload_duration_nsec', dur)
+            self.recorder.set_result_by_one_key('workload_duration_sec', float(dur)/SEC)
+
+            write_traffic = self.recorder.get_general_accumulater_cnt(
+                    'traffic', 'write') / MB
+
+            self.recorder.set_result_by_one_key('workload_duration_nsec', dur)
+
+            if dur == 0:
+                write_bw = "NA"
+            else:
+                write_bw = float(write_traffic)/(float(dur) / SEC)
+
+            self.recorder.set_result_by_one_key('write_bandwidth', write_bw)
+            print '>>>>>>>>>> Bandwidth (MB/s) <<<<<<<<<<<', write_bw
+            print '>>>>>>>>>> Traffic (MB)     <<<<<<<<<<<', write_traffic
+            print '>>>>>>>>>> Duration (sec)   <<<<<<<<<<<', float(dur) / SEC
+
+        elif operation == OP_FALLOCATE:
+            pass
+
+        elif operation == OP_SAVE_STATE:
+            checkpoint.save_ssd_state(self, host_event.arg1)
+
+    def _ftl_op_process(self, host_event):
+        """
+        Return the process (generator) that carries out host_event in the FTL,
+        or None if there is nothing to do for this FTL.
+        """
+        operation = host_event.get_operation()
+
+        if operation == OP_FLUSH_TRANS_CACHE:
+            if self.conf['ftl_type'] == 'dftldes':
+                return self.ftl.flush_trans_cache()
+
+        elif operation == OP_PURGE_TRANS_CACHE:
+            if self.conf['ftl_type'] == 'dftldes':
+                return self.ftl.purge_trans_cache()
+
+        elif operation == OP_CLEAN:
+            print 'start cleaning'
+            return self._cleaner_process(forced=True)
+
+        elif operation == OP_NON_MERGE_CLEAN:
+            print 'start non merge cleaning'
+            if self.conf['ftl_type'] == 'nkftl2':
+                return self.ftl.clean(forced=True, merge=False)
+
+        elif operation == OP_READ:
+            return self.ftl.read_ext(host_event.get_lpn_extent(self.conf))
+
+        elif  operation == OP_WRITE:
+            return self.ftl.write_ext(host_event.get_lpn_extent(self.conf))
+
+        elif  operation == OP_DISCARD:
+            return self.ftl.discard_ext(host_event.get_lpn_extent(self.conf))
+
+        else:
+            raise NotImplementedError("Operation {} not supported."\
+                    .format(host_event.operation))
+
+        return None
+
     def _process(self, pid):
         raise NotImplementedError()
 
@@ -43,8 +175,8 @@ class Ssd(SsdBase):
         self.ncq = ncq # should be initialized in Simulator
         self.n_processes = self.ncq.ncq_depth
 
-        self.flash_controller = controller.Controller3(
-                self.env, self.conf, self.recorder)
+        self.flash_controller = controller.Controller3(self.env, self.conf,
+                self.recorder)
 
         print 'initializing ssd...........', self.conf['ftl_type']
 
@@ -61,6 +193,41 @@ class Ssd(SsdBase):
         self.gc_sleep_timer = 0
         self.gc_sleep_duration = 10
 
+        # a request overlaps GC if a GC starts after
+        # _n_gc_started - _n_gc_running, the mark taken when it is dispatched
+        self._n_gc_started = 0
+        self._n_gc_running = 0
+        self._record_request_latency = self.conf.get(
+                'record_request_latency', True)
+        # {(histogram set, operation, overlaps GC): LatencyHistogram}
+        self._latency_histograms = {}
+
+    def _latency_histogram(self, set_name, operation, during_gc):
+        key = (set_name, operation, during_gc)
+        histogram = self._latency_histograms.get(key, None)
+        if histogram is None:
+            histogram = self.recorder.histogram(set_name,
+                    '{}-{}'.format(operation,
+                        'gc' if during_gc is True else 'no_gc'))
+            self._latency_histograms[key] = histogram
+        return histogram
+
+    def _record_latency(self, host_event, start_time, gc_mark):
+        """
+        Add the time from start_time until now to the request_latency
+        histogram of the operation, split by whether GC ran since gc_mark
+        was taken. If Host set the time the request arrived (open-loop
+        replay), add the time since then to host_latency too.
+        """
+        operation = host_event.operation
+        during_gc = self._n_gc_started > gc_mark
+        now = self.env.now
+        self._latency_histogram('request_latency', operation,
+                during_gc).add(now - start_time)
+        if host_event.enqueue_time is not None:
+            self._latency_histogram('host_latency', operation,
+                    during_gc).add(now - host_event.enqueue_time)
+
     def _create_ftl(self):
         if self.conf['ftl_type'] == 'dftldes':
             return dftldes.Ftl(self.conf, self.recorder, self.flash_controller,
@@ -71,22 +238,11 @@ class Ssd(SsdBase):
             return nkftl2.Ftl(self.conf, self.recorder, simpleflash, self.env,
                     self.flash_controller)
 
-    def _barrier(self):
-        """
-        Grab and hold the rest of the ncq slots (already holding one)
-        """
-        reqs = []
-        for i in range(self.ncq.ncq_depth - 1):
-            slot_req = self.ncq.slots.request()
-            reqs.append(slot_req)
-        yield simpy.AllOf(self.env, reqs)
-
-        for req in reqs:
-            self.ncq.slots.release(req)
-
     def _process(self, pid):
         for req_i in itertools.count():
             host_event = yield self.ncq.queue.get()
+            start_time = self.env.now
+            gc_mark = self._n_gc_started - self._n_gc_running
 
             slot_req = self.ncq.slots.request()
             yield slot_req
@@ -94,14 +250,8 @@ class Ssd(SsdBase):
             # handle host_event case by case
             operation = host_event.get_operation()
 
-            if operation == OP_ENABLE_RECORDER:
-                self.recorder.enable()
-
-            elif operation == OP_DISABLE_RECORDER:
-                self.recorder.disable()
-
-            elif operation == OP_WORKLOADSTART:
-                pass
+            if operation in self.INSTANT_OPS:
+                self._handle_instant_op(host_event)
 
             elif operation == OP_SHUT_SSD:
                 print 'got shut_ssd'
@@ -109,127 +259,31 @@ class Ssd(SsdBase):
                 yield self.env.process(self._end_all_processes())
 
             elif operation == OP_BARRIER:
-                # The correct way of doing barrier is to use
-                # OP_BARRIER with more than n_ncq_slots OP_NOOP.
-                # the OP_NOOPs are to make sure no other operations
-                # can be scheduled before OP_BARRIER.
-                # for example, EventA, OP_BARRIER, EventB cannot garantee
-                # that B executed before A because all A, Barrier and B can
-                # get the slots at the same time. Schedule is free to run
-                # them in any order. EventA, OP_NOOP x 9999, EventB cannot
-                # garantee either because OP_NOOP takes no time and Event B
-                # can run at the same time as A..
-                # So the correct way is
-                # EventA, OP_NOOPsx9999, OP_BARRIER, OP_NOOPSX9999, EventB
-                # OP_BARRIER will wait util EventA finishes. The first OP_NOOP
-                # x9999 makes sure eventA get a slot before barrier
-
-                yield self.env.process(self._barrier())
-
-            elif operation == OP_NOOP:
-                pass
-
-            elif operation == OP_CALC_GC_DURATION:
-                dur = self.recorder.get_result_by_one_key('gc_end') - \
-                        self.recorder.get_result_by_one_key('gc_start')
-                self.recorder.set_result_by_one_key('gc_duration', dur)
-                self.recorder.set_result_by_one_key('gc_duration_sec', dur/SEC)
-
-            elif operation == OP_CALC_NON_MERGE_GC_DURATION:
-                dur = self.recorder.get_result_by_one_key('non_merge_gc_end') - \
-                        self.recorder.get_result_by_one_key('non_merge_gc_start')
-                self.recorder.set_result_by_one_key('non_merge_gc_duration', dur)
-                self.recorder.set_result_by_one_key('non_merge_gc_duration_sec', dur/SEC)
-
-            elif operation == OP_FLUSH_TRANS_CACHE:
-                if self.conf['ftl_type'] == 'dftldes':
-                    yield self.env.process(self.ftl.flush_trans_cache())
-
-            elif operation == OP_PURGE_TRANS_CACHE:
-                if self.conf['ftl_type'] == 'dftldes':
-                    yield self.env.process(self.ftl.purge_trans_cache())
-
-            elif operation == OP_DROP_TRANS_CACHE:
-                if self.conf['ftl_type'] == 'dftldes':
-                    self.ftl.drop_trans_cache()
-
-            elif operation == OP_REC_TIMESTAMP:
-                self.recorder.set_result_by_one_key(host_event.arg1,
-                        self.env.now)
-
-            elif operation == OP_REC_FLASH_OP_CNT:
-                result_dict = self.recorder.get_result_summary()
-                flashops = copy.deepcopy(
-                    result_dict['general_accumulator'].get('flash_ops', {}))
-                self.recorder.set_result_by_one_key(host_event.arg1,
-                        flashops)
-
-            elif operation == OP_REC_FOREGROUND_OP_CNT:
-                result_dict = self.recorder.get_result_summary()
-                traffic = copy.deepcopy(
-                    result_dict['general_accumulator'].get('traffic', {}))
-                self.recorder.set_result_by_one_key(host_event.arg1,
-                        traffic)
-
-            elif operation == OP_REC_CACHE_HITMISS:
-                result_dict = self.recorder.get_result_summary()
-                data = copy.deepcopy(
-                    result_dict['general_accumulator'].get('Mapping_Cache', {}))
-                self.recorder.set_result_by_one_key(host_event.arg1,
-                        data)
+                # The queue hands out nothing after OP_BARRIER until
+                # barrier() ends, which waits for the requests taken
+                # before it.
+                yield self.env.process(self.ncq.barrier())
+                if host_event.barrier_done is not None:
+                    host_event.barrier_done.succeed()
+
+            elif operation == OP_LOAD_STATE:
+                # Like OP_BARRIER, the queue hands out nothing until the
+                # checkpoint is loaded and the clock is at its time.
+                yield self.env.process(self._load_state(host_event.arg1))
+                yield self.env.process(self.ncq.barrier())
 
             elif operation == OP_END_SSD_PROCESS:
                 self.ncq.slots.release(slot_req)
+                self.ncq.finish_request(host_event)
                 break
 
-            elif operation == OP_CLEAN:
-                print 'start cleaning'
-                yield self.env.process(self._cleaner_process(forced=True))
-
-            elif operation == OP_REC_BW:
-                dur = self.recorder.get_result_by_one_key('interest_workload_end') - \
-                        self.recorder.get_result_by_one_key('interest_workload_start')
-                self.recorder.set_result_by_one_key('workload_duration_nsec', dur)
-                self.recorder.set_result_by_one_key('workload_duration_sec', float(dur)/SEC)
-
-                write_traffic = self.recorder.get_general_accumulater_cnt(
-                        'traffic', 'write') / MB
-
-                self.recorder.set_result_by_one_key('workload_duration_nsec', dur)
-
-                if dur == 0:
-                    write_bw = "NA"
-                else:
-                    write_bw = float(write_traffic)/(float(dur) / SEC)
-
-                self.recorder.set_result_by_one_key('write_bandwidth', write_bw)
-                print '>>>>>>>>>> Bandwidth (MB/s) <<<<<<<<<<<', write_bw
-                print '>>>>>>>>>> Traffic (MB)     <<<<<<<<<<<', write_traffic
-                print '>>>>>>>>>> Duration (sec)   <<<<<<<<<<<', float(dur) / SEC
-
-            elif operation == OP_NON_MERGE_CLEAN:
-                print 'start non merge cleaning'
-                if self.conf['ftl_type'] == 'nkftl2':
-                    yield self.env.process(self.ftl.clean(forced=True, merge=False))
-
-            elif operation == OP_READ:
-                yield self.env.process(
-                    self.ftl.read_ext(host_event.get_lpn_extent(self.conf)))
-
-            elif  operation == OP_WRITE:
-                yield self.env.process(
-                    self.ftl.write_ext(host_event.get_lpn_extent(self.conf)))
-
-            elif  operation == OP_DISCARD:
-                yield self.env.process(
-                    self.ftl.discard_ext(host_event.get_lpn_extent(self.conf)))
-
-            elif operation in [OP_FALLOCATE]:
-                pass
-
             else:
-                raise NotImplementedError("Operation {} not supported."\
-                        .format(host_event.operation))
+                op_proc = self._ftl_op_process(host_event)
+                if op_proc is not None:
+                    yield self.env.process(op_proc)
+                if self._record_request_latency is True and \
+                        operation in self.HOST_OPS:
+                    self._record_latency(host_event, start_time, gc_mark)
 
             if req_i % 1000 == 0:
                 print '.',
@@ -247,6 +301,20 @@ class Ssd(SsdBase):
                 self.gc_sleep_timer = self.gc_sleep_duration
 
             self.ncq.slots.release(slot_req)
+            self.ncq.finish_request(host_event)
+
+    def _load_state(self, path):
+        """
+        Load the checkpoint in path and resume the simulated time at the
+        time it was saved, so that later requests and the timers of the
+        background processes see the same times as in the run that saved
+        it.
+        """
+        saved_now = checkpoint.load_ssd_state(self, path)
+        if saved_now < self.env.now:
+            raise RuntimeError("Cannot load checkpoint {} taken at {} at "
+                "time {}".format(path, saved_now, self.env.now))
+        yield self.env.timeout(saved_now - self.env.now)
 
     def _end_all_processes(self):
         for i in range(self.n_processes):
@@ -260,7 +328,10 @@ class Ssd(SsdBase):
     def _cleaner_process(self, forced=False):
         # things may have changed since last time we check, because of locks
         if forced is True or self.ftl.is_cleaning_needed():
+            self._n_gc_started += 1
+            self._n_gc_running += 1
             yield self.env.process(self.ftl.clean(forced))
+            self._n_gc_running -= 1
 
     def _wear_leveling_process(self):
         print 'wear leveling process start'
@@ -310,44 +381,6 @@ class Ssd(SsdBase):
         yield simpy.events.AllOf(self.env, procs)
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 class SSDFramework(object):
     """
     The interface of this FTL for the host is a queue (NCQ). The host puts
@@ -364,9 +397,11 @@ class SSDFramework(object):
         self.recorder = recorderobj
         self.env = simpy_env
 
+        # process() does not finish requests or wait on barriers
         self.ncq = NCQSingleQueue(
                 ncq_depth = self.conf['SSDFramework']['ncq_depth'],
-                simpy_env = self.env)
+                simpy_env = self.env,
+                drain_on_barrier = False)
 
         self.flash_controller = controller.Controller3(
                 self.env, self.conf, self.recorder)
@@ -400,6 +435,10 @@ class SSDFramework(object):
         event.token.release(event.token_req)
 
     def process(self, pid):
+        translation_timer = self.recorder.counter(
+                "translation_time-w_wait", pid)
+        flash_access_timer = self.recorder.counter(
+                "forground_flash_access_time-w_wait", pid)
         for req_index in itertools.count():
             host_event = yield self.ncq.queue.get()
 
@@ -425,16 +464,14 @@ class SSDFramework(object):
             flash_reqs = yield self.env.process(
                     self.realftl.translate(ssd_req, pid) )
             e = self.env.now
-            self.recorder.add_to_timer("translation_time-w_wait", pid,
-                    e - s)
+            translation_timer.add(e - s)
 
             # Access flash
             s = self.env.now
             yield self.env.process(
                     self.access_flash(flash_reqs))
             e = self.env.now
-            self.recorder.add_to_timer("forground_flash_access_time-w_wait", pid,
-                    e - s)
+            flash_access_timer.add(e - s)
 
             # Try clean garbage
             self.env.process(
@@ -466,7 +503,7 @@ class SSDFramework(object):
         if not os.path.exists(raw_blkparse_file_path):
             return
 
-        blkresult = blocktrace.BlktraceResult(
+        blkresult = blocktrace.BlktraceResultStream(
                 self.conf['sector_size'],
                 self.conf['event_file_column_names'],
                 raw_blkparse_file_path, None)
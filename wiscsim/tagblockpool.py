@@ -1,4 +1,5 @@
-from collections import Counter
+import heapq
+from collections import Counter, OrderedDict
 
 TFREE = 'TAGFREE'
 
@@ -6,28 +7,151 @@ LEAST_ERASED = 'least'
 MOST_ERASED = 'most'
 
 
+class ErasureCountIndex(object):
+    """
+    Blocks of one tag, indexed by erasure count.
+
+    Two heaps are kept so that both the least and the most erased block can
+    be found in O(log N). Ties are broken the same way as the old
+    Counter.most_common() scan: the least erased block with the largest
+    block number, and the most erased block with the smallest block number.
+
+    Entries are deleted lazily. An entry is valid only if the block is
+    still in the index with the same erasure count.
+    """
+    def __init__(self):
+        # {blocknum: erasure count}
+        self._members = {}
+        # (count, -blocknum)
+        self._least_heap = []
+        # (-count, blocknum)
+        self._most_heap = []
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, blocknum):
+        return blocknum in self._members
+
+    def add(self, blocknum, count):
+        self._members[blocknum] = count
+        heapq.heappush(self._least_heap, (count, -blocknum))
+        heapq.heappush(self._most_heap, (-count, blocknum))
+        self._compact_if_needed()
+
+    def remove(self, blocknum):
+        del self._members[blocknum]
+
+    def top(self, choice, nblocks):
+        if choice == LEAST_ERASED:
+            heap = self._least_heap
+            decode = self._decode_least
+        elif choice == MOST_ERASED:
+            heap = self._most_heap
+            decode = self._decode_most
+        else:
+            raise NotImplementedError
+
+        popped = []
+        blocks = []
+        while len(heap) > 0 and len(blocks) < nblocks:
+            entry = heapq.heappop(heap)
+            count, blocknum = decode(entry)
+            if self._members.get(blocknum, None) != count \
+                    or blocknum in blocks:
+                # stale or duplicated entry, drop it
+                continue
+            popped.append(entry)
+            blocks.append(blocknum)
+
+        for entry in popped:
+            heapq.heappush(heap, entry)
+
+        return blocks
+
+    def _decode_least(self, entry):
+        return entry[0], -entry[1]
+
+    def _decode_most(self, entry):
+        return -entry[0], entry[1]
+
+    def _compact_if_needed(self):
+        if len(self._least_heap) > 2 * len(self._members) + 64:
+            self._least_heap = [(cnt, -blk) for blk, cnt
+                    in self._members.items()]
+            heapq.heapify(self._least_heap)
+        if len(self._most_heap) > 2 * len(self._members) + 64:
+            self._most_heap = [(-cnt, blk) for blk, cnt
+                    in self._members.items()]
+            heapq.heapify(self._most_heap)
+
+
+class ErasureCounter(Counter):
+    """
+    Counter of {blocknum: erasure count} that keeps the erasure count
+    indexes of its pool up to date, however the count is changed.
+    """
+    def __init__(self, pool):
+        super(ErasureCounter, self).__init__()
+        self._pool = pool
+
+    def __setitem__(self, blocknum, count):
+        super(ErasureCounter, self).__setitem__(blocknum, count)
+        self._pool._erasure_count_changed(blocknum, count)
+
+    def __reduce__(self):
+        # The indexes are pickled with the pool, so the counts are restored
+        # without telling the pool (which may not be unpickled yet).
+        return (self.__class__, (self._pool,), dict(self))
+
+    def __setstate__(self, counts):
+        dict.update(self, counts)
+
+
 class TagBlockPool(object):
     def __init__(self, n, tags):
-        self._tag_subpool = {tag:[] for tag in tags}
-        self._tag_subpool[TFREE] = range(n)
+        # OrderedDict is used as an ordered set, so membership test and
+        # removal are O(1) while blocks keep their insertion order.
+        self._tag_subpool = {tag:OrderedDict() for tag in tags}
+        self._tag_subpool[TFREE] = OrderedDict.fromkeys(range(n))
+
+        # {blocknum: tag}
+        self._block_tag = {block:TFREE for block in range(n)}
+        # {tag: ErasureCountIndex}
+        self._erasure_index = {tag:ErasureCountIndex()
+                for tag in self._tag_subpool.keys()}
 
         # {blocknum: count}
-        self._erasure_cnt = Counter()
+        self._erasure_cnt = ErasureCounter(self)
         # have to put the block number in the counter
         # otherwise, if a free block is never used, it won't
         # appear in the counter.
         for block in range(n):
             self._erasure_cnt[block] = 0
 
+    def _erasure_count_changed(self, blocknum, count):
+        tag = self._block_tag.get(blocknum, None)
+        if tag is not None:
+            # re-adding replaces the old entry of blocknum
+            self._erasure_index[tag].add(blocknum, count)
+
     def get_blocks_of_tag(self, tag):
-        return self._tag_subpool[tag]
+        return self._tag_subpool[tag].keys()
+
+    def get_tag(self, blocknum):
+        return self._block_tag[blocknum]
 
     def change_tag(self, blocknum, src, dst):
-        self._tag_subpool[src].remove(blocknum)
-        self._tag_subpool[dst].append(blocknum)
+        del self._tag_subpool[src][blocknum]
+        self._tag_subpool[dst][blocknum] = None
 
+        self._erasure_index[src].remove(blocknum)
+        self._block_tag[blocknum] = dst
         if dst == TFREE:
+            # this also indexes blocknum under dst
             self._erasure_cnt[blocknum] += 1
+        else:
+            self._erasure_index[dst].add(blocknum, self._erasure_cnt[blocknum])
 
     def count_blocks(self, tag):
         return len(self._tag_subpool[tag])
@@ -60,24 +184,7 @@ class TagBlockPool(object):
             return None
 
     def get_least_or_most_erased_blocks(self, tag, choice, nblocks):
-        if choice == LEAST_ERASED:
-            blocks_by_cnt = reversed(self._erasure_cnt.most_common())
-        elif choice == MOST_ERASED:
-            blocks_by_cnt = self._erasure_cnt.most_common()
-        else:
-            raise NotImplementedError
-
-        tag_blocks = self.get_blocks_of_tag(tag)
-
-        # iterate from least used to most used
-        blocks = []
-        for blocknum, count in blocks_by_cnt:
-            if blocknum in tag_blocks:
-                blocks.append(blocknum)
-                if len(blocks) == nblocks:
-                    break
-
-        return blocks
+        return self._erasure_index[tag].top(choice, nblocks)
 
     def get_erasure_count_dist(self):
         return Counter(self._erasure_cnt.values())
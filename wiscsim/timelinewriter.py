@@ -0,0 +1,167 @@
+"""
+Buffered columnar timeline files.
+
+A columnar timeline file has a fixed schema: the column names are set by
+the first row and every row must have them. Rows are kept in preallocated
+column buffers and written in chunks of chunk_rows rows. The file is a
+sequence of pickles:
+
+    header: {'format': FORMAT_NAME, 'version': 1, 'colnames': [...]}
+    chunk:  {'n_rows': n, 'columns': [(typecode, data), ...]}
+
+A column of a chunk is stored as array.array bytes if all its values are
+ints ('l') or numbers ('d'). Otherwise the values are written as str(),
+like in the text timelines, and dictionary encoded: typecode is 'S' and
+data is (list of distinct strings, array.array('l') bytes of indexes).
+
+Use read_timeline() to load a file as NumPy arrays, or
+read_timeline_dataframe() to load it as a pandas DataFrame.
+"""
+import array
+import cPickle
+import collections
+import os
+
+FORMAT_NAME = 'wiscsim-columnar-timeline'
+FORMAT_VERSION = 1
+EXTENSION = '.cols'
+
+
+def columnar_filename(filename):
+    """
+    'timeline.txt' -> 'timeline.cols'
+    """
+    return os.path.splitext(filename)[0] + EXTENSION
+
+
+class ColumnarTimelineWriter(object):
+    def __init__(self, path, colnames, chunk_rows=65536):
+        self.path = path
+        self.colnames = list(colnames)
+        self.chunk_rows = chunk_rows
+
+        self._buffers = [[None] * chunk_rows for _ in self.colnames]
+        self._n_buffered = 0
+        self.n_rows = 0
+
+        self._file = open(path, 'wb')
+        cPickle.dump({'format': FORMAT_NAME,
+                      'version': FORMAT_VERSION,
+                      'colnames': self.colnames},
+                     self._file, cPickle.HIGHEST_PROTOCOL)
+
+    def append(self, row):
+        """
+        row is a dict with (at least) all the columns of the file.
+        """
+        i = self._n_buffered
+        for buf, colname in zip(self._buffers, self.colnames):
+            buf[i] = row[colname]
+
+        self._n_buffered = i + 1
+        if self._n_buffered == self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        n = self._n_buffered
+        if n == 0:
+            return
+
+        columns = [encode_column(buf[:n]) for buf in self._buffers]
+        cPickle.dump({'n_rows': n, 'columns': columns},
+                     self._file, cPickle.HIGHEST_PROTOCOL)
+        self.n_rows += n
+        self._n_buffered = 0
+
+    def close(self):
+        self.flush()
+        self._file.flush()
+        os.fsync(self._file)
+        self._file.close()
+
+
+def encode_column(values):
+    types = set(type(v) for v in values)
+    if types <= set([int]):
+        return ('l', array.array('l', values).tostring())
+    elif types <= set([int, long, float]):
+        return ('d', array.array('d', values).tostring())
+    else:
+        strings = {}
+        codes = array.array('l',
+                (strings.setdefault(str(v), len(strings)) for v in values))
+        distinct = sorted(strings, key=strings.get)
+        return ('S', (distinct, codes.tostring()))
+
+
+def decode_column(typecode, data):
+    if typecode == 'S':
+        distinct, code_bytes = data
+        codes = array.array('l')
+        codes.fromstring(code_bytes)
+        return [distinct[code] for code in codes]
+    else:
+        arr = array.array(typecode)
+        arr.fromstring(data)
+        return arr
+
+
+def _load_header(f, path):
+    header = cPickle.load(f)
+    if header.get('format') != FORMAT_NAME or \
+            header.get('version') != FORMAT_VERSION:
+        raise RuntimeError("{} is not a columnar timeline file of "
+                "version {}".format(path, FORMAT_VERSION))
+    return header
+
+
+def read_colnames(path):
+    with open(path, 'rb') as f:
+        return _load_header(f, path)['colnames']
+
+
+def iter_chunks(path):
+    """
+    Yield {colname: array.array or list} of each chunk, in column order.
+    """
+    with open(path, 'rb') as f:
+        colnames = _load_header(f, path)['colnames']
+        while True:
+            try:
+                chunk = cPickle.load(f)
+            except EOFError:
+                break
+            yield collections.OrderedDict(
+                (name, decode_column(*column))
+                for name, column in zip(colnames, chunk['columns']))
+
+
+def read_timeline(path):
+    """
+    Return {colname: numpy array} of a columnar timeline file, in column
+    order. Requires numpy.
+    """
+    import numpy as np
+
+    parts = collections.OrderedDict(
+            (name, []) for name in read_colnames(path))
+    for chunk in iter_chunks(path):
+        for name, values in chunk.items():
+            if isinstance(values, array.array):
+                parts[name].append(np.frombuffer(values, dtype=values.typecode))
+            else:
+                parts[name].append(np.array(values, dtype=object))
+
+    return collections.OrderedDict(
+            (name, np.concatenate(arrays) if len(arrays) > 0 else np.array([]))
+            for name, arrays in parts.items())
+
+
+def read_timeline_dataframe(path):
+    """
+    Return a pandas DataFrame of a columnar timeline file. Requires pandas.
+    """
+    import pandas as pd
+
+    columns = read_timeline(path)
+    return pd.DataFrame(columns, columns=columns.keys())
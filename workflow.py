@@ -6,6 +6,7 @@ from commons import *
 from utilities.utils import *
 import wiscsim
 from wiscsim.simulator import create_simulator
+from wiscsim import simprofiler
 import workrunner
 
 
@@ -63,6 +64,12 @@ class Workflow(object):
 
         simulator = create_simulator(self.conf['simulator_class'], self.conf,
                 event_iter )
-        simulator.run()
+
+        profiler = simprofiler.create_profiler(self.conf)
+        if profiler is None:
+            simulator.run()
+        else:
+            profiler.profile_run(simulator)
+            profiler.save(self.conf['result_dir'])
 
 
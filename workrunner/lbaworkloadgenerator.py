@@ -1,13 +1,17 @@
 import abc
+import os
 import random
 
 import config
 import workload
-from wiscsim import hostevent
+from wiscsim import checkpoint, hostevent
+from wiscsim.hostevent import BarrierGen
 from commons import *
 
 from pyreuse.general.zipf import ZipfGenerator
 
+DEFAULT_CHUNK_BATCH_SIZE = 2**16
+
 class LBAWorkloadGenerator(object):
     __metaclass__ = abc.ABCMeta
 
@@ -302,6 +306,17 @@ class AccessesWithDist(LBAWorkloadGenerator):
         self.space_size = self.conf['AccessesWithDist']['space_size']
         self.skew_factor = self.conf['AccessesWithDist']['skew_factor']
         self.zipf_alpha = self.conf['AccessesWithDist']['zipf_alpha']
+        # draw chunk ids in batches from numpy random states instead of one
+        # by one from the random module. The sequences differ from those of
+        # the random module. Requires numpy.
+        self.use_numpy = self.conf['AccessesWithDist'].get('use_numpy',
+                False)
+        # seed of the numpy random states. If it is None, a seed is drawn
+        # from the random module.
+        self.seed = self.conf['AccessesWithDist'].get('seed', None)
+        # number of chunk ids generated at a time
+        self.batch_size = self.conf['AccessesWithDist'].get('batch_size',
+                DEFAULT_CHUNK_BATCH_SIZE)
         self.lbabytes = self.conf['dev_size_mb'] * MB
 
 
@@ -331,65 +346,106 @@ class AccessesWithDist(LBAWorkloadGenerator):
                 self.distribution))
 
     def uniform_events(self):
-        chunk_size = self.chunk_size
-        traffic_size = self.traffic_size
-
-        n_chunks_in_traffic = traffic_size / chunk_size
-        n_chunks_in_space = self.space_size / chunk_size
+        for chunk_ids in self.uniform_chunk_ids():
+            for event in self.get_write_events(chunk_ids):
+                yield event
 
-        for i in range(n_chunks_in_traffic):
-            chunk_id = random.randint(0, n_chunks_in_space - 1)
-            yield self.get_write_event(chunk_id)
+    def hot_cold_space_event(self):
+        for chunk_ids in self.hot_cold_chunk_ids():
+            for event in self.get_write_events(chunk_ids):
+                yield event
 
+    def zipf_events(self):
+        for chunk_ids in self.zipf_chunk_ids():
+            for event in self.get_write_events(chunk_ids):
+                yield event
 
-    def hot_cold_space_event(self):
+    def uniform_chunk_ids(self):
         """
-        first half cold, second half hot
+        Yield batches of chunk ids, as numpy arrays with use_numpy,
+        otherwise as lists. Same for the other *_chunk_ids().
+        """
+        n_chunks_in_traffic = self.traffic_size / self.chunk_size
+        n_chunks_in_space = self.space_size / self.chunk_size
+
+        if self.use_numpy is False:
+            for start in range(0, n_chunks_in_traffic, self.batch_size):
+                n = min(self.batch_size, n_chunks_in_traffic - start)
+                yield [random.randint(0, n_chunks_in_space - 1)
+                        for i in range(n)]
+        else:
+            import numpy as np
+            seed = self.seed
+            if seed is None:
+                seed = random.getrandbits(32)
+            random_state = np.random.RandomState(seed)
+            for start in range(0, n_chunks_in_traffic, self.batch_size):
+                n = min(self.batch_size, n_chunks_in_traffic - start)
+                yield random_state.randint(0, n_chunks_in_space, size=n)
+
+    def hot_cold_chunk_ids(self):
         """
-        chunk_size = self.chunk_size
-        traffic_size = self.traffic_size
+        first half cold, second half hot
 
-        n_chunks_in_traffic = traffic_size / chunk_size
-        n_chunks_in_space = self.space_size / chunk_size
+        The cold half is written once, then the hot half skew_factor times,
+        repeatedly, until n_chunks_in_traffic + 1 chunks are written.
+        """
+        n_chunks_in_traffic = self.traffic_size / self.chunk_size
+        n_chunks_in_space = self.space_size / self.chunk_size
         n_chunks_in_half_space = int(n_chunks_in_space / 2)
+        n_chunks_to_write = n_chunks_in_traffic + 1
 
-        n_chunks_written = 0
-
-        finished = False
-        while finished is False:
-            for chunk_id in range(n_chunks_in_half_space):
-                yield self.get_write_event(chunk_id)
-                n_chunks_written += 1
-                if n_chunks_written > n_chunks_in_traffic:
-                    finished = True
-                    break
+        if self.use_numpy is False:
+            round_ids = range(n_chunks_in_half_space) + \
+                range(n_chunks_in_half_space, n_chunks_in_space) * \
+                self.skew_factor
+        else:
+            import numpy as np
+            round_ids = np.concatenate((
+                np.arange(n_chunks_in_half_space),
+                np.tile(np.arange(n_chunks_in_half_space, n_chunks_in_space),
+                    self.skew_factor)))
+        if len(round_ids) == 0:
+            return
+
+        for start in range(0, n_chunks_to_write, self.batch_size):
+            n = min(self.batch_size, n_chunks_to_write - start)
+            # the batch starts at this position of a round
+            pos = start % len(round_ids)
+            if self.use_numpy is False:
+                yield [round_ids[(pos + i) % len(round_ids)]
+                        for i in range(n)]
+            else:
+                yield np.take(round_ids, np.arange(pos, pos + n),
+                        mode='wrap')
 
-            if finished is True:
-                break
-
-            # write the second half.
-            for i in range(self.skew_factor):
-                for chunk_id in range(n_chunks_in_half_space, n_chunks_in_space):
-                    yield self.get_write_event(chunk_id)
-                    n_chunks_written += 1
-                    if n_chunks_written > n_chunks_in_traffic:
-                        finished = True
-                        break
-                if finished is True:
-                    break
+    def zipf_chunk_ids(self):
+        n_chunks_in_traffic = self.traffic_size / self.chunk_size
+        n_chunks_in_space = self.space_size / self.chunk_size
 
-    def zipf_events(self):
-        chunk_size = self.chunk_size
-        traffic_size = self.traffic_size
+        zipfgen = ZipfGenerator(n_chunks_in_space, self.zipf_alpha,
+                seed=self.seed, use_numpy=self.use_numpy)
 
-        n_chunks_in_traffic = traffic_size / chunk_size
-        n_chunks_in_space = self.space_size / chunk_size
+        for start in range(0, n_chunks_in_traffic, self.batch_size):
+            n = min(self.batch_size, n_chunks_in_traffic - start)
+            yield zipfgen.sample(n)
 
-        zipfgen = ZipfGenerator(n_chunks_in_space, self.zipf_alpha)
+    def get_write_events(self, chunk_ids):
+        """
+        Events are created one at a time, so only the chunk ids of a batch
+        are held in memory.
+        """
+        if self.use_numpy is False:
+            for chunk_id in chunk_ids:
+                yield self.get_write_event(chunk_id)
+            return
 
-        for i in range(n_chunks_in_traffic):
-            chunk_id = zipfgen.next()
-            yield self.get_write_event(chunk_id)
+        import numpy as np
+        sector_size = self.sector_size
+        size = self.chunk_size
+        for offset in (np.asarray(chunk_ids) * size).tolist():
+            yield hostevent.Event(sector_size=sector_size,
+                pid=0, operation=OP_WRITE, offset=offset, size=size)
 
     def get_write_event(self, chunk_id):
         offset = chunk_id * self.chunk_size
@@ -398,18 +454,6 @@ class AccessesWithDist(LBAWorkloadGenerator):
             pid=0, operation=OP_WRITE, offset=offset, size=size)
 
 
-class BarrierGen(object):
-    def __init__(self, n_ncq_slots):
-        self.n_ncq_slots = n_ncq_slots
-
-    def barrier_events(self):
-        for i in range(self.n_ncq_slots):
-            yield hostevent.ControlEvent(operation=OP_NOOP)
-        yield hostevent.ControlEvent(operation=OP_BARRIER)
-        for i in range(self.n_ncq_slots):
-            yield hostevent.ControlEvent(operation=OP_NOOP)
-
-
 class BlktraceEvents(LBAWorkloadGenerator):
     def __init__(self, confobj):
         if not isinstance(confobj, config.Config):
@@ -428,13 +472,26 @@ class BlktraceEvents(LBAWorkloadGenerator):
             self.stop_on_bytes = float('inf')
 
     def __iter__(self):
-        barriergen = BarrierGen(self.conf.ssd_ncq_depth())
+        barriergen = BarrierGen()
 
         yield hostevent.ControlEvent(operation=OP_DISABLE_RECORDER)
 
         # mkfs events
-        for event in self.prepfs_events():
-            yield event
+        snapshot_path = checkpoint.aging_snapshot_path(self.conf,
+                self.mkfs_event_path)
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            yield hostevent.ControlEvent(operation=OP_LOAD_STATE,
+                    arg1=snapshot_path)
+        else:
+            for event in self.prepfs_events():
+                yield event
+
+            if snapshot_path is not None:
+                # nothing may be in flight when the state is saved
+                for req in barriergen.barrier_events():
+                    yield req
+                yield hostevent.ControlEvent(operation=OP_SAVE_STATE,
+                        arg1=snapshot_path)
 
         # target workload event
         for event in self.target_workload_events():
@@ -449,23 +506,23 @@ class BlktraceEvents(LBAWorkloadGenerator):
         yield hostevent.ControlEvent(operation=OP_REC_BW)
 
     def prepfs_events(self):
-        prepfs_line_iter = hostevent.FileLineIterator(self.mkfs_event_path)
-        event_prepfs_iter = hostevent.EventIterator(self.conf, prepfs_line_iter)
+        event_prepfs_iter = hostevent.event_file_iterator(self.conf,
+                self.mkfs_event_path)
 
         for event in event_prepfs_iter:
             yield event
 
     def target_workload_events(self):
         # special event indicates the start of workload
-        barriergen = BarrierGen(self.conf.ssd_ncq_depth())
+        barriergen = BarrierGen()
         yield hostevent.ControlEvent(operation=OP_ENABLE_RECORDER)
         for req in barriergen.barrier_events():
             yield req
         yield hostevent.ControlEvent(operation=OP_REC_TIMESTAMP,
                 arg1='interest_workload_start')
 
-        workload_line_iter = hostevent.FileLineIterator(self.ftlsim_event_path)
-        event_workload_iter = hostevent.EventIterator(self.conf, workload_line_iter)
+        event_workload_iter = hostevent.event_file_iterator(self.conf,
+                self.ftlsim_event_path)
 
         total_rw_bytes = 0
         for event in event_workload_iter:
@@ -484,7 +541,7 @@ class BlktraceEvents(LBAWorkloadGenerator):
                 arg1='interest_workload_end')
 
     def gc_event(self):
-        barriergen = BarrierGen(self.conf.ssd_ncq_depth())
+        barriergen = BarrierGen()
         if self.conf['do_gc_after_workload'] is True:
             for req in barriergen.barrier_events():
                 yield req
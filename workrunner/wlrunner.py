@@ -10,24 +10,13 @@ import cpuhandler
 import filesystem
 import fshelper
 from wiscsim import hostevent
+from wiscsim.hostevent import BarrierGen
 from utilities import utils
 import workload
 
 from commons import *
 
 
-class BarrierGen(object):
-    def __init__(self, n_ncq_slots):
-        self.n_ncq_slots = n_ncq_slots
-
-    def barrier_events(self):
-        for i in range(self.n_ncq_slots):
-            yield hostevent.ControlEvent(operation=OP_NOOP)
-        yield hostevent.ControlEvent(operation=OP_BARRIER)
-        for i in range(self.n_ncq_slots):
-            yield hostevent.ControlEvent(operation=OP_NOOP)
-
-
 class WorkloadRunner(object):
     def __init__(self, confobj):
         if not isinstance(confobj, config.Config):
@@ -324,7 +313,7 @@ class WorkloadRunner(object):
         utils.table_to_file(extents_list, extent_path, width=0)
 
     def get_event_iterator(self):
-        barriergen = BarrierGen(self.conf.ssd_ncq_depth())
+        barriergen = BarrierGen()
 
         yield hostevent.ControlEvent(operation=OP_DISABLE_RECORDER)
 
@@ -354,7 +343,7 @@ class WorkloadRunner(object):
 
     def target_workload_events(self):
         # special event indicates the start of workload
-        barriergen = BarrierGen(self.conf.ssd_ncq_depth())
+        barriergen = BarrierGen()
         yield hostevent.ControlEvent(operation=OP_ENABLE_RECORDER)
         for req in barriergen.barrier_events():
             yield req
@@ -374,7 +363,7 @@ class WorkloadRunner(object):
                 arg1='interest_workload_end')
 
     def gc_event(self):
-        barriergen = BarrierGen(self.conf.ssd_ncq_depth())
+        barriergen = BarrierGen()
         if self.conf['do_gc_after_workload'] is True:
             for req in barriergen.barrier_events():
                 yield req